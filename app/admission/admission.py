@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from app.exceptions.exception import Overloaded
+from app.metrics.metrics import METRICS
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Weight of the latest request in the EWMA of the request duration, which the Retry-After estimate is based on
+EWMA_ALPHA: float = 0.2
+
+
+class AdmissionController:
+    """Bounds the number of requests an endpoint works on at once. Requests beyond the limit wait in a bounded queue, and are rejected with a 503 straight away if the queue is full, or once they have waited for longer than the queue timeout. Rejecting early keeps the latency of the admitted requests bounded instead of letting every request time out."""
+
+    def __init__(
+        self,
+        endpoint: str,
+        max_in_flight: int,
+        max_queue_depth: int,
+        queue_timeout_seconds: float,
+    ):
+        self._endpoint = endpoint
+        self._max_in_flight = max_in_flight
+        self._max_queue_depth = max_queue_depth
+        self._queue_timeout_seconds = queue_timeout_seconds
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._in_flight: int = 0
+        self._queue_length: int = 0
+        self._duration_ewma: Optional[float] = None
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        await self.acquire()
+        start: float = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(duration=time.monotonic() - start)
+
+    async def acquire(self) -> None:
+        """Raises Overloaded if the request is rejected. Every successful acquire must be followed by a release."""
+        # Counted from the controller's own state, as the semaphore is only updated once the waiting coroutines get to run
+        if self._in_flight + self._queue_length >= (
+            self._max_in_flight + self._max_queue_depth
+        ):
+            self._reject(reason="queue_full")
+
+        self._queue_length += 1
+        self._export_gauges()
+        start: float = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                self._semaphore.acquire(), timeout=self._queue_timeout_seconds
+            )
+        except TimeoutError:
+            self._reject(reason="queue_timeout")
+        finally:
+            self._queue_length -= 1
+            self._export_gauges()
+        METRICS.observe(
+            "admission_queue_wait_seconds",
+            time.monotonic() - start,
+            labels={"endpoint": self._endpoint},
+        )
+        self._in_flight += 1
+        self._export_gauges()
+
+    def release(self, duration: float) -> None:
+        self._in_flight -= 1
+        self._semaphore.release()
+        self._duration_ewma = (
+            duration
+            if self._duration_ewma is None
+            else EWMA_ALPHA * duration + (1 - EWMA_ALPHA) * self._duration_ewma
+        )
+        self._export_gauges()
+
+    def _reject(self, reason: str) -> None:
+        METRICS.increment(
+            "admission_rejections_total",
+            labels={"endpoint": self._endpoint, "reason": reason},
+        )
+        retry_after_seconds: int = self._get_retry_after_seconds()
+        log.warning(
+            f"Rejecting request to {self._endpoint} ({reason}), retry after {retry_after_seconds}s"
+        )
+        raise Overloaded(
+            message=f"Too many requests to {self._endpoint}, please retry later",
+            retry_after_seconds=retry_after_seconds,
+        )
+
+    def _get_retry_after_seconds(self) -> int:
+        # The time it takes for the requests that are in flight and queued to drain at the current request duration
+        if self._duration_ewma is None:
+            return math.ceil(self._queue_timeout_seconds)
+        backlog: int = self._in_flight + self._queue_length
+        return max(1, math.ceil(self._duration_ewma * backlog / self._max_in_flight))
+
+    def _export_gauges(self) -> None:
+        METRICS.set_gauge(
+            "admission_in_flight", self._in_flight, labels={"endpoint": self._endpoint}
+        )
+        METRICS.set_gauge(
+            "admission_queue_length",
+            self._queue_length,
+            labels={"endpoint": self._endpoint},
+        )
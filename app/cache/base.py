@@ -0,0 +1,46 @@
+from abc import ABC, abstractmethod
+from enum import StrEnum
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class CacheBackendType(StrEnum):
+    MEMORY = "memory"
+    SQLITE = "sqlite"
+
+
+class CacheStats(BaseModel):
+    # The hits, misses, sets and evictions are counted by this worker, while the entries and size are those of the whole cache
+    hits: int = 0
+    misses: int = 0
+    sets: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+
+class CacheBackend(ABC):
+    """Base class for the key-value caches of serialised values. Every value expires after its TTL, and the least recently used values are evicted once the cache outgrows its size limit, if it has one."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns None if the key is missing or expired."""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl_seconds: Optional[float] = None) -> None:
+        """Values without a TTL only leave the cache through eviction."""
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def stats(self) -> CacheStats:
+        pass
@@ -0,0 +1,35 @@
+from typing import Optional
+
+from app.cache.base import CacheBackend, CacheBackendType
+from app.cache.memory import MemoryCache
+from app.cache.sqlite import SqliteCache
+from app.config import CACHE_CONFIG, STATE_STORE_CONFIG, CacheConfig
+
+_cache: Optional[CacheBackend] = None
+_state_store: Optional[CacheBackend] = None
+
+
+def create_cache(config: CacheConfig) -> CacheBackend:
+    match config.backend:
+        case CacheBackendType.MEMORY:
+            return MemoryCache(max_size_bytes=config.max_size_bytes)
+        case CacheBackendType.SQLITE:
+            return SqliteCache(path=config.path, max_size_bytes=config.max_size_bytes)
+        case _:
+            raise ValueError(f"Unsupported cache backend: {config.backend}")
+
+
+def get_cache() -> CacheBackend:
+    """Returns the cache of this worker, which is only opened when it is first used."""
+    global _cache
+    if _cache is None:
+        _cache = create_cache(config=CACHE_CONFIG)
+    return _cache
+
+
+def get_state_store() -> CacheBackend:
+    """Returns the store of the use sessions and application drafts of this worker, which only drops entries once they expire. It is only opened when it is first used."""
+    global _state_store
+    if _state_store is None:
+        _state_store = create_cache(config=STATE_STORE_CONFIG)
+    return _state_store
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.cache.base import CacheBackend, CacheStats
+
+
+class MemoryCache(CacheBackend):
+    """Cache that lives in the memory of a single worker. Useful when there is only one worker, or no writable disk."""
+
+    def __init__(self, max_size_bytes: Optional[int]):
+        self._max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        # Ordered from the least to the most recently used
+        self._entries: OrderedDict[str, tuple[bytes, Optional[float]]] = OrderedDict()
+        self._size_bytes: int = 0
+        self._stats = CacheStats()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry: Optional[tuple[bytes, Optional[float]]] = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.time():
+                self._remove(key=key)
+                entry = None
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: bytes, ttl_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key=key)
+            self._entries[key] = (
+                value,
+                time.time() + ttl_seconds if ttl_seconds is not None else None,
+            )
+            self._size_bytes += len(value)
+            self._stats.sets += 1
+            while (
+                self._max_size_bytes is not None
+                and self._size_bytes > self._max_size_bytes
+                and self._entries
+            ):
+                self._remove(key=next(iter(self._entries)))
+                self._stats.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key=key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return self._stats.model_copy(
+                update={"entries": len(self._entries), "size_bytes": self._size_bytes}
+            )
+
+    def _remove(self, key: str) -> None:
+        value, _ = self._entries.pop(key)
+        self._size_bytes -= len(value)
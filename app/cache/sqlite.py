@@ -0,0 +1,181 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from app.cache.base import CacheBackend, CacheStats
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Seconds a connection waits for another worker's write lock before giving up
+BUSY_TIMEOUT_SECONDS: float = 5.0
+# The database is memory-mapped, so reads of hot entries do not copy pages through the page cache of every connection
+MMAP_SIZE_BYTES: int = 256 * 1024 * 1024
+# The access time of an entry is only rewritten once it is older than this, so that a hit on a hot entry does not take the write lock every time. The least recently used order is only this precise
+ACCESS_TIME_RESOLUTION_SECONDS: float = 60.0
+
+
+class SqliteCache(CacheBackend):
+    """Cache in a local SQLite database in WAL mode, which every worker on the host opens. Readers never block each other or the writer, so a value cached by one worker is served to the rest. Every thread has its own connection, as SQLite connections cannot be shared between threads."""
+
+    def __init__(self, path: str, max_size_bytes: Optional[int]):
+        self._path = path
+        self._max_size_bytes = max_size_bytes
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = CacheStats()
+        directory: str = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._get_connection() as connection:
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+            # Expired entries are removed on every set, which would otherwise scan the whole table
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)"
+            )
+            # The number and size of the entries are kept up to date by triggers, so that every worker sees the same totals without summing the whole table on every set
+            connection.execute(
+                """CREATE TABLE IF NOT EXISTS cache_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    entries INTEGER NOT NULL,
+                    size_bytes INTEGER NOT NULL
+                )"""
+            )
+            connection.execute(
+                """CREATE TRIGGER IF NOT EXISTS cache_totals_insert AFTER INSERT ON cache BEGIN
+                    UPDATE cache_totals SET entries = entries + 1, size_bytes = size_bytes + NEW.size_bytes;
+                END"""
+            )
+            connection.execute(
+                """CREATE TRIGGER IF NOT EXISTS cache_totals_delete AFTER DELETE ON cache BEGIN
+                    UPDATE cache_totals SET entries = entries - 1, size_bytes = size_bytes - OLD.size_bytes;
+                END"""
+            )
+            connection.execute(
+                """CREATE TRIGGER IF NOT EXISTS cache_totals_update AFTER UPDATE OF size_bytes ON cache BEGIN
+                    UPDATE cache_totals SET size_bytes = size_bytes - OLD.size_bytes + NEW.size_bytes;
+                END"""
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO cache_totals (id, entries, size_bytes) SELECT 0, COUNT(*), COALESCE(SUM(size_bytes), 0) FROM cache"
+            )
+
+    def get(self, key: str) -> Optional[bytes]:
+        now: float = time.time()
+        with self._get_connection() as connection:
+            row: Optional[tuple[bytes, Optional[float], float]] = connection.execute(
+                "SELECT value, expires_at, accessed_at FROM cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+                row = None
+            if row is not None and now - row[2] >= ACCESS_TIME_RESOLUTION_SECONDS:
+                connection.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+        self._count(hits=row is not None, misses=row is None)
+        return row[0] if row is not None else None
+
+    def set(self, key: str, value: bytes, ttl_seconds: Optional[float] = None) -> None:
+        now: float = time.time()
+        with self._get_connection() as connection:
+            # An upsert instead of INSERT OR REPLACE, as the rows that REPLACE deletes do not fire the delete trigger
+            connection.execute(
+                """INSERT INTO cache (key, value, size_bytes, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, size_bytes = excluded.size_bytes, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at""",
+                (
+                    key,
+                    value,
+                    len(value),
+                    now + ttl_seconds if ttl_seconds is not None else None,
+                    now,
+                ),
+            )
+            evictions: int = self._evict(connection=connection, now=now)
+        self._count(sets=True, evictions=evictions)
+
+    def delete(self, key: str) -> None:
+        with self._get_connection() as connection:
+            connection.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._get_connection() as connection:
+            connection.execute("DELETE FROM cache")
+
+    def stats(self) -> CacheStats:
+        entries, size_bytes = (
+            self._get_connection()
+            .execute("SELECT entries, size_bytes FROM cache_totals")
+            .fetchone()
+        )
+        with self._stats_lock:
+            return self._stats.model_copy(
+                update={"entries": entries, "size_bytes": size_bytes}
+            )
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> int:
+        """Removes the expired entries first, then the least recently used entries until the cache fits its size limit again."""
+        evictions: int = connection.execute(
+            "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (now,),
+        ).rowcount
+        if self._max_size_bytes is None:
+            return evictions
+        size_bytes: int = connection.execute(
+            "SELECT size_bytes FROM cache_totals"
+        ).fetchone()[0]
+        if size_bytes <= self._max_size_bytes:
+            return evictions
+
+        keys: list[str] = []
+        for key, entry_size_bytes in connection.execute(
+            "SELECT key, size_bytes FROM cache ORDER BY accessed_at"
+        ):
+            if size_bytes <= self._max_size_bytes:
+                break
+            keys.append(key)
+            size_bytes -= entry_size_bytes
+        connection.executemany(
+            "DELETE FROM cache WHERE key = ?", [(key,) for key in keys]
+        )
+        return evictions + len(keys)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        connection: Optional[sqlite3.Connection] = getattr(
+            self._local, "connection", None
+        )
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=BUSY_TIMEOUT_SECONDS)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+            self._local.connection = connection
+        return connection
+
+    def _count(
+        self,
+        hits: bool = False,
+        misses: bool = False,
+        sets: bool = False,
+        evictions: int = 0,
+    ) -> None:
+        with self._stats_lock:
+            self._stats.hits += hits
+            self._stats.misses += misses
+            self._stats.sets += sets
+            self._stats.evictions += evictions
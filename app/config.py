@@ -1,16 +1,43 @@
-from pydantic import BaseModel
+import os
+import tempfile
+from typing import Optional
 
+from dotenv import load_dotenv
+from pydantic import BaseModel, TypeAdapter
+
+# Loaded before any configuration is read from the environment
+load_dotenv()
+
+from app.cache.base import CacheBackendType
+from app.llm.cassette import CassetteMode
 from app.llm.model import LLMType
+from app.scheduler.scheduler import TenantConfig
 
 
 class InferenceConfig(BaseModel):
     """The main class describing the inference configuration."""
 
     llm_type: LLMType = LLMType.OPENAI_GPT4
+    # Interchangeable model variants for the stage, which are opt-in as the router does not weigh their quality. If any is configured, the messages of the stage are routed across llm_type and these variants by their live latency and error rates, failing over when one of them fails
+    fallback_llm_types: list[LLMType] = []
+    # Cheaper or faster model variants that are tried in order before llm_type. A response is only escalated to the next model if it fails validation against the schema, and is never escalated back to one of these through fallback_llm_types
+    cascade_llm_types: list[LLMType] = []
+    # The responses of the stage are kept in the shared cache for this long, so that the same message against the same applications is only sent to the LLM once across the workers. Responses are not cached if this is not set
+    cache_ttl_seconds: Optional[int] = None
+    # Only used by the selection stage. Once the applications have more tables than this in total, the applications are selected first from their summaries, before the tables of each relevant application are selected concurrently
+    hierarchical_selection_table_threshold: Optional[int] = None
+    # Only used by the selection stage. The groupings are streamed, and the HTTP request of every grouping is generated as soon as it is selected, so that the two stages overlap. Streamed groupings cannot be taken back once a cheaper model's response fails validation, so this is ignored if cascade_llm_types is set
+    pipeline_selection: bool = False
+    # Only used by the HTTP request stage. Once a POST instruction asks for at least this many rows, the rows are generated in chunks of bulk_insert_chunk_size rows by concurrent LLM calls instead of one long completion
+    bulk_insert_row_threshold: Optional[int] = None
+    bulk_insert_chunk_size: int = 25
 
 
 SELECTION_CONFIG = InferenceConfig(
     llm_type=LLMType.OPENAI_GPT4,
+    cascade_llm_types=[LLMType.OPENAI_GPT3_5],
+    cache_ttl_seconds=3600,
+    hierarchical_selection_table_threshold=15,
 )
 
 CLARIFICATION_CONFIG = InferenceConfig(
@@ -19,8 +46,199 @@ CLARIFICATION_CONFIG = InferenceConfig(
 
 HTTP_REQUEST_CONFIG = InferenceConfig(
     llm_type=LLMType.OPENAI_GPT4,
+    cascade_llm_types=[LLMType.OPENAI_GPT3_5],
+    cache_ttl_seconds=3600,
+    bulk_insert_row_threshold=50,
 )
 
 APPLICATION_CONFIG = InferenceConfig(
     llm_type=LLMType.OPENAI_GPT4,
 )
+
+
+class FastPathConfig(BaseModel):
+    """The main class describing the configuration of the rule-based fast path that bypasses the LLM for trivial instructions."""
+
+    enabled: bool = True
+    confidence_threshold: float = 0.8
+
+
+FAST_PATH_CONFIG = FastPathConfig(
+    enabled=True,
+    confidence_threshold=0.8,
+)
+
+
+class CacheConfig(BaseModel):
+    """The main class describing the configuration of the cache shared by the workers on the host."""
+
+    backend: CacheBackendType = CacheBackendType.SQLITE
+    # Only used by the SQLite backend. Every worker must open the same file
+    path: str = os.path.join(tempfile.gettempdir(), "whale_inference_cache.sqlite3")
+    # The least recently used entries are evicted once the cache outgrows this. Entries are only dropped once they expire if this is not set
+    max_size_bytes: Optional[int] = 64 * 1024 * 1024
+
+
+CACHE_CONFIG = CacheConfig(
+    backend=CacheBackendType(os.environ.get("CACHE_BACKEND", CacheBackendType.SQLITE)),
+    path=os.environ.get(
+        "CACHE_PATH",
+        os.path.join(tempfile.gettempdir(), "whale_inference_cache.sqlite3"),
+    ),
+    max_size_bytes=64 * 1024 * 1024,
+)
+
+# The use sessions and application drafts are kept apart from the cached LLM responses, as they cannot be regenerated and must not be evicted to make room for them. The store is a file on the host, so only the workers of one host share it: with several hosts, every turn of a session or draft has to be routed to the host that created it (e.g. by a load balancer that is sticky on the session or draft id)
+STATE_STORE_CONFIG = CacheConfig(
+    backend=CacheBackendType(
+        os.environ.get("STATE_STORE_BACKEND", CACHE_CONFIG.backend)
+    ),
+    path=os.environ.get(
+        "STATE_STORE_PATH",
+        os.path.join(tempfile.gettempdir(), "whale_inference_state.sqlite3"),
+    ),
+    max_size_bytes=None,
+)
+
+
+class SessionConfig(BaseModel):
+    """The main class describing the use sessions, which keep the chat history on the server so that clients only send the new message of every turn."""
+
+    # A session expires once it has not been used for this long. Sessions are kept in the state store, which does not evict them before then
+    ttl_seconds: int = 24 * 60 * 60
+    # Older messages are folded into the summary of the session
+    max_messages: int = 20
+    # The rows of every message but the latest are cut down to this many, as the LLM only needs to know what they looked like
+    max_rows_per_message: int = 5
+
+
+USE_SESSION_CONFIG = SessionConfig(
+    ttl_seconds=24 * 60 * 60,
+    max_messages=20,
+    max_rows_per_message=5,
+)
+
+
+class DraftConfig(BaseModel):
+    """The main class describing the application drafts of the create flow, which are kept on the server as versions so that clients do not send every schema back on every turn."""
+
+    # A draft expires once it has not been used for this long. Drafts are kept in the state store, which does not evict them before then
+    ttl_seconds: int = 24 * 60 * 60
+    # The oldest versions are dropped once a draft has more versions than this
+    max_versions: int = 50
+
+
+CREATE_DRAFT_CONFIG = DraftConfig(
+    ttl_seconds=24 * 60 * 60,
+    max_versions=50,
+)
+
+
+class CassetteConfig(BaseModel):
+    """The main class describing the configuration of the cassettes, which record the messages sent to the LLMs with their responses and replay them without any network calls."""
+
+    # The messages are neither recorded nor replayed if this is not set
+    mode: Optional[CassetteMode] = None
+    directory: str = "cassettes"
+
+
+CASSETTE_CONFIG = CassetteConfig(
+    mode=(
+        CassetteMode(os.environ["CASSETTE_MODE"])
+        if os.environ.get("CASSETTE_MODE")
+        else None
+    ),
+    directory=os.environ.get("CASSETTE_DIRECTORY", "cassettes"),
+)
+
+
+class AdmissionConfig(BaseModel):
+    """The main class describing the admission control of an endpoint in each worker."""
+
+    max_in_flight: int
+    max_queue_depth: int
+    # Queued requests are rejected after waiting this long, which bounds the latency of the admitted requests
+    queue_timeout_seconds: float
+
+
+USE_ADMISSION_CONFIG = AdmissionConfig(
+    max_in_flight=32,
+    max_queue_depth=64,
+    queue_timeout_seconds=10,
+)
+
+CREATE_ADMISSION_CONFIG = AdmissionConfig(
+    max_in_flight=16,
+    max_queue_depth=32,
+    queue_timeout_seconds=10,
+)
+
+
+class DeadlineConfig(BaseModel):
+    """The main class describing the deadlines of the requests, which bound the time spent on every stage of a request."""
+
+    # Used when the client does not supply a timeout
+    default_timeout_seconds: float
+    max_timeout_seconds: float
+    # Share of the request's remaining time given to selection. The rest of the time is split across the levels of the HTTP request fan-out
+    selection_fraction: float
+
+
+DEADLINE_CONFIG = DeadlineConfig(
+    default_timeout_seconds=60,
+    max_timeout_seconds=120,
+    selection_fraction=0.4,
+)
+
+
+class WarmupConfig(BaseModel):
+    """The main class describing the warmup of a worker, which it goes through before it reports that it is ready for traffic."""
+
+    enabled: bool = True
+    # The worker reports that it is ready once this has passed, even if the warmup is not done, so that a slow or unreachable backend cannot keep it out of the pool for good
+    timeout_seconds: float = 30
+    # Connections opened to the backend before the worker is ready
+    connection_count: int = 4
+    # Idle connections are used again this often, so that they are not closed by the keep-alive expiry of the pool
+    keepalive_interval_seconds: float = 20
+    # The tool schemas of this many of the most recently seen application sets are precompiled, across every worker on the host
+    max_recent_applications: int = 32
+    # A JSON file with a list of application sets whose tool schemas are always precompiled
+    applications_path: Optional[str] = None
+
+
+WARMUP_CONFIG = WarmupConfig(
+    enabled=os.environ.get("WARMUP_ENABLED", "true").lower() != "false",
+    timeout_seconds=30,
+    connection_count=4,
+    keepalive_interval_seconds=20,
+    max_recent_applications=32,
+    applications_path=os.environ.get("WARMUP_APPLICATIONS_PATH"),
+)
+
+
+class SchedulerConfig(BaseModel):
+    """The main class describing the scheduler that the LLM calls of a worker wait in, which shares the calls fairly between the tenants."""
+
+    enabled: bool = True
+    # LLM calls of every tenant in flight at once
+    max_in_flight: int = 64
+    # Applies to every tenant that is not listed in tenants
+    default_tenant: TenantConfig = TenantConfig()
+    tenants: dict[str, TenantConfig] = {}
+
+
+LLM_SCHEDULER_CONFIG = SchedulerConfig(
+    enabled=os.environ.get("SCHEDULER_ENABLED", "true").lower() != "false",
+    max_in_flight=64,
+    default_tenant=TenantConfig(
+        weight=1,
+        max_in_flight=16,
+        max_queue_depth=256,
+        calls_per_minute=None,
+    ),
+    # A JSON object of tenant configs keyed by the tenant id, e.g. {"acme": {"weight": 4, "max_in_flight": 32}}
+    tenants=TypeAdapter(dict[str, TenantConfig]).validate_json(
+        os.environ.get("SCHEDULER_TENANTS", "{}")
+    ),
+)
@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+from app.exceptions.exception import DeadlineExceeded
+from app.metrics.metrics import METRICS
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# The time.monotonic() at which the current request (or stage of the request) must be done. Tasks copy the context when they are created, so the deadline follows the request into every task it fans out to
+_expires_at: ContextVar[Optional[float]] = ContextVar("expires_at", default=None)
+
+
+@asynccontextmanager
+async def deadline(timeout_seconds: Optional[float], stage: str) -> AsyncIterator[None]:
+    """Bounds the work inside the block to timeout_seconds, or to the deadline of the enclosing block if that is sooner. The work is cancelled once the deadline passes, and DeadlineExceeded is raised in its place. A timeout of None only inherits the enclosing deadline."""
+    expires_at: Optional[float] = _expires_at.get()
+    if timeout_seconds is not None:
+        expires_at = min(
+            time.monotonic() + timeout_seconds,
+            expires_at if expires_at is not None else float("inf"),
+        )
+    token = _expires_at.set(expires_at)
+    try:
+        async with asyncio.timeout(
+            max(0.0, expires_at - time.monotonic()) if expires_at is not None else None
+        ):
+            yield
+    except TimeoutError:
+        METRICS.increment("deadline_exceeded_total", labels={"stage": stage})
+        log.error(f"Deadline exceeded at {stage} stage")
+        raise DeadlineExceeded(f"Deadline exceeded at {stage} stage")
+    finally:
+        _expires_at.reset(token)
+
+
+def get_remaining_seconds() -> Optional[float]:
+    """Returns None if there is no deadline."""
+    expires_at: Optional[float] = _expires_at.get()
+    if expires_at is None:
+        return None
+    return max(0.0, expires_at - time.monotonic())
+
+
+def get_share_of_remaining_seconds(fraction: float) -> Optional[float]:
+    remaining_seconds: Optional[float] = get_remaining_seconds()
+    if remaining_seconds is None:
+        return None
+    return remaining_seconds * fraction
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, TypeVar
+
+from fastapi import Request
+
+from app.exceptions.exception import ClientDisconnected
+from app.metrics.metrics import METRICS
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+async def cancel_on_disconnect(
+    request: Request, awaitable: Awaitable[T], endpoint: str
+) -> T:
+    """Runs the awaitable until it completes, or cancels it (and with it every task and provider request it is waiting on) as soon as the client disconnects, so that no work is spent on a response nobody will read."""
+    task: asyncio.Future[T] = asyncio.ensure_future(awaitable)
+    disconnect_task: asyncio.Task[None] = asyncio.create_task(
+        _wait_for_disconnect(request=request)
+    )
+    try:
+        await asyncio.wait({task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        disconnect_task.cancel()
+    if task.done():
+        return task.result()
+
+    task.cancel()
+    # The cancellation has to finish before the request returns, so that the admission slot is released
+    await asyncio.gather(task, return_exceptions=True)
+    METRICS.increment("client_disconnects_total", labels={"endpoint": endpoint})
+    log.warning(f"Client disconnected from {endpoint}, cancelled the request")
+    raise ClientDisconnected(f"Client disconnected from {endpoint}")
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # The body has already been read by the time the endpoint runs, so the only message left to receive is the disconnect
+    while True:
+        message: dict[str, Any] = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
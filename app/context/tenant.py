@@ -0,0 +1,41 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from app.models.application import ApplicationContent
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Set by the gateway to the customer the request is served for
+TENANT_HEADER: str = "X-Tenant-Id"
+# The LLM calls of requests that do not name their tenant (and are not about any application) share this tenant
+DEFAULT_TENANT_ID: str = "default"
+
+# The tenant the current request is served for. Tasks copy the context when they are created, so the tenant follows the request into every LLM call it fans out to
+_tenant_id: ContextVar[str] = ContextVar("tenant_id", default=DEFAULT_TENANT_ID)
+
+
+@contextmanager
+def tenant(tenant_id: str) -> Iterator[None]:
+    token = _tenant_id.set(tenant_id)
+    try:
+        yield
+    finally:
+        _tenant_id.reset(token)
+
+
+def get_tenant_id() -> str:
+    return _tenant_id.get()
+
+
+def resolve_tenant_id(
+    header: Optional[str], applications: Optional[list[ApplicationContent]] = None
+) -> str:
+    """The tenant named by the client, or else the applications the request is about, so that a heavy application cannot starve the others even when the gateway does not name the tenant."""
+    if header and header.strip():
+        return header.strip()
+    if applications:
+        return ",".join(sorted(application.name for application in applications))
+    return DEFAULT_TENANT_ID
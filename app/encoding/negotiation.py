@@ -0,0 +1,127 @@
+import logging
+from typing import Any, Callable, Coroutine, Optional
+
+import msgpack
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from app.metrics.metrics import METRICS
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+MESSAGEPACK_MEDIA_TYPE: str = "application/msgpack"
+# Clients written before application/msgpack was registered still send the older names
+MESSAGEPACK_MEDIA_TYPES: set[str] = {
+    MESSAGEPACK_MEDIA_TYPE,
+    "application/x-msgpack",
+    "application/vnd.msgpack",
+}
+JSON_MEDIA_TYPES: set[str] = {"application/json", "application/*", "*/*"}
+
+
+class MessagePackRequest(Request):
+    """A request with a MessagePack body, which FastAPI reads as if it were JSON. The body is unpacked straight into the Python objects that the pydantic models are validated from, without going through JSON text."""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = msgpack.unpackb(await self.body())
+        return self._json
+
+
+class MessagePackResponse(Response):
+    media_type = MESSAGEPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content)
+
+
+class NegotiatedRoute(APIRoute):
+    """Accepts MessagePack request bodies besides JSON ones, depending on their Content-Type. The endpoints pick the encoding of their response with create_response."""
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        route_handler: Callable[[Request], Coroutine[Any, Any, Response]] = (
+            super().get_route_handler()
+        )
+
+        async def negotiated_route_handler(request: Request) -> Response:
+            if _get_media_type(request.headers.get("content-type")) in (
+                MESSAGEPACK_MEDIA_TYPES
+            ):
+                METRICS.increment(
+                    "encoded_bodies_total",
+                    labels={"direction": "request", "encoding": "msgpack"},
+                )
+                # FastAPI only hands the body to the models if it is declared as JSON, which MessagePackRequest.json then decodes
+                request = MessagePackRequest(
+                    scope=_with_json_content_type(scope=request.scope),
+                    receive=request.receive,
+                )
+            return await route_handler(request)
+
+        return negotiated_route_handler
+
+
+def create_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """Encodes the content as MessagePack if the client prefers it over JSON according to its Accept header, and as JSON otherwise."""
+    if _prefers_messagepack(accept=request.headers.get("accept")):
+        METRICS.increment(
+            "encoded_bodies_total",
+            labels={"direction": "response", "encoding": "msgpack"},
+        )
+        response: Response = MessagePackResponse(
+            status_code=status_code, content=content
+        )
+    else:
+        METRICS.increment(
+            "encoded_bodies_total", labels={"direction": "response", "encoding": "json"}
+        )
+        response = JSONResponse(status_code=status_code, content=content)
+    # Caches in front of the service must not serve a response in one encoding to a client that asked for the other
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+def _prefers_messagepack(accept: Optional[str]) -> bool:
+    # Ties go to the media range listed first, and a missing Accept header means JSON
+    if not accept:
+        return False
+    messagepack_preference: tuple[float, int] = (0.0, 0)
+    json_preference: tuple[float, int] = (0.0, 0)
+    for index, media_range in enumerate(accept.split(",")):
+        media_type, _, parameters = media_range.partition(";")
+        media_type = media_type.strip().lower()
+        preference: tuple[float, int] = (_get_quality(parameters=parameters), -index)
+        if media_type in MESSAGEPACK_MEDIA_TYPES:
+            messagepack_preference = max(messagepack_preference, preference)
+        elif media_type in JSON_MEDIA_TYPES:
+            json_preference = max(json_preference, preference)
+    return messagepack_preference[0] > 0 and messagepack_preference > json_preference
+
+
+def _get_quality(parameters: str) -> float:
+    for parameter in parameters.split(";"):
+        name, _, value = parameter.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def _get_media_type(content_type: Optional[str]) -> Optional[str]:
+    if content_type is None:
+        return None
+    return content_type.partition(";")[0].strip().lower()
+
+
+def _with_json_content_type(scope: dict[str, Any]) -> dict[str, Any]:
+    return {
+        **scope,
+        "headers": [
+            (name, value) for name, value in scope["headers"] if name != b"content-type"
+        ]
+        + [(b"content-type", b"application/json")],
+    }
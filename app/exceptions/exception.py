@@ -13,3 +13,46 @@ class InferenceFailure(HTTPException):
         super().__init__(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=message
         )
+
+
+class ProviderFailure(InferenceFailure):
+    """An inference failure caused by the provider (e.g. a connection error, a timeout or a rate limit) instead of the request, so another backend may still succeed."""
+
+
+class Overloaded(HTTPException):
+    def __init__(self, message: str, retry_after_seconds: int):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=message,
+            headers={"Retry-After": str(retry_after_seconds)},
+        )
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self, message: str):
+        super().__init__(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=message)
+
+
+class ClientDisconnected(HTTPException):
+    def __init__(self, message: str):
+        # 499 is the de facto status of a request that the client closed before the response
+        super().__init__(status_code=499, detail=message)
+
+
+class SessionNotFound(HTTPException):
+    def __init__(self, message: str):
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=message)
+
+
+class DraftNotFound(HTTPException):
+    def __init__(self, message: str):
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=message)
+
+
+class QuotaExceeded(HTTPException):
+    def __init__(self, message: str, retry_after_seconds: int):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=message,
+            headers={"Retry-After": str(retry_after_seconds)},
+        )
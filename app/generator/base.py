@@ -2,9 +2,12 @@ import logging
 from abc import ABC, abstractmethod
 from typing import Any
 
-from app.config import InferenceConfig
+from app.cache.factory import get_cache
+from app.config import CASSETTE_CONFIG, LLM_SCHEDULER_CONFIG, InferenceConfig
 from app.llm.base import LLMBaseModel
+from app.llm.cassette import CassetteStore
 from app.llm.model import LLM, LLMType
+from app.scheduler.factory import get_llm_scheduler
 
 log = logging.getLogger(__name__)
 
@@ -17,7 +20,20 @@ class Generator(ABC):
 
     def __init__(self, config: InferenceConfig):
         self._llm_type = config.llm_type
-        self._model = LLM(model_type=self._llm_type).model
+        self._model = LLM(
+            model_type=self._llm_type,
+            fallback_model_types=config.fallback_llm_types,
+            cascade_model_types=config.cascade_llm_types,
+            cache=get_cache() if config.cache_ttl_seconds else None,
+            cache_ttl_seconds=config.cache_ttl_seconds,
+            cassette_store=(
+                CassetteStore(directory=CASSETTE_CONFIG.directory)
+                if CASSETTE_CONFIG.mode
+                else None
+            ),
+            cassette_mode=CASSETTE_CONFIG.mode,
+            scheduler=get_llm_scheduler() if LLM_SCHEDULER_CONFIG.enabled else None,
+        ).model
         self._max_tokens = self._model.model_config.max_tokens
 
     @abstractmethod
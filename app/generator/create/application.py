@@ -1,15 +1,21 @@
 import logging
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-from app.exceptions.exception import InferenceFailure
+from app.exceptions.exception import DraftNotFound, InferenceFailure
 from app.generator.base import Generator
 from app.llm.model import LLMType
 from app.models.application import ApplicationContent
-from app.models.inference.create import CreateInferenceResponse, CreateMessage
+from app.models.inference.create import (
+    ApplicationDraft,
+    CreateInferenceResponse,
+    CreateMessage,
+    CreateStreamEvent,
+)
 from app.prompts.create.application.open_ai import (
     generate_openai_application_system_message,
     generate_openai_application_user_message,
 )
+from app.session.draft import get_draft_version, get_latest_version
 
 log = logging.getLogger(__name__)
 
@@ -25,32 +31,53 @@ class ApplicationGenerator(Generator):
                 raise ValueError(f"Unsupported LLM type: {self._llm_type})")
 
     def generate_user_message(
-        self, message: str, chat_history: list[CreateMessage]
+        self,
+        message: str,
+        chat_history: list[CreateMessage],
+        last_draft_version: Optional[int],
+        last_application_draft: Optional[ApplicationContent],
     ) -> str:
         match self._llm_type:
             case LLMType.OPENAI_GPT4:
                 return generate_openai_application_user_message(
-                    message=message, chat_history=chat_history
+                    message=message,
+                    chat_history=chat_history,
+                    last_draft_version=last_draft_version,
+                    last_application_draft=last_application_draft,
                 )
             case LLMType.OPENAI_GPT3_5:
                 return generate_openai_application_user_message(
-                    message=message, chat_history=chat_history
+                    message=message,
+                    chat_history=chat_history,
+                    last_draft_version=last_draft_version,
+                    last_application_draft=last_application_draft,
                 )
             case _:
                 raise ValueError(f"Unsupported LLM type: {self._llm_type})")
 
     async def generate(
-        self, message: str, chat_history: list[CreateMessage]
+        self,
+        message: str,
+        chat_history: list[CreateMessage],
+        draft: Optional[ApplicationDraft] = None,
     ) -> CreateInferenceResponse:
+        """The last application draft is the latest version of the draft if anything was committed to it, or the application_content of the last message otherwise."""
+        last_draft_version, last_application_draft = _get_last_application_draft(
+            chat_history=chat_history, draft=draft
+        )
         system_message: str = self.generate_system_message()
         user_message = self.generate_user_message(
-            message=message, chat_history=chat_history
+            message=message,
+            chat_history=_inline_draft_versions(
+                chat_history=chat_history,
+                draft=draft,
+                last_draft_version=last_draft_version,
+            ),
+            last_draft_version=last_draft_version,
+            last_application_draft=last_application_draft,
         )
 
         try:
-            last_application_draft: Optional[ApplicationContent] = None
-            if chat_history:
-                last_application_draft = chat_history[-1].application_content
             response: CreateInferenceResponse = (
                 await self._model.send_application_message(
                     system_message=system_message,
@@ -65,3 +92,85 @@ class ApplicationGenerator(Generator):
         except Exception as e:
             log.error(f"Error in generating response: {e}")
             raise e
+
+    async def stream(
+        self,
+        message: str,
+        chat_history: list[CreateMessage],
+        draft: Optional[ApplicationDraft] = None,
+    ) -> AsyncIterator[CreateStreamEvent]:
+        last_draft_version, last_application_draft = _get_last_application_draft(
+            chat_history=chat_history, draft=draft
+        )
+        system_message: str = self.generate_system_message()
+        user_message = self.generate_user_message(
+            message=message,
+            chat_history=_inline_draft_versions(
+                chat_history=chat_history,
+                draft=draft,
+                last_draft_version=last_draft_version,
+            ),
+            last_draft_version=last_draft_version,
+            last_application_draft=last_application_draft,
+        )
+
+        try:
+            async for event in self._model.stream_application_message(
+                system_message=system_message,
+                user_message=user_message,
+                last_application_draft=last_application_draft,
+            ):
+                yield event
+        except InferenceFailure as e:
+            log.error(f"Inference failure at application streaming step: {e}")
+            raise e
+        except Exception as e:
+            log.error(f"Error in streaming response: {e}")
+            raise e
+
+
+def _get_last_application_draft(
+    chat_history: list[CreateMessage], draft: Optional[ApplicationDraft]
+) -> tuple[Optional[int], Optional[ApplicationContent]]:
+    last_draft_version: Optional[int] = (
+        get_latest_version(draft=draft) if draft is not None else None
+    )
+    if last_draft_version is not None:
+        return last_draft_version, get_draft_version(
+            draft=draft, version=last_draft_version
+        )
+    # A draft that nothing was committed to yet does not replace the application of the chat history
+    if chat_history:
+        return None, chat_history[-1].application_content
+    return None, None
+
+
+def _inline_draft_versions(
+    chat_history: list[CreateMessage],
+    draft: Optional[ApplicationDraft],
+    last_draft_version: Optional[int],
+) -> list[CreateMessage]:
+    """Only the latest version of the draft is sent once for the whole chat history, so a message that refers to an earlier version has that version inlined instead. A version that the draft no longer keeps is left as a reference."""
+    if draft is None:
+        return chat_history
+    inlined_chat_history: list[CreateMessage] = []
+    for message in chat_history:
+        if (
+            message.draft_version is not None
+            and message.draft_version != last_draft_version
+            and message.application_content is None
+        ):
+            try:
+                message = message.model_copy(
+                    update={
+                        "application_content": get_draft_version(
+                            draft=draft, version=message.draft_version
+                        )
+                    }
+                )
+            except DraftNotFound:
+                log.warning(
+                    f"Version {message.draft_version} of application draft {draft.draft_id} is no longer kept"
+                )
+        inlined_chat_history.append(message)
+    return inlined_chat_history
@@ -6,6 +6,7 @@ from app.llm.model import LLMType
 from app.models.application import ApplicationContent
 from app.models.inference.use import UseMessage
 from app.prompts.use.clarification.open_ai import (
+    generate_openai_clarification_context_message,
     generate_openai_clarification_system_message,
     generate_openai_clarification_user_message,
 )
@@ -23,22 +24,32 @@ class ClarificationGenerator(Generator):
             case _:
                 raise ValueError(f"Unsupported LLM type: {self._llm_type})")
 
+    def generate_context_message(self, applications: list[ApplicationContent]) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_clarification_context_message(
+                    applications=applications
+                )
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_clarification_context_message(
+                    applications=applications
+                )
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
     def generate_user_message(
         self,
-        applications: list[ApplicationContent],
         message: str,
         chat_history: list[UseMessage],
     ) -> str:
         match self._llm_type:
             case LLMType.OPENAI_GPT4:
                 return generate_openai_clarification_user_message(
-                    applications=applications,
                     message=message,
                     chat_history=chat_history,
                 )
             case LLMType.OPENAI_GPT3_5:
                 return generate_openai_clarification_user_message(
-                    applications=applications,
                     message=message,
                     chat_history=chat_history,
                 )
@@ -52,13 +63,15 @@ class ClarificationGenerator(Generator):
         chat_history: list[UseMessage],
     ) -> str:
         system_message: str = self.generate_system_message()
+        context_message: str = self.generate_context_message(applications=applications)
         user_message = self.generate_user_message(
-            applications=applications, message=message, chat_history=chat_history
+            message=message, chat_history=chat_history
         )
 
         try:
             response: str = await self._model.send_clarification_message(
                 system_message=system_message,
+                context_message=context_message,
                 user_message=user_message,
             )
             return response
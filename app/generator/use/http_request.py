@@ -1,26 +1,88 @@
 import asyncio
+import contextvars
 import logging
+import re
+import time
+from typing import Any, AsyncIterator, Optional
 
+from app.config import InferenceConfig
+from app.context.deadline import deadline, get_share_of_remaining_seconds
+from app.exceptions.exception import InferenceFailure
 from app.generator.base import Generator
 from app.llm.model import LLMType
+from app.metrics.metrics import METRICS
 from app.models.application import ApplicationContent, Table
 from app.models.inference.use import (
+    BulkInsertSummary,
     HttpMethod,
     HttpMethodResponse,
     SelectedGrouping,
     SelectionResponse,
     UseMessage,
 )
+from app.processor.plan import build_execution_plan
 from app.prompts.use.http_request.open_ai import (
+    generate_openai_bulk_insert_chunk_message,
+    generate_openai_http_request_context_message,
     generate_openai_http_request_system_message,
     generate_openai_http_request_user_message,
 )
+from app.prompts.use.schema import canonicalize
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+ROW_NOUNS: set[str] = {"row", "record", "entry", "entries", "item"}
+# A number followed by one of these counts money, time or a measure instead of rows, e.g. "an expense of 500 dollars for grocery items"
+UNIT_WORDS: set[str] = {
+    "am",
+    "cent",
+    "cents",
+    "day",
+    "days",
+    "dollar",
+    "dollars",
+    "eur",
+    "euro",
+    "euros",
+    "gbp",
+    "hour",
+    "hours",
+    "kg",
+    "km",
+    "minute",
+    "minutes",
+    "month",
+    "months",
+    "percent",
+    "pm",
+    "pound",
+    "pounds",
+    "second",
+    "seconds",
+    "usd",
+    "week",
+    "weeks",
+    "year",
+    "years",
+    "yen",
+}
+# Lines that start with a bullet or a number, e.g. "- Buy milk" or "12. Buy milk"
+LIST_ITEM_PATTERN: re.Pattern = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+\S", re.MULTILINE)
+# The number of times the rows of one call are continued after being cut off by the output limit, before the request is failed
+MAX_ROW_CONTINUATIONS: int = 4
+
 
 class HttpRequestGenerator(Generator):
+
+    _bulk_insert_row_threshold: Optional[int]
+    _bulk_insert_chunk_size: int
+
+    def __init__(self, config: InferenceConfig):
+        super().__init__(config=config)
+        self._bulk_insert_row_threshold = config.bulk_insert_row_threshold
+        self._bulk_insert_chunk_size = config.bulk_insert_chunk_size
+
     def generate_system_message(self, http_method: HttpMethod) -> str:
         match self._llm_type:
             case LLMType.OPENAI_GPT4:
@@ -34,95 +96,487 @@ class HttpRequestGenerator(Generator):
             case _:
                 raise ValueError(f"Unsupported LLM type: {self._llm_type})")
 
-    def generate_user_message(
+    def generate_context_message(
         self,
         application_name: str,
         table: Table,
         http_method: HttpMethod,
-        message: str,
-        chat_history: list[UseMessage],
     ) -> str:
         match self._llm_type:
             case LLMType.OPENAI_GPT4:
-                return generate_openai_http_request_user_message(
+                return generate_openai_http_request_context_message(
                     application_name=application_name,
                     table=table,
                     http_method=http_method,
-                    message=message,
-                    chat_history=chat_history,
                 )
             case LLMType.OPENAI_GPT3_5:
-                return generate_openai_http_request_user_message(
+                return generate_openai_http_request_context_message(
                     application_name=application_name,
                     table=table,
                     http_method=http_method,
+                )
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
+    def generate_user_message(
+        self,
+        message: str,
+        chat_history: list[UseMessage],
+        prerequisites: list[HttpMethodResponse],
+    ) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_http_request_user_message(
                     message=message,
                     chat_history=chat_history,
+                    prerequisites=prerequisites,
+                )
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_http_request_user_message(
+                    message=message,
+                    chat_history=chat_history,
+                    prerequisites=prerequisites,
+                )
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
+    def generate_bulk_insert_chunk_message(
+        self, start: int, end: Optional[int], row_count: int
+    ) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_bulk_insert_chunk_message(
+                    start=start, end=end, row_count=row_count
+                )
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_bulk_insert_chunk_message(
+                    start=start, end=end, row_count=row_count
                 )
             case _:
                 raise ValueError(f"Unsupported LLM type: {self._llm_type})")
 
     async def generate(
         self,
-        applications: list[ApplicationContent],
+        applications: dict[tuple[str, str], ApplicationContent],
         message: str,
         chat_history: list[UseMessage],
         selection_response: SelectionResponse,
+        execution_plan: list[list[int]],
     ) -> list[HttpMethodResponse]:
+        """The applications are keyed by (application name, table name) and only hold the table of their key, so that every message carries the schema of its target table only."""
+        groupings: list[SelectedGrouping] = selection_response.relevant_groupings
 
-        async def process_grouping(grouping: SelectedGrouping) -> HttpMethodResponse:
-            application_name = grouping.application_name
-            table_name = grouping.table_name
-            http_method = grouping.http_method
+        responses: dict[int, HttpMethodResponse] = {}
 
-            log.info(
-                f"Application: {application_name}, Table: {table_name}, HTTP Method: {http_method}"
-            )
+        # Groupings within a level are independent so they run concurrently, while the levels themselves run in topological order so that dependent groupings can see the parameters generated for their prerequisites
+        for level_index, level in enumerate(execution_plan):
+            # Every remaining level gets the same share of the remaining time, and the groupings of a level share it as they run concurrently
+            async with deadline(
+                timeout_seconds=get_share_of_remaining_seconds(
+                    fraction=1 / (len(execution_plan) - level_index)
+                ),
+                stage="http_request",
+            ):
+                try:
+                    # The task group cancels the rest of the level as soon as one grouping fails, as the request is failed anyway
+                    async with asyncio.TaskGroup() as task_group:
+                        tasks: dict[int, asyncio.Task[HttpMethodResponse]] = {
+                            index: task_group.create_task(
+                                self._process_grouping(
+                                    applications=applications,
+                                    message=message,
+                                    chat_history=chat_history,
+                                    grouping=groupings[index],
+                                    prerequisites=[
+                                        responses[dependency]
+                                        for dependency in sorted(
+                                            groupings[index].depends_on
+                                        )
+                                        if dependency in responses
+                                    ],
+                                )
+                            )
+                            for index in level
+                        }
+                except ExceptionGroup as e:
+                    raise e.exceptions[0]
+            for index, task in tasks.items():
+                responses[index] = task.result()
 
-            application: ApplicationContent = next(
-                (app for app in applications if app.name == application_name)
-            )
-            table: Table = next(
-                (table for table in application.tables if table.name == table_name)
-            )
+        # Process results in the order of input
+        return [responses[index] for index in range(len(groupings))]
 
-            system_message: str = self.generate_system_message(http_method=http_method)
-            user_message = self.generate_user_message(
-                application_name=application_name,
-                table=table,
-                http_method=http_method,
+    async def generate_from_stream(
+        self,
+        applications: dict[tuple[str, str], ApplicationContent],
+        message: str,
+        chat_history: list[UseMessage],
+        groupings: AsyncIterator[SelectedGrouping],
+        selection_timeout_seconds: Optional[float],
+    ) -> tuple[list[SelectedGrouping], list[HttpMethodResponse]]:
+        """Generates the HTTP request of every grouping as soon as it is streamed, so that the HTTP requests overlap with the rest of the selection instead of waiting for all of it. A grouping still waits for the groupings it depends on, and one that depends on a grouping that was not streamed yet (directly or not) is only dispatched once the selection is complete. Returns the selected groupings along with their responses, in the order they were selected."""
+        selected_groupings: list[SelectedGrouping] = []
+        tasks: dict[int, asyncio.Task[HttpMethodResponse]] = {}
+        deferred_indices: set[int] = set()
+        # The HTTP requests run under the deadline of the request instead of the deadline of the selection stage they are dispatched from
+        context: contextvars.Context = contextvars.copy_context()
+
+        async def process_after_prerequisites(
+            index: int, dependencies: list[int]
+        ) -> HttpMethodResponse:
+            prerequisites: list[HttpMethodResponse] = [
+                await tasks[dependency] for dependency in dependencies
+            ]
+            return await self._process_grouping(
+                applications=applications,
                 message=message,
                 chat_history=chat_history,
+                grouping=selected_groupings[index],
+                prerequisites=prerequisites,
+            )
+
+        def dispatch(index: int, task_group: asyncio.TaskGroup) -> None:
+            tasks[index] = task_group.create_task(
+                process_after_prerequisites(
+                    index=index,
+                    dependencies=[
+                        dependency
+                        for dependency in sorted(selected_groupings[index].depends_on)
+                        if dependency in tasks
+                    ],
+                ),
+                context=context,
             )
 
-            try:
-                response: HttpMethodResponse = (
+        start: float = time.monotonic()
+        first_dispatched_at: Optional[float] = None
+        try:
+            # The task group cancels the rest of the requests (and the selection) as soon as one grouping fails, as the request is failed anyway
+            async with asyncio.TaskGroup() as task_group:
+                async with deadline(
+                    timeout_seconds=selection_timeout_seconds, stage="selection"
+                ):
+                    async for grouping in groupings:
+                        index: int = len(selected_groupings)
+                        selected_groupings.append(grouping)
+                        # A grouping can only be dispatched once every grouping it depends on was dispatched
+                        if any(
+                            dependency > index or dependency in deferred_indices
+                            for dependency in grouping.depends_on
+                        ):
+                            deferred_indices.add(index)
+                            continue
+                        dispatch(index=index, task_group=task_group)
+                        if first_dispatched_at is None:
+                            first_dispatched_at = time.monotonic()
+                selection_seconds: float = time.monotonic() - start
+                log.info(
+                    f"Selection streamed {len(selected_groupings)} groupings in {selection_seconds:.2f}s"
+                )
+                _record_pipeline_overlap(
+                    selection_seconds=selection_seconds,
+                    overlap_seconds=(
+                        start + selection_seconds - first_dispatched_at
+                        if first_dispatched_at is not None
+                        else 0.0
+                    ),
+                    streamed_count=len(selected_groupings) - len(deferred_indices),
+                    deferred_count=len(deferred_indices),
+                )
+
+                # Every grouping is known now, so the deferred groupings follow the execution plan (or the order they were selected in, if their dependencies form a cycle)
+                for level in build_execution_plan(groupings=selected_groupings):
+                    for index in level:
+                        if index in deferred_indices:
+                            dispatch(index=index, task_group=task_group)
+        except ExceptionGroup as e:
+            raise e.exceptions[0]
+
+        return selected_groupings, [
+            tasks[index].result() for index in range(len(selected_groupings))
+        ]
+
+    async def _process_grouping(
+        self,
+        applications: dict[tuple[str, str], ApplicationContent],
+        message: str,
+        chat_history: list[UseMessage],
+        grouping: SelectedGrouping,
+        prerequisites: list[HttpMethodResponse],
+    ) -> HttpMethodResponse:
+        application_name = grouping.application_name
+        table_name = grouping.table_name
+        http_method = grouping.http_method
+
+        log.info(
+            f"Application: {application_name}, Table: {table_name}, HTTP Method: {http_method}"
+        )
+
+        application: ApplicationContent = applications[(application_name, table_name)]
+        table: Table = application.tables[0]
+
+        system_message: str = self.generate_system_message(http_method=http_method)
+        context_message: str = self.generate_context_message(
+            application_name=application_name,
+            table=table,
+            http_method=http_method,
+        )
+        user_message = self.generate_user_message(
+            message=message,
+            chat_history=chat_history,
+            prerequisites=prerequisites,
+        )
+
+        row_count: Optional[int] = (
+            _estimate_row_count(message=message, table=table)
+            if http_method == HttpMethod.POST
+            else None
+        )
+        is_chunked: bool = (
+            row_count is not None
+            and self._bulk_insert_row_threshold is not None
+            and row_count >= self._bulk_insert_row_threshold
+        )
+        try:
+            if is_chunked:
+                responses: list[HttpMethodResponse] = await self._send_in_chunks(
+                    system_message=system_message,
+                    context_message=context_message,
+                    user_message=user_message,
+                    application=application,
+                    table=table,
+                    row_count=row_count,
+                )
+            elif http_method == HttpMethod.POST:
+                responses = await self._send_rows(
+                    system_message=system_message,
+                    context_message=context_message,
+                    user_message=user_message,
+                    application=application,
+                    table=table,
+                    start=1,
+                    end=None,
+                    row_count=row_count,
+                    is_chunked=False,
+                )
+            else:
+                responses = [
                     await self._model.send_http_request_message(
                         system_message=system_message,
+                        context_message=context_message,
                         user_message=user_message,
                         application=application,
                         http_method=http_method,
                         table=table,
                     )
+                ]
+            if http_method == HttpMethod.POST:
+                return _merge_inserted_rows(
+                    responses=responses, table=table, is_chunked=is_chunked
                 )
-                return response
-            except Exception as e:
-                log.error(f"Error in generating response: {e}")
-                raise e
+            return responses[0]
+        except Exception as e:
+            log.error(f"Error in generating response: {e}")
+            raise e
 
-        tasks = [
-            process_grouping(grouping)
-            for grouping in selection_response.relevant_groupings
-        ]
-        response_list: list[HttpMethodResponse] = []
+    async def _send_in_chunks(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        table: Table,
+        row_count: int,
+    ) -> list[HttpMethodResponse]:
+        """Every chunk generates its own range of rows concurrently, so a bulk insert takes about as long as its slowest chunk instead of one completion that might not even fit the output limit. The last range is left open, as the row count is only an estimate."""
+        starts: list[int] = list(range(1, row_count + 1, self._bulk_insert_chunk_size))
+        log.info(
+            f"Generating about {row_count} rows for {table.name} in {len(starts)} chunks"
+        )
+        METRICS.observe("bulk_insert_chunk_count", len(starts))
+        try:
+            # The task group cancels the other chunks as soon as one fails, as the request is failed anyway
+            async with asyncio.TaskGroup() as task_group:
+                tasks: list[asyncio.Task[list[HttpMethodResponse]]] = [
+                    task_group.create_task(
+                        self._send_rows(
+                            system_message=system_message,
+                            context_message=context_message,
+                            user_message=user_message,
+                            application=application,
+                            table=table,
+                            start=start,
+                            end=(
+                                start + self._bulk_insert_chunk_size - 1
+                                if index < len(starts) - 1
+                                else None
+                            ),
+                            row_count=row_count,
+                            is_chunked=True,
+                        )
+                    )
+                    for index, start in enumerate(starts)
+                ]
+        except ExceptionGroup as e:
+            raise e.exceptions[0]
+        return [response for task in tasks for response in task.result()]
 
-        # Use asyncio.gather to run all tasks concurrently
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+    async def _send_rows(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        table: Table,
+        start: int,
+        end: Optional[int],
+        row_count: int,
+        is_chunked: bool,
+    ) -> list[HttpMethodResponse]:
+        """Generates rows start to end (or onwards, if end is None) of a POST. Rows that were cut off by the output limit are generated by another call from the first missing row, so the caller never gets fewer rows than the LLM meant to insert. Raises an InferenceFailure if a call is cut off before its first row, or the rows are still cut off after MAX_ROW_CONTINUATIONS calls."""
+        responses: list[HttpMethodResponse] = []
+        next_start: int = start
+        while True:
+            response: HttpMethodResponse = await self._model.send_http_request_message(
+                system_message=system_message,
+                context_message=context_message,
+                user_message=(
+                    user_message
+                    + self.generate_bulk_insert_chunk_message(
+                        start=next_start, end=end, row_count=row_count
+                    )
+                    if is_chunked or responses
+                    else user_message
+                ),
+                application=application,
+                http_method=HttpMethod.POST,
+                table=table,
+            )
+            responses.append(response)
+            if not response.is_truncated:
+                return responses
 
-        # Process results in the order of input
-        for result in results:
-            if isinstance(result, Exception):
-                raise result
-            response_list.append(result)
+            generated_row_count: int = len(response.inserted_rows or [])
+            if generated_row_count == 0:
+                raise InferenceFailure(
+                    f"The rows for {table.name} were cut off before the first one was complete"
+                )
+            next_start += generated_row_count
+            if end is not None and next_start > end:
+                return responses
+            if len(responses) > MAX_ROW_CONTINUATIONS:
+                raise InferenceFailure(
+                    f"The rows for {table.name} were still cut off after {MAX_ROW_CONTINUATIONS} continuations"
+                )
+            METRICS.increment("bulk_insert_continuations_total")
+            log.warning(
+                f"The rows for {table.name} were cut off after {generated_row_count} rows, continuing from row {next_start}"
+            )
+
+
+def _record_pipeline_overlap(
+    selection_seconds: float,
+    overlap_seconds: float,
+    streamed_count: int,
+    deferred_count: int,
+) -> None:
+    """The overlap is the time between the first HTTP request being dispatched and the selection being complete, which is the latency that the pipeline saved compared to running the stages one after another."""
+    METRICS.observe("selection_pipeline_overlap_seconds", overlap_seconds)
+    if selection_seconds > 0:
+        METRICS.observe(
+            "selection_pipeline_overlap_fraction", overlap_seconds / selection_seconds
+        )
+    METRICS.increment(
+        "selection_pipeline_groupings_total",
+        streamed_count,
+        labels={"dispatch": "streamed"},
+    )
+    METRICS.increment(
+        "selection_pipeline_groupings_total",
+        deferred_count,
+        labels={"dispatch": "deferred"},
+    )
+    log.info(
+        f"Pipelined {streamed_count} groupings with the selection ({overlap_seconds:.2f}s overlap), {deferred_count} deferred until it was complete"
+    )
+
+
+def _estimate_row_count(message: str, table: Table) -> int:
+    """Estimates the number of rows a POST instruction asks for, either from a count that is directly followed by a row noun (e.g. "add 200 tasks" or "add 200 new tasks") or from the number of list items in the instruction. The estimate only decides how the rows are split across calls, so any number it is not sure about is ignored, e.g. "add an expense of 500 dollars for grocery items" or "finish 60 entries of my journal"."""
+    table_nouns: set[str] = {
+        table.name.split("_")[-1],
+        table.name.split("_")[-1].removesuffix("s"),
+    }
+    words: list[str] = re.findall(r"[a-z0-9_-]+", message.lower())
+    counts: list[int] = [
+        int(word)
+        for index, word in enumerate(words)
+        if word.isdigit()
+        and _counts_rows(
+            following_words=words[index + 1 : index + 4], table_nouns=table_nouns
+        )
+    ]
+    list_item_count: int = len(LIST_ITEM_PATTERN.findall(message))
+    return max(counts + [list_item_count, 1])
 
-        return response_list
+
+def _counts_rows(following_words: list[str], table_nouns: set[str]) -> bool:
+    # The noun comes straight after the number, or after a single adjective
+    for noun_index in (0, 1):
+        if noun_index >= len(following_words):
+            return False
+        word: str = following_words[noun_index]
+        if word in UNIT_WORDS:
+            return False
+        if word in table_nouns or word.removesuffix("s") in table_nouns:
+            return True
+        if word in ROW_NOUNS or word.removesuffix("s") in ROW_NOUNS:
+            # A generic noun followed by "of" counts something else, e.g. "60 entries of my journal"
+            return following_words[noun_index + 1 : noun_index + 2] != ["of"]
+    return False
+
+
+def _merge_inserted_rows(
+    responses: list[HttpMethodResponse], table: Table, is_chunked: bool
+) -> HttpMethodResponse:
+    """Concatenates the rows of the chunks in order, dropping every row that repeats the value of a unique column of an earlier row, as the insert would fail on it anyway. The responses of a POST that was not chunked are the continuations of its cut-off rows, which are merged the same way but are not a bulk insert."""
+    unique_column_names: list[str] = [
+        column.name for column in table.columns if column.unique
+    ]
+    seen_keys: set[tuple[str, str]] = set()
+    inserted_rows: list[dict[str, Any]] = []
+    duplicate_row_count: int = 0
+    for response in responses:
+        for row in response.inserted_rows or []:
+            keys: list[tuple[str, str]] = [
+                (column_name, canonicalize(row[column_name]))
+                for column_name in unique_column_names
+                if row.get(column_name) is not None
+            ]
+            if any(key in seen_keys for key in keys):
+                duplicate_row_count += 1
+                continue
+            seen_keys.update(keys)
+            inserted_rows.append(row)
+
+    if duplicate_row_count:
+        log.warning(
+            f"Dropped {duplicate_row_count} rows with duplicate unique values from the insert into {table.name}"
+        )
+        METRICS.increment("bulk_insert_duplicate_rows_total", duplicate_row_count)
+    return responses[0].model_copy(
+        update={
+            "inserted_rows": inserted_rows,
+            # The rows that were cut off were generated by the responses that follow
+            "is_truncated": False,
+            "bulk_insert": (
+                BulkInsertSummary(
+                    row_count=len(inserted_rows),
+                    chunk_count=len(responses),
+                    duplicate_row_count=duplicate_row_count,
+                )
+                if is_chunked
+                else None
+            ),
+        }
+    )
@@ -1,19 +1,45 @@
+import asyncio
 import logging
+from typing import AsyncIterator, Optional
 
+from app.config import InferenceConfig
 from app.exceptions.exception import InferenceFailure
 from app.generator.base import Generator
 from app.llm.model import LLMType
 from app.models.application import ApplicationContent
-from app.models.inference.use import SelectionResponse, UseMessage
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    SelectedApplicationGrouping,
+    SelectedGrouping,
+    SelectionResponse,
+    TableSelectionResponse,
+    UseMessage,
+)
 from app.prompts.use.selection.open_ai import (
+    generate_openai_application_selection_context_message,
+    generate_openai_application_selection_system_message,
+    generate_openai_application_selection_user_message,
+    generate_openai_selection_context_message,
     generate_openai_selection_system_message,
     generate_openai_selection_user_message,
+    generate_openai_table_selection_context_message,
+    generate_openai_table_selection_system_message,
+    generate_openai_table_selection_user_message,
 )
 
 log = logging.getLogger(__name__)
 
 
 class SelectionGenerator(Generator):
+
+    _hierarchical_selection_table_threshold: Optional[int]
+
+    def __init__(self, config: InferenceConfig):
+        super().__init__(config=config)
+        self._hierarchical_selection_table_threshold = (
+            config.hierarchical_selection_table_threshold
+        )
+
     def generate_system_message(self) -> str:
         match self._llm_type:
             case LLMType.OPENAI_GPT4:
@@ -23,22 +49,121 @@ class SelectionGenerator(Generator):
             case _:
                 raise ValueError(f"Unsupported LLM type: {self._llm_type})")
 
+    def generate_context_message(self, applications: list[ApplicationContent]) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_selection_context_message(
+                    applications=applications
+                )
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_selection_context_message(
+                    applications=applications
+                )
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
     def generate_user_message(
         self,
-        applications: list[ApplicationContent],
         message: str,
         chat_history: list[UseMessage],
     ) -> str:
         match self._llm_type:
             case LLMType.OPENAI_GPT4:
                 return generate_openai_selection_user_message(
-                    applications=applications,
                     message=message,
                     chat_history=chat_history,
                 )
             case LLMType.OPENAI_GPT3_5:
                 return generate_openai_selection_user_message(
-                    applications=applications,
+                    message=message,
+                    chat_history=chat_history,
+                )
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
+    def generate_application_selection_system_message(self) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_application_selection_system_message()
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_application_selection_system_message()
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
+    def generate_application_selection_context_message(
+        self, applications: list[ApplicationContent]
+    ) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_application_selection_context_message(
+                    applications=applications
+                )
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_application_selection_context_message(
+                    applications=applications
+                )
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
+    def generate_application_selection_user_message(
+        self,
+        message: str,
+        chat_history: list[UseMessage],
+    ) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_application_selection_user_message(
+                    message=message,
+                    chat_history=chat_history,
+                )
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_application_selection_user_message(
+                    message=message,
+                    chat_history=chat_history,
+                )
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
+    def generate_table_selection_system_message(self) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_table_selection_system_message()
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_table_selection_system_message()
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
+    def generate_table_selection_context_message(
+        self, application: ApplicationContent
+    ) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_table_selection_context_message(
+                    application=application
+                )
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_table_selection_context_message(
+                    application=application
+                )
+            case _:
+                raise ValueError(f"Unsupported LLM type: {self._llm_type})")
+
+    def generate_table_selection_user_message(
+        self,
+        groupings: dict[int, SelectedApplicationGrouping],
+        message: str,
+        chat_history: list[UseMessage],
+    ) -> str:
+        match self._llm_type:
+            case LLMType.OPENAI_GPT4:
+                return generate_openai_table_selection_user_message(
+                    groupings=groupings,
+                    message=message,
+                    chat_history=chat_history,
+                )
+            case LLMType.OPENAI_GPT3_5:
+                return generate_openai_table_selection_user_message(
+                    groupings=groupings,
                     message=message,
                     chat_history=chat_history,
                 )
@@ -51,14 +176,23 @@ class SelectionGenerator(Generator):
         message: str,
         chat_history: list[UseMessage],
     ) -> SelectionResponse:
+        if self._should_use_hierarchical_selection(applications=applications):
+            return await self._generate_hierarchically(
+                applications=applications,
+                message=message,
+                chat_history=chat_history,
+            )
+
         system_message: str = self.generate_system_message()
+        context_message: str = self.generate_context_message(applications=applications)
         user_message = self.generate_user_message(
-            applications=applications, message=message, chat_history=chat_history
+            message=message, chat_history=chat_history
         )
 
         try:
             response: SelectionResponse = await self._model.send_selection_message(
                 system_message=system_message,
+                context_message=context_message,
                 user_message=user_message,
                 applications=applications,
             )
@@ -69,3 +203,184 @@ class SelectionGenerator(Generator):
         except Exception as e:
             log.error(f"Error in generating response: {e}")
             raise e
+
+    async def stream(
+        self,
+        applications: list[ApplicationContent],
+        message: str,
+        chat_history: list[UseMessage],
+    ) -> AsyncIterator[SelectedGrouping]:
+        """Yields every grouping as soon as it is selected. A hierarchical selection only knows its groupings once the tables of every application are selected, so they are yielded together at the end."""
+        if self._should_use_hierarchical_selection(applications=applications):
+            response: SelectionResponse = await self._generate_hierarchically(
+                applications=applications,
+                message=message,
+                chat_history=chat_history,
+            )
+            for grouping in response.relevant_groupings or []:
+                yield grouping
+            return
+
+        system_message: str = self.generate_system_message()
+        context_message: str = self.generate_context_message(applications=applications)
+        user_message = self.generate_user_message(
+            message=message, chat_history=chat_history
+        )
+
+        try:
+            async for grouping in self._model.stream_selection_message(
+                system_message=system_message,
+                context_message=context_message,
+                user_message=user_message,
+                applications=applications,
+            ):
+                yield grouping
+        except InferenceFailure as e:
+            log.error(f"Inference failure at selection step: {e}")
+            raise e
+        except Exception as e:
+            log.error(f"Error in generating response: {e}")
+            raise e
+
+    def _should_use_hierarchical_selection(
+        self, applications: list[ApplicationContent]
+    ) -> bool:
+        if self._hierarchical_selection_table_threshold is None:
+            return False
+        table_count: int = sum(len(application.tables) for application in applications)
+        return table_count > self._hierarchical_selection_table_threshold
+
+    async def _generate_hierarchically(
+        self,
+        applications: list[ApplicationContent],
+        message: str,
+        chat_history: list[UseMessage],
+    ) -> SelectionResponse:
+        """Selects the (task, application, HTTP method) groupings from the application summaries first, before selecting the tables of every relevant application concurrently. Only the relevant applications have their full schema sent to the LLM."""
+        system_message: str = self.generate_application_selection_system_message()
+        context_message: str = self.generate_application_selection_context_message(
+            applications=applications
+        )
+        user_message = self.generate_application_selection_user_message(
+            message=message, chat_history=chat_history
+        )
+
+        try:
+            application_selection_response: ApplicationSelectionResponse = (
+                await self._model.send_application_selection_message(
+                    system_message=system_message,
+                    context_message=context_message,
+                    user_message=user_message,
+                    applications=applications,
+                )
+            )
+            application_groupings: list[SelectedApplicationGrouping] = (
+                application_selection_response.relevant_groupings or []
+            )
+            if not application_groupings:
+                return SelectionResponse(relevant_groupings=None)
+
+            groupings_by_application: dict[
+                str, dict[int, SelectedApplicationGrouping]
+            ] = {}
+            for index, grouping in enumerate(application_groupings):
+                groupings_by_application.setdefault(grouping.application_name, {})[
+                    index
+                ] = grouping
+
+            application_lookup: dict[str, ApplicationContent] = {
+                application.name: application for application in applications
+            }
+            table_system_message: str = self.generate_table_selection_system_message()
+            # The task group cancels the other table selections as soon as one fails, as the request is failed anyway
+            try:
+                async with asyncio.TaskGroup() as task_group:
+                    tasks: list[asyncio.Task[TableSelectionResponse]] = [
+                        task_group.create_task(
+                            self._model.send_table_selection_message(
+                                system_message=table_system_message,
+                                context_message=self.generate_table_selection_context_message(
+                                    application=application_lookup[application_name]
+                                ),
+                                user_message=self.generate_table_selection_user_message(
+                                    groupings=groupings,
+                                    message=message,
+                                    chat_history=chat_history,
+                                ),
+                                application=application_lookup[application_name],
+                                grouping_indices=list(groupings),
+                            )
+                        )
+                        for application_name, groupings in groupings_by_application.items()
+                    ]
+            except ExceptionGroup as e:
+                raise e.exceptions[0]
+            table_selection_responses: list[TableSelectionResponse] = [
+                task.result() for task in tasks
+            ]
+        except InferenceFailure as e:
+            log.error(f"Inference failure at selection step: {e}")
+            raise e
+        except Exception as e:
+            log.error(f"Error in generating response: {e}")
+            raise e
+
+        table_names_by_grouping: dict[int, list[str]] = {}
+        for groupings, table_selection_response in zip(
+            groupings_by_application.values(), table_selection_responses
+        ):
+            for selected_table in table_selection_response.selected_tables:
+                # The grouping index is not enum-constrained, so the LLM could pair a table with a task of another application. The cascade rejects such a selection, but a single model is taken at its word
+                if selected_table.grouping_index not in groupings:
+                    log.warning(
+                        f"Ignoring table {selected_table.table_name} selected for unknown task {selected_table.grouping_index}"
+                    )
+                    continue
+                table_names: list[str] = table_names_by_grouping.setdefault(
+                    selected_table.grouping_index, []
+                )
+                if selected_table.table_name not in table_names:
+                    table_names.append(selected_table.table_name)
+
+        return _merge_selections(
+            application_groupings=application_groupings,
+            table_names_by_grouping=table_names_by_grouping,
+        )
+
+
+def _merge_selections(
+    application_groupings: list[SelectedApplicationGrouping],
+    table_names_by_grouping: dict[int, list[str]],
+) -> SelectionResponse:
+    """A grouping of the first phase is expanded into one grouping per selected table, so the dependencies have to be remapped to the positions of the expanded groupings."""
+    expanded_indices: dict[int, list[int]] = {}
+    position: int = 0
+    for index in range(len(application_groupings)):
+        table_count: int = len(table_names_by_grouping.get(index, []))
+        # Dropping the task would also drop it from the tasks that depend on it, which would then run without the rows they need
+        if not table_count:
+            raise InferenceFailure(
+                f"No table selected for task: {application_groupings[index].task}"
+            )
+        expanded_indices[index] = list(range(position, position + table_count))
+        position += table_count
+
+    relevant_groupings: list[SelectedGrouping] = []
+    for index, grouping in enumerate(application_groupings):
+        depends_on: list[int] = [
+            expanded_index
+            for dependency in grouping.depends_on
+            for expanded_index in expanded_indices.get(dependency, [])
+        ]
+        for table_name in table_names_by_grouping.get(index, []):
+            relevant_groupings.append(
+                SelectedGrouping(
+                    task=grouping.task,
+                    application_name=grouping.application_name,
+                    table_name=table_name,
+                    http_method=grouping.http_method,
+                    depends_on=depends_on,
+                )
+            )
+
+    return SelectionResponse(relevant_groupings=relevant_groupings or None)
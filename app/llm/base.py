@@ -1,10 +1,19 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+from typing import AsyncIterator, Optional
 
 from pydantic import BaseModel
 
 from app.models.application import ApplicationContent, Table
-from app.models.inference.use import HttpMethod, HttpMethodResponse, SelectionResponse
+from app.models.inference.create import CreateInferenceResponse, CreateStreamEvent
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    HttpMethod,
+    HttpMethodResponse,
+    SelectedGrouping,
+    SelectionResponse,
+    TableSelectionResponse,
+)
 
 
 class LLMConfig(BaseModel):
@@ -32,6 +41,7 @@ class LLMBaseModel(ABC):
     async def send_http_request_message(
         self,
         system_message: str,
+        context_message: str,
         user_message: str,
         application: ApplicationContent,
         http_method: HttpMethod,
@@ -44,21 +54,81 @@ class LLMBaseModel(ABC):
     async def send_selection_message(
         self,
         system_message: str,
+        context_message: str,
         user_message: str,
         applications: list[ApplicationContent],
     ) -> SelectionResponse:
         """Sends a message to the AI and returns the response."""
         pass
 
+    @abstractmethod
+    async def send_application_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> ApplicationSelectionResponse:
+        """Sends a message to the AI and returns the response."""
+        pass
+
+    @abstractmethod
+    async def send_table_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        grouping_indices: list[int],
+    ) -> TableSelectionResponse:
+        """Sends a message to the AI and returns the response. The grouping indices are the tasks of the user message, which every selected table must belong to."""
+        pass
+
     @abstractmethod
     async def send_clarification_message(
         self,
         system_message: str,
+        context_message: str,
         user_message: str,
     ) -> str:
         """Sends a message to the AI and returns the response."""
         pass
 
+    @abstractmethod
+    async def send_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> CreateInferenceResponse:
+        """Sends a message to the AI and returns the response."""
+        pass
+
+    @abstractmethod
+    def stream_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> AsyncIterator[CreateStreamEvent]:
+        """Sends a message to the AI and streams the response as events while it is being generated."""
+        pass
+
+    @abstractmethod
+    def stream_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> AsyncIterator[SelectedGrouping]:
+        """Sends a message to the AI and streams every grouping of the response as soon as it is complete."""
+        pass
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
     @property
     def model_config(self) -> LLMConfig:
         return self._model_config
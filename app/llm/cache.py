@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Optional
+
+from pydantic import TypeAdapter
+from pydantic_core import to_jsonable_python
+
+from app.cache.base import CacheBackend
+from app.llm.base import LLMBaseModel
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent, Table
+from app.models.inference.create import CreateInferenceResponse, CreateStreamEvent
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    HttpMethod,
+    HttpMethodResponse,
+    SelectedGrouping,
+    SelectionResponse,
+    TableSelectionResponse,
+)
+from app.prompts.use.schema import canonicalize
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Bump this whenever the cached response models or prompts change, so that the stale entries are no longer read
+CACHE_KEY_VERSION: str = "1"
+
+
+class CachedModel(LLMBaseModel):
+    """Serves repeated messages from the shared cache."""
+
+    def __init__(self, model: LLMBaseModel, cache: CacheBackend, ttl_seconds: int):
+        super().__init__(model_name=model.model_name, model_config=model.model_config)
+        self._model = model
+        self._cache = cache
+        self._ttl_seconds = ttl_seconds
+
+    async def send_http_request_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        http_method: HttpMethod,
+        table: Table,
+    ) -> HttpMethodResponse:
+        return await self._get_or_send(
+            stage="http_request",
+            method_name="send_http_request_message",
+            response_type=HttpMethodResponse,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            http_method=http_method,
+            table=table,
+        )
+
+    async def send_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> SelectionResponse:
+        return await self._get_or_send(
+            stage="selection",
+            method_name="send_selection_message",
+            response_type=SelectionResponse,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_application_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> ApplicationSelectionResponse:
+        return await self._get_or_send(
+            stage="application_selection",
+            method_name="send_application_selection_message",
+            response_type=ApplicationSelectionResponse,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_table_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        grouping_indices: list[int],
+    ) -> TableSelectionResponse:
+        return await self._get_or_send(
+            stage="table_selection",
+            method_name="send_table_selection_message",
+            response_type=TableSelectionResponse,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            grouping_indices=grouping_indices,
+        )
+
+    async def send_clarification_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+    ) -> str:
+        return await self._get_or_send(
+            stage="clarification",
+            method_name="send_clarification_message",
+            response_type=str,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+        )
+
+    async def send_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> CreateInferenceResponse:
+        return await self._get_or_send(
+            stage="application",
+            method_name="send_application_message",
+            response_type=CreateInferenceResponse,
+            system_message=system_message,
+            user_message=user_message,
+            last_application_draft=last_application_draft,
+        )
+
+    def stream_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> AsyncIterator[CreateStreamEvent]:
+        # The point of streaming is to show the draft while it is being generated, so streams are not cached
+        return self._model.stream_application_message(
+            system_message=system_message,
+            user_message=user_message,
+            last_application_draft=last_application_draft,
+        )
+
+    async def stream_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> AsyncIterator[SelectedGrouping]:
+        """Shares its entries with send_selection_message, as the streamed groupings add up to the same response. A hit yields the cached groupings straight away."""
+        arguments: dict[str, Any] = {
+            "system_message": system_message,
+            "context_message": context_message,
+            "user_message": user_message,
+            "applications": applications,
+        }
+        key: str = self._get_key(
+            method_name="send_selection_message", arguments=arguments
+        )
+        adapter = TypeAdapter(SelectionResponse)
+        cached_response: Optional[SelectionResponse] = await self._read(
+            stage="selection", key=key, adapter=adapter
+        )
+        if cached_response is not None:
+            for grouping in cached_response.relevant_groupings or []:
+                yield grouping
+            return
+
+        groupings: list[SelectedGrouping] = []
+        async for grouping in self._model.stream_selection_message(**arguments):
+            groupings.append(grouping)
+            yield grouping
+        await self._write(
+            stage="selection",
+            key=key,
+            adapter=adapter,
+            response=SelectionResponse(relevant_groupings=groupings or None),
+        )
+
+    async def _get_or_send(
+        self, stage: str, method_name: str, response_type: type, **kwargs
+    ) -> Any:
+        key: str = self._get_key(method_name=method_name, arguments=kwargs)
+        adapter = TypeAdapter(response_type)
+        response: Any = await self._read(stage=stage, key=key, adapter=adapter)
+        if response is not None:
+            return response
+        response = await getattr(self._model, method_name)(**kwargs)
+        await self._write(stage=stage, key=key, adapter=adapter, response=response)
+        return response
+
+    def _get_key(self, method_name: str, arguments: dict[str, Any]) -> str:
+        message_key: str = get_message_key(
+            model_name=self._model_name, method_name=method_name, arguments=arguments
+        )
+        return f"llm:{CACHE_KEY_VERSION}:{message_key}"
+
+    async def _read(self, stage: str, key: str, adapter: TypeAdapter) -> Optional[Any]:
+        """Returns None on a miss."""
+        # The cache is only an optimisation, so a broken cache must not fail the request
+        try:
+            value: Optional[bytes] = await asyncio.to_thread(self._cache.get, key)
+        except Exception as e:
+            log.warning(f"Error reading {stage} response from cache: {e}")
+            value = None
+        if value is not None:
+            try:
+                response: Any = adapter.validate_json(value)
+                METRICS.increment(
+                    "llm_cache_requests_total",
+                    labels={"stage": stage, "result": "hit"},
+                )
+                return response
+            except Exception as e:
+                log.warning(f"Ignoring invalid cached {stage} response: {e}")
+
+        METRICS.increment(
+            "llm_cache_requests_total", labels={"stage": stage, "result": "miss"}
+        )
+        return None
+
+    async def _write(
+        self, stage: str, key: str, adapter: TypeAdapter, response: Any
+    ) -> None:
+        try:
+            await asyncio.to_thread(
+                self._cache.set, key, adapter.dump_json(response), self._ttl_seconds
+            )
+        except Exception as e:
+            log.warning(f"Error writing {stage} response to cache: {e}")
+
+
+def get_message_key(
+    model_name: str, method_name: str, arguments: dict[str, Any]
+) -> str:
+    """Hashes the model and every argument of a message, so that two messages share a key only if they send exactly the same prompt against exactly the same schema."""
+    content: str = canonicalize(
+        {
+            "model": model_name,
+            "method": method_name,
+            "arguments": to_jsonable_python(arguments),
+        }
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
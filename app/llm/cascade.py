@@ -0,0 +1,236 @@
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Optional
+
+from app.llm.base import LLMBaseModel
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent, Table
+from app.models.inference.create import CreateInferenceResponse, CreateStreamEvent
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    HttpMethod,
+    HttpMethodResponse,
+    SelectedGrouping,
+    SelectionResponse,
+    TableSelectionResponse,
+)
+from app.processor.validation import (
+    validate_application_response,
+    validate_application_selection_response,
+    validate_clarification_response,
+    validate_http_method_response,
+    validate_selection_response,
+    validate_table_selection_response,
+)
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class Cascade(LLMBaseModel):
+    """Sends every message to the cheapest tier first and only escalates to the next tier if the response fails validation against the schema (or the tier fails). The response of the last tier is returned as it is, since there is nothing left to escalate to."""
+
+    def __init__(self, tiers: list[LLMBaseModel]):
+        if not tiers:
+            raise ValueError("At least one tier must be provided.")
+        # The last tier is the model the stage is configured with, so it determines the model config the generators see
+        super().__init__(
+            model_name=tiers[-1].model_name, model_config=tiers[-1].model_config
+        )
+        self._tiers = tiers
+
+    async def send_http_request_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        http_method: HttpMethod,
+        table: Table,
+    ) -> HttpMethodResponse:
+        return await self._cascade(
+            stage="http_request",
+            method_name="send_http_request_message",
+            validate=lambda response: validate_http_method_response(
+                response=response, table=table
+            ),
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            http_method=http_method,
+            table=table,
+        )
+
+    async def send_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> SelectionResponse:
+        return await self._cascade(
+            stage="selection",
+            method_name="send_selection_message",
+            validate=lambda response: validate_selection_response(
+                response=response, applications=applications
+            ),
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_application_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> ApplicationSelectionResponse:
+        return await self._cascade(
+            stage="application_selection",
+            method_name="send_application_selection_message",
+            validate=lambda response: validate_application_selection_response(
+                response=response, applications=applications
+            ),
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_table_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        grouping_indices: list[int],
+    ) -> TableSelectionResponse:
+        return await self._cascade(
+            stage="table_selection",
+            method_name="send_table_selection_message",
+            validate=lambda response: validate_table_selection_response(
+                response=response,
+                application=application,
+                grouping_indices=grouping_indices,
+            ),
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            grouping_indices=grouping_indices,
+        )
+
+    async def send_clarification_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+    ) -> str:
+        return await self._cascade(
+            stage="clarification",
+            method_name="send_clarification_message",
+            validate=lambda response: validate_clarification_response(
+                response=response
+            ),
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+        )
+
+    async def send_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> CreateInferenceResponse:
+        return await self._cascade(
+            stage="application",
+            method_name="send_application_message",
+            validate=lambda response: validate_application_response(response=response),
+            system_message=system_message,
+            user_message=user_message,
+            last_application_draft=last_application_draft,
+        )
+
+    def stream_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> AsyncIterator[CreateStreamEvent]:
+        # Streamed events cannot be taken back once the response fails validation, so streams skip the cascade
+        return self._tiers[-1].stream_application_message(
+            system_message=system_message,
+            user_message=user_message,
+            last_application_draft=last_application_draft,
+        )
+
+    def stream_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> AsyncIterator[SelectedGrouping]:
+        # Streamed groupings are dispatched before the rest of the response is validated, so streams skip the cascade
+        return self._tiers[-1].stream_selection_message(
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def _cascade(
+        self, stage: str, method_name: str, validate: Callable[[Any], None], **kwargs
+    ) -> Any:
+        last_tier: int = len(self._tiers) - 1
+        escalation_latency: float = 0.0
+        for tier, model in enumerate(self._tiers):
+            start: float = time.monotonic()
+            if tier == last_tier:
+                response: Any = await getattr(model, method_name)(**kwargs)
+                if tier > 0:
+                    METRICS.increment(
+                        "llm_cascade_requests_total",
+                        labels={"stage": stage, "outcome": "escalated"},
+                    )
+                    METRICS.observe(
+                        "llm_cascade_escalation_overhead_seconds",
+                        escalation_latency,
+                        labels={"stage": stage},
+                    )
+                    self._export_hit_rate(stage=stage)
+                return response
+
+            try:
+                response = await getattr(model, method_name)(**kwargs)
+                validate(response)
+            except Exception as e:
+                log.info(
+                    f"Escalating {stage} from {model.model_name} to the next tier: {e}"
+                )
+                escalation_latency += time.monotonic() - start
+                continue
+
+            # There is no latency saved to report, as the last tier only ever answers the messages that the cheaper tiers failed, which are not representative of the ones they answer
+            METRICS.increment(
+                "llm_cascade_requests_total",
+                labels={"stage": stage, "outcome": "hit"},
+            )
+            self._export_hit_rate(stage=stage)
+            return response
+
+    def _export_hit_rate(self, stage: str) -> None:
+        hits: float = METRICS.get_counter(
+            "llm_cascade_requests_total", labels={"stage": stage, "outcome": "hit"}
+        )
+        escalations: float = METRICS.get_counter(
+            "llm_cascade_requests_total",
+            labels={"stage": stage, "outcome": "escalated"},
+        )
+        METRICS.set_gauge(
+            "llm_cascade_hit_rate", hits / (hits + escalations), labels={"stage": stage}
+        )
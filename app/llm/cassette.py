@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from enum import StrEnum
+from typing import Any, AsyncIterator, Optional
+
+from pydantic import TypeAdapter
+from pydantic_core import to_jsonable_python
+
+from app.exceptions.exception import ProviderFailure
+from app.llm.base import LLMBaseModel
+from app.llm.cache import get_message_key
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent, Table
+from app.models.inference.create import CreateInferenceResponse, CreateStreamEvent
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    HttpMethod,
+    HttpMethodResponse,
+    SelectedGrouping,
+    SelectionResponse,
+    TableSelectionResponse,
+)
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class CassetteMode(StrEnum):
+    RECORD = "record"
+    REPLAY = "replay"
+
+
+class CassetteStore:
+    """Content-addressed store of recorded messages on disk. Every message is saved as <directory>/<first 2 characters of the key>/<key>.json, where the key is the hash of the model and the arguments of the message, so re-recording the same message overwrites it instead of duplicating it."""
+
+    def __init__(self, directory: str):
+        self._directory = directory
+
+    def load(self, key: str) -> Optional[dict[str, Any]]:
+        try:
+            with open(self._get_path(key=key), encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: str, cassette: dict[str, Any]) -> None:
+        path: str = self._get_path(key=key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file first, so that a concurrent replay never reads a partial cassette
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".tmp"
+        )
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+            json.dump(cassette, file, indent=2, sort_keys=True)
+        os.replace(temporary_path, path)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self._directory, key[:2], f"{key}.json")
+
+
+class CassetteModel(LLMBaseModel):
+    """Records every message sent to the wrapped model together with its response, or replays the recorded responses without sending anything over the network. A message that was not recorded fails in replay mode."""
+
+    def __init__(self, model: LLMBaseModel, store: CassetteStore, mode: CassetteMode):
+        super().__init__(model_name=model.model_name, model_config=model.model_config)
+        self._model = model
+        self._store = store
+        self._mode = mode
+
+    async def send_http_request_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        http_method: HttpMethod,
+        table: Table,
+    ) -> HttpMethodResponse:
+        return await self._record_or_replay(
+            method_name="send_http_request_message",
+            response_type=HttpMethodResponse,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            http_method=http_method,
+            table=table,
+        )
+
+    async def send_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> SelectionResponse:
+        return await self._record_or_replay(
+            method_name="send_selection_message",
+            response_type=SelectionResponse,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_application_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> ApplicationSelectionResponse:
+        return await self._record_or_replay(
+            method_name="send_application_selection_message",
+            response_type=ApplicationSelectionResponse,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_table_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        grouping_indices: list[int],
+    ) -> TableSelectionResponse:
+        return await self._record_or_replay(
+            method_name="send_table_selection_message",
+            response_type=TableSelectionResponse,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            grouping_indices=grouping_indices,
+        )
+
+    async def send_clarification_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+    ) -> str:
+        return await self._record_or_replay(
+            method_name="send_clarification_message",
+            response_type=str,
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+        )
+
+    async def send_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> CreateInferenceResponse:
+        return await self._record_or_replay(
+            method_name="send_application_message",
+            response_type=CreateInferenceResponse,
+            system_message=system_message,
+            user_message=user_message,
+            last_application_draft=last_application_draft,
+        )
+
+    async def stream_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> AsyncIterator[CreateStreamEvent]:
+        """A stream is recorded as the list of its events, which are replayed in the same order."""
+        arguments: dict[str, Any] = {
+            "system_message": system_message,
+            "user_message": user_message,
+            "last_application_draft": last_application_draft,
+        }
+        adapter = TypeAdapter(list[CreateStreamEvent])
+        key: str = get_message_key(
+            model_name=self._model_name,
+            method_name="stream_application_message",
+            arguments=arguments,
+        )
+        if self._mode == CassetteMode.REPLAY:
+            cassette: dict[str, Any] = await self._load(
+                key=key, method_name="stream_application_message"
+            )
+            for event in adapter.validate_python(cassette["response"]):
+                yield event
+            return
+
+        events: list[CreateStreamEvent] = []
+        async for event in self._model.stream_application_message(**arguments):
+            events.append(event)
+            yield event
+        await self._save(
+            key=key,
+            method_name="stream_application_message",
+            arguments=arguments,
+            response=adapter.dump_python(events, mode="json"),
+        )
+
+    async def stream_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> AsyncIterator[SelectedGrouping]:
+        """A stream is recorded as the list of its groupings, which are replayed in the same order."""
+        arguments: dict[str, Any] = {
+            "system_message": system_message,
+            "context_message": context_message,
+            "user_message": user_message,
+            "applications": applications,
+        }
+        adapter = TypeAdapter(list[SelectedGrouping])
+        key: str = get_message_key(
+            model_name=self._model_name,
+            method_name="stream_selection_message",
+            arguments=arguments,
+        )
+        if self._mode == CassetteMode.REPLAY:
+            cassette: dict[str, Any] = await self._load(
+                key=key, method_name="stream_selection_message"
+            )
+            for grouping in adapter.validate_python(cassette["response"]):
+                yield grouping
+            return
+
+        groupings: list[SelectedGrouping] = []
+        async for grouping in self._model.stream_selection_message(**arguments):
+            groupings.append(grouping)
+            yield grouping
+        await self._save(
+            key=key,
+            method_name="stream_selection_message",
+            arguments=arguments,
+            response=adapter.dump_python(groupings, mode="json"),
+        )
+
+    async def _record_or_replay(
+        self, method_name: str, response_type: type, **kwargs
+    ) -> Any:
+        adapter = TypeAdapter(response_type)
+        key: str = get_message_key(
+            model_name=self._model_name, method_name=method_name, arguments=kwargs
+        )
+        if self._mode == CassetteMode.REPLAY:
+            cassette: dict[str, Any] = await self._load(
+                key=key, method_name=method_name
+            )
+            return adapter.validate_python(cassette["response"])
+
+        response: Any = await getattr(self._model, method_name)(**kwargs)
+        await self._save(
+            key=key,
+            method_name=method_name,
+            arguments=kwargs,
+            response=adapter.dump_python(response, mode="json"),
+        )
+        return response
+
+    async def _load(self, key: str, method_name: str) -> dict[str, Any]:
+        cassette: Optional[dict[str, Any]] = await asyncio.to_thread(
+            self._store.load, key
+        )
+        if cassette is None:
+            METRICS.increment(
+                "llm_cassette_replays_total",
+                labels={"method": method_name, "result": "miss"},
+            )
+            log.error(f"No recorded {method_name} for {self._model_name}: {key}")
+            # A backend that failed while recording has no recording, so the router fails over on replay like it did on the recorded traffic
+            raise ProviderFailure(f"No recorded response for {method_name}")
+        METRICS.increment(
+            "llm_cassette_replays_total",
+            labels={"method": method_name, "result": "hit"},
+        )
+        return cassette
+
+    async def _save(
+        self, key: str, method_name: str, arguments: dict[str, Any], response: Any
+    ) -> None:
+        cassette: dict[str, Any] = {
+            "model": self._model_name,
+            "method": method_name,
+            "request": to_jsonable_python(arguments),
+            "response": response,
+        }
+        # A recording that cannot be written must not fail the request it records
+        try:
+            await asyncio.to_thread(self._store.save, key, cassette)
+            METRICS.increment(
+                "llm_cassette_recordings_total", labels={"method": method_name}
+            )
+        except Exception as e:
+            log.warning(f"Error recording {method_name}: {e}")
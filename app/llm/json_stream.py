@@ -0,0 +1,167 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Optional, Union
+
+PathElement = Union[str, int]
+Path = tuple[PathElement, ...]
+
+# Matches any index of an array in a watched path
+WILDCARD = "*"
+
+WHITESPACE = " \t\n\r"
+SCALAR_TERMINATORS = ",}]" + WHITESPACE
+
+
+@dataclass
+class _Frame:
+    kind: str
+    start: int
+    key: Optional[str] = None
+    index: int = 0
+    expecting_key: bool = False
+
+
+class IncrementalJsonParser:
+    """Parses a JSON document that arrives in chunks (e.g. the arguments of a streamed tool call) and returns the values at the watched paths as soon as they are complete, instead of waiting for the whole document. If the document is cut off, recover() returns what was complete of it."""
+
+    def __init__(self, paths: list[Path]):
+        self._paths = paths
+        self._buffer: str = ""
+        self._position: int = 0
+        self._stack: list[_Frame] = []
+        self._in_string: bool = False
+        self._escaped: bool = False
+        self._string_start: int = 0
+        self._scalar_start: Optional[int] = None
+        self._is_complete: bool = False
+        # The end of the longest prefix of the buffer that is valid JSON once the containers that are still open are closed, together with the brackets that close them
+        self._safe_end: int = 0
+        self._safe_closing_brackets: Optional[str] = None
+
+    @property
+    def is_complete(self) -> bool:
+        return self._is_complete
+
+    @property
+    def text(self) -> str:
+        return self._buffer
+
+    def recover(self) -> Any:
+        """Returns the document as if it ended after the last value that was complete. A watched value is either recovered whole or left out, so that a half-generated row or grouping is never mistaken for a complete one. Raises a ValueError if nothing can be recovered."""
+        if self._is_complete:
+            return json.loads(self._buffer)
+        if self._safe_closing_brackets is None:
+            raise ValueError("No complete value to recover from the document.")
+        return json.loads(self._buffer[: self._safe_end] + self._safe_closing_brackets)
+
+    def feed(self, chunk: str) -> list[tuple[Path, Any]]:
+        self._buffer += chunk
+        completed_values: list[tuple[Path, Any]] = []
+        while self._position < len(self._buffer):
+            character: str = self._buffer[self._position]
+            self._consume(character=character, completed_values=completed_values)
+            self._position += 1
+        return completed_values
+
+    def _consume(
+        self, character: str, completed_values: list[tuple[Path, Any]]
+    ) -> None:
+        frame: Optional[_Frame] = self._stack[-1] if self._stack else None
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif character == "\\":
+                self._escaped = True
+            elif character == '"':
+                self._in_string = False
+                if frame and frame.kind == "{" and frame.expecting_key:
+                    frame.key = json.loads(
+                        self._buffer[self._string_start : self._position + 1]
+                    )
+                    frame.expecting_key = False
+                else:
+                    self._complete_value(
+                        start=self._string_start,
+                        end=self._position + 1,
+                        completed_values=completed_values,
+                    )
+            return
+
+        if self._scalar_start is not None:
+            if character not in SCALAR_TERMINATORS:
+                return
+            self._complete_value(
+                start=self._scalar_start,
+                end=self._position,
+                completed_values=completed_values,
+            )
+            self._scalar_start = None
+
+        match character:
+            case '"':
+                self._in_string = True
+                self._string_start = self._position
+            case "{" | "[":
+                self._stack.append(
+                    _Frame(
+                        kind=character,
+                        start=self._position,
+                        expecting_key=character == "{",
+                    )
+                )
+                self._record_safe_point(end=self._position + 1)
+            case "}" | "]":
+                frame = self._stack.pop()
+                self._complete_value(
+                    start=frame.start,
+                    end=self._position + 1,
+                    completed_values=completed_values,
+                )
+            case ",":
+                frame = self._stack[-1]
+                if frame.kind == "{":
+                    frame.key = None
+                    frame.expecting_key = True
+                else:
+                    frame.index += 1
+            case ":":
+                pass
+            case _ if character in WHITESPACE:
+                pass
+            case _:
+                self._scalar_start = self._position
+
+    def _complete_value(
+        self, start: int, end: int, completed_values: list[tuple[Path, Any]]
+    ) -> None:
+        if not self._stack:
+            self._is_complete = True
+        path: Path = tuple(
+            frame.key if frame.kind == "{" else frame.index for frame in self._stack
+        )
+        if any(matches_path(path=path, pattern=pattern) for pattern in self._paths):
+            completed_values.append((path, json.loads(self._buffer[start:end])))
+        self._record_safe_point(end=end)
+
+    def _record_safe_point(self, end: int) -> None:
+        # Nothing inside a watched value is a safe point, as the value is only recovered whole
+        for depth in range(1, len(self._stack)):
+            path: Path = tuple(
+                frame.key if frame.kind == "{" else frame.index
+                for frame in self._stack[:depth]
+            )
+            if any(matches_path(path=path, pattern=pattern) for pattern in self._paths):
+                return
+        self._safe_end = end
+        self._safe_closing_brackets = "".join(
+            "}" if frame.kind == "{" else "]" for frame in reversed(self._stack)
+        )
+
+
+def matches_path(path: Path, pattern: Path) -> bool:
+    if len(path) != len(pattern):
+        return False
+    return all(
+        expected == WILDCARD and isinstance(actual, int) or expected == actual
+        for actual, expected in zip(path, pattern)
+    )
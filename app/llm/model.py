@@ -2,8 +2,14 @@ from dataclasses import dataclass
 from enum import StrEnum
 from typing import Optional
 
+from app.cache.base import CacheBackend
 from app.llm.base import LLMBaseModel, LLMConfig
-from app.llm.open_ai import OpenAi
+from app.llm.cache import CachedModel
+from app.llm.cascade import Cascade
+from app.llm.cassette import CassetteMode, CassetteModel, CassetteStore
+from app.llm.router import Router
+from app.llm.scheduled import ScheduledModel
+from app.scheduler.scheduler import FairScheduler
 
 
 class LLMType(StrEnum):
@@ -24,6 +30,13 @@ class LLMType(StrEnum):
         raise ValueError(f"Unsupported LLM type: {self}")
 
 
+# Models are shared between requests, so that the router and the cascade keep their latency and error measurements
+_MODEL_CACHE: dict[
+    tuple[tuple[LLMType, ...], tuple[LLMType, ...], Optional[CassetteMode]],
+    LLMBaseModel,
+] = {}
+
+
 @dataclass
 class LLM:
     """Wrapper class for the LLM models."""
@@ -34,18 +47,129 @@ class LLM:
         self,
         model_type: LLMType,
         model_config: Optional[LLMConfig] = None,
+        fallback_model_types: Optional[list[LLMType]] = None,
+        cascade_model_types: Optional[list[LLMType]] = None,
+        cache: Optional[CacheBackend] = None,
+        cache_ttl_seconds: Optional[int] = None,
+        cassette_store: Optional[CassetteStore] = None,
+        cassette_mode: Optional[CassetteMode] = None,
+        scheduler: Optional[FairScheduler] = None,
     ):
-        model_config: LLMConfig = model_config or model_type.default_config()
-        match model_type:
-            case LLMType.OPENAI_GPT4:
-                self._model = OpenAi(
-                    model_name=model_type.value, model_config=model_config
-                )
-            case LLMType.OPENAI_GPT3_5:
-                self._model = OpenAi(
-                    model_name=model_type.value, model_config=model_config
-                )
+        model_types: list[LLMType] = [model_type] + [
+            fallback_model_type
+            for fallback_model_type in fallback_model_types or []
+            if fallback_model_type != model_type
+        ]
+        cassette: Optional[tuple[CassetteStore, CassetteMode]] = (
+            (cassette_store, cassette_mode)
+            if cassette_store and cassette_mode
+            else None
+        )
+        if model_config:
+            self._model = _create_model(
+                model_types=model_types,
+                cascade_model_types=cascade_model_types or [],
+                cassette=cassette,
+                model_config=model_config,
+            )
+            if scheduler:
+                self._model = ScheduledModel(model=self._model, scheduler=scheduler)
+            return
+
+        key: tuple[tuple[LLMType, ...], tuple[LLMType, ...], Optional[CassetteMode]] = (
+            tuple(model_types),
+            tuple(cascade_model_types or []),
+            cassette[1] if cassette else None,
+        )
+        if key not in _MODEL_CACHE:
+            _MODEL_CACHE[key] = _create_model(
+                model_types=model_types,
+                cascade_model_types=cascade_model_types or [],
+                cassette=cassette,
+            )
+        self._model = _MODEL_CACHE[key]
+        # Cache hits do not call the LLM, so they are served without waiting in the scheduler
+        if scheduler:
+            self._model = ScheduledModel(model=self._model, scheduler=scheduler)
+        if cache and cache_ttl_seconds:
+            self._model = CachedModel(
+                model=self._model, cache=cache, ttl_seconds=cache_ttl_seconds
+            )
 
     @property
     def model(self) -> LLMBaseModel:
         return self._model
+
+
+def _create_model(
+    model_types: list[LLMType],
+    cascade_model_types: list[LLMType],
+    cassette: Optional[tuple[CassetteStore, CassetteMode]],
+    model_config: Optional[LLMConfig] = None,
+) -> LLMBaseModel:
+    if not cascade_model_types:
+        return _create_routed_model(
+            model_types=model_types, cassette=cassette, model_config=model_config
+        )
+    # An escalated message must reach a stronger model, so the last tier never routes to a model of the tiers before it. The primary model is always kept
+    model: LLMBaseModel = _create_routed_model(
+        model_types=[model_types[0]]
+        + [
+            model_type
+            for model_type in model_types[1:]
+            if model_type not in cascade_model_types
+        ],
+        cassette=cassette,
+        model_config=model_config,
+    )
+    tiers: list[LLMBaseModel] = [
+        _create_backend(
+            model_type=cascade_model_type,
+            model_config=model_config or cascade_model_type.default_config(),
+            cassette=cassette,
+        )
+        for cascade_model_type in cascade_model_types
+    ]
+    return Cascade(tiers=tiers + [model])
+
+
+def _create_routed_model(
+    model_types: list[LLMType],
+    cassette: Optional[tuple[CassetteStore, CassetteMode]],
+    model_config: Optional[LLMConfig] = None,
+) -> LLMBaseModel:
+    backends: list[LLMBaseModel] = [
+        _create_backend(
+            model_type=model_type,
+            model_config=model_config or model_type.default_config(),
+            cassette=cassette,
+        )
+        for model_type in model_types
+    ]
+    if len(backends) == 1:
+        return backends[0]
+    return Router(backends=backends)
+
+
+def _create_backend(
+    model_type: LLMType,
+    model_config: LLMConfig,
+    cassette: Optional[tuple[CassetteStore, CassetteMode]],
+) -> LLMBaseModel:
+    # The OpenAI SDK takes longer to import than the rest of the app together, so it is only imported once the first model is created instead of on every cold start
+    from app.llm.open_ai import OpenAi
+
+    match model_type:
+        case LLMType.OPENAI_GPT4:
+            model: LLMBaseModel = OpenAi(
+                model_name=model_type.value, model_config=model_config
+            )
+        case LLMType.OPENAI_GPT3_5:
+            model = OpenAi(model_name=model_type.value, model_config=model_config)
+        case _:
+            raise ValueError(f"Unsupported LLM type: {model_type}")
+    # Every backend is recorded on its own, so that the router and the cascade make the same decisions on replay as they did on the recorded traffic
+    if cassette:
+        store, mode = cassette
+        return CassetteModel(model=model, store=store, mode=mode)
+    return model
@@ -1,51 +1,113 @@
+import asyncio
 import json
 import logging
 import os
-from typing import Optional
+from contextlib import aclosing
+from dataclasses import dataclass
+from functools import cache
+from typing import Any, AsyncIterator, Callable, Optional, Union
 
-from dotenv import load_dotenv
-from openai import OpenAI
+import httpx
+from openai import (
+    NOT_GIVEN,
+    APIConnectionError,
+    APIStatusError,
+    AsyncOpenAI,
+    BadRequestError,
+    DefaultAsyncHttpxClient,
+    NotGiven,
+    UnprocessableEntityError,
+)
+from openai.types import CompletionUsage
 
-from app.exceptions.exception import InferenceFailure
+from app.context.deadline import get_remaining_seconds
+from app.exceptions.exception import InferenceFailure, ProviderFailure
 from app.llm.base import LLMBaseModel, LLMConfig
+from app.llm.json_stream import WILDCARD, IncrementalJsonParser, Path, matches_path
+from app.metrics.metrics import METRICS
 from app.models.application import ApplicationContent, Table
-from app.models.inference.create import CreateInferenceResponse
-from app.models.inference.use import HttpMethod, HttpMethodResponse, SelectionResponse
+from app.models.inference.create import (
+    CreateInferenceResponse,
+    CreateStreamEvent,
+    CreateStreamEventType,
+    PatchOperation,
+)
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    HttpMethod,
+    HttpMethodResponse,
+    SelectedApplicationGrouping,
+    SelectedGrouping,
+    SelectedTable,
+    SelectionResponse,
+    TableSelectionResponse,
+)
+from app.processor.patch import apply_application_patch
+from app.processor.validation import validate_selected_grouping
 from app.prompts.create.functions import (
     ApplicationFunction,
     clarify,
     conclude,
     create_application,
+    patch_application,
 )
 from app.prompts.use.functions import (
     HttpMethodFunction,
     SelectionFunction,
+    get_application_selection_function,
     get_http_method_parameters_function,
     get_selection_function,
+    get_table_selection_function,
 )
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
-load_dotenv()
+# Idle connections are kept for longer than the default of 5 seconds, so that the warmup can keep them open between requests
+CONNECTION_KEEPALIVE_EXPIRY_SECONDS: float = 60
 
+# The path at which _stream_tool_call yields the name of the tool, which no value of the arguments can be at
+TOOL_NAME_PATH: Path = ()
+
+# The .env file is loaded by app.config, which is always imported before this module
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
+# The LLM sometimes nests the overview and clarification inside the application content, so both locations are watched
+APPLICATION_STREAM_EVENTS: dict[Path, CreateStreamEventType] = {
+    (
+        ApplicationFunction.APPLICATION_CONTENT,
+        ApplicationFunction.NAME,
+    ): CreateStreamEventType.APPLICATION_NAME,
+    (
+        ApplicationFunction.APPLICATION_CONTENT,
+        ApplicationFunction.TABLES,
+        WILDCARD,
+    ): CreateStreamEventType.TABLE,
+    (ApplicationFunction.OVERVIEW,): CreateStreamEventType.OVERVIEW,
+    (
+        ApplicationFunction.APPLICATION_CONTENT,
+        ApplicationFunction.OVERVIEW,
+    ): CreateStreamEventType.OVERVIEW,
+    (ApplicationFunction.CLARIFICATION,): CreateStreamEventType.CLARIFICATION,
+    (
+        ApplicationFunction.APPLICATION_CONTENT,
+        ApplicationFunction.CLARIFICATION,
+    ): CreateStreamEventType.CLARIFICATION,
+    (ApplicationFunction.CONCLUDING_MESSAGE,): CreateStreamEventType.CONCLUDING_MESSAGE,
+}
+
 
 class OpenAi(LLMBaseModel):
     """This class handles the interaction with OpenAI API."""
 
     def __init__(self, model_name: str, model_config: LLMConfig):
         super().__init__(model_name=model_name, model_config=model_config)
-        self._client = OpenAI(
-            api_key=OPENAI_API_KEY,
-        )
+        self._client = _get_client()
 
-    # TODO: Ensure that the order of the pairs are correct. Sometimes order matters. E.g. PUT -> GET
-    # TODO: Consider splitting the selection step of tables separately. Currently: (Application, Table Name, HTTP Method) -> To consider: (Application, HTTP Method) + (Table Name). This allows us to use enums for the function calling schema for table name.
     async def send_selection_message(
         self,
         system_message: str,
+        context_message: str,
         user_message: str,
         applications: list[ApplicationContent],
     ) -> SelectionResponse:
@@ -53,10 +115,11 @@ class OpenAi(LLMBaseModel):
         try:
             log.info(system_message)
             log.info(user_message)
-            response = self._client.chat.completions.create(
-                model=self._model_name,
+            _, json_response, _ = await self._send_tool_call(
+                stage="selection",
                 messages=[
                     {"role": "system", "content": system_message},
+                    {"role": "user", "content": context_message},
                     {"role": "user", "content": user_message},
                 ],
                 tools=[get_selection_function(applications=applications)],
@@ -64,9 +127,13 @@ class OpenAi(LLMBaseModel):
                     "type": "function",
                     "function": {"name": SelectionFunction.SELECT},
                 },
+                validators={
+                    (
+                        SelectionFunction.RELEVANT_GROUPINGS,
+                        WILDCARD,
+                    ): SelectedGrouping.model_validate
+                },
             )
-            tool_call = response.choices[0].message.tool_calls[0]
-            json_response: dict[str, str] = json.loads(tool_call.function.arguments)
             log.info(f"Initial Selection Response: {json_response}")
             if not json_response:
                 json_response = {"relevant_groupings": None}
@@ -74,17 +141,118 @@ class OpenAi(LLMBaseModel):
             selection_response = SelectionResponse.model_validate(json_response)
             log.info(selection_response)
             return selection_response
+        except asyncio.CancelledError as e:
+            _record_cancellation(stage="selection")
+            raise e
         except Exception as e:
             log.error(
                 f"Error sending or processing selection message to OpenAI: {str(e)}"
             )
-            raise InferenceFailure(
-                "Error sending or processing selection message to OpenAI"
+            raise _get_failure(
+                exception=e,
+                message="Error sending or processing selection message to OpenAI",
+            )
+
+    async def send_application_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> ApplicationSelectionResponse:
+        log.info(f"Sending application selection message to OpenAI")
+        try:
+            _, json_response, _ = await self._send_tool_call(
+                stage="application_selection",
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": context_message},
+                    {"role": "user", "content": user_message},
+                ],
+                tools=[get_application_selection_function(applications=applications)],
+                tool_choice={
+                    "type": "function",
+                    "function": {"name": SelectionFunction.SELECT_APPLICATIONS},
+                },
+                validators={
+                    (
+                        SelectionFunction.RELEVANT_GROUPINGS,
+                        WILDCARD,
+                    ): SelectedApplicationGrouping.model_validate
+                },
+            )
+            log.info(f"Initial Application Selection Response: {json_response}")
+            if not json_response:
+                json_response = {"relevant_groupings": None}
+
+            application_selection_response = (
+                ApplicationSelectionResponse.model_validate(json_response)
+            )
+            log.info(application_selection_response)
+            return application_selection_response
+        except asyncio.CancelledError as e:
+            _record_cancellation(stage="application_selection")
+            raise e
+        except Exception as e:
+            log.error(
+                f"Error sending or processing application selection message to OpenAI: {str(e)}"
+            )
+            raise _get_failure(
+                exception=e,
+                message="Error sending or processing application selection message to OpenAI",
+            )
+
+    async def send_table_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        grouping_indices: list[int],
+    ) -> TableSelectionResponse:
+        log.info(f"Sending table selection message to OpenAI")
+        try:
+            _, json_response, _ = await self._send_tool_call(
+                stage="table_selection",
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": context_message},
+                    {"role": "user", "content": user_message},
+                ],
+                tools=[get_table_selection_function(application=application)],
+                tool_choice={
+                    "type": "function",
+                    "function": {"name": SelectionFunction.SELECT_TABLES},
+                },
+                validators={
+                    (
+                        SelectionFunction.SELECTED_TABLES,
+                        WILDCARD,
+                    ): SelectedTable.model_validate
+                },
+            )
+            log.info(f"Initial Table Selection Response: {json_response}")
+            table_selection_response = TableSelectionResponse.model_validate(
+                json_response
+            )
+            log.info(table_selection_response)
+            return table_selection_response
+        except asyncio.CancelledError as e:
+            _record_cancellation(stage="table_selection")
+            raise e
+        except Exception as e:
+            log.error(
+                f"Error sending or processing table selection message to OpenAI: {str(e)}"
+            )
+            raise _get_failure(
+                exception=e,
+                message="Error sending or processing table selection message to OpenAI",
             )
 
     async def send_http_request_message(
         self,
         system_message: str,
+        context_message: str,
         user_message: str,
         application: ApplicationContent,
         http_method: HttpMethod,
@@ -92,10 +260,11 @@ class OpenAi(LLMBaseModel):
     ) -> HttpMethodResponse:
         log.info(f"Sending http method message to OpenAI")
         try:
-            response = self._client.chat.completions.create(
-                model=self._model_name,
+            _, json_response, is_truncated = await self._send_tool_call(
+                stage="http_request",
                 messages=[
                     {"role": "system", "content": system_message},
+                    {"role": "user", "content": context_message},
                     {"role": "user", "content": user_message},
                 ],
                 tools=[
@@ -107,9 +276,14 @@ class OpenAi(LLMBaseModel):
                     "type": "function",
                     "function": {"name": HttpMethodFunction.GET_HTTP_METHOD_PARAMETERS},
                 },
+                validators={
+                    (HttpMethodFunction.INSERTED_ROWS, WILDCARD): _validate_object
+                },
             )
-            tool_call = response.choices[0].message.tool_calls[0]
-            json_response: dict[str, str] = json.loads(tool_call.function.arguments)
+            # Only the rows of an insert can be recovered, as a cut-off filter would match more rows than asked for. The rows that are missing are left for the caller to generate
+            if is_truncated and http_method != HttpMethod.POST:
+                raise ValueError(f"The {http_method} request was cut off")
+            json_response["is_truncated"] = is_truncated
             log.info(f"Initial HTTP Request Response: {json_response}")
             json_response["http_method"] = http_method
             json_response["application"] = application.model_dump()
@@ -117,37 +291,49 @@ class OpenAi(LLMBaseModel):
             http_method_response = HttpMethodResponse.model_validate(json_response)
             log.info(http_method_response)
             return http_method_response
+        except asyncio.CancelledError as e:
+            _record_cancellation(stage="http_request")
+            raise e
         except Exception as e:
             log.error(
                 f"Error sending or processing http method message to OpenAI: {str(e)}"
             )
-            raise InferenceFailure(
-                "Error sending or processing http method message to OpenAI"
+            raise _get_failure(
+                exception=e,
+                message="Error sending or processing http method message to OpenAI",
             )
 
     async def send_clarification_message(
         self,
         system_message: str,
+        context_message: str,
         user_message: str,
     ) -> str:
         log.info(f"Sending clarification message to OpenAI")
         try:
-            response = self._client.chat.completions.create(
+            response = await self._client.chat.completions.create(
                 model=self._model_name,
+                timeout=_get_request_timeout(),
                 messages=[
                     {"role": "system", "content": system_message},
+                    {"role": "user", "content": context_message},
                     {"role": "user", "content": user_message},
                 ],
             )
+            _record_usage(stage="clarification", usage=response.usage)
             clarification_response: str = response.choices[0].message.content
             log.info(f"Clarification question: {clarification_response}")
             return clarification_response
+        except asyncio.CancelledError as e:
+            _record_cancellation(stage="clarification")
+            raise e
         except Exception as e:
             log.error(
                 f"Error sending or processing clarification message to OpenAI: {str(e)}"
             )
-            raise InferenceFailure(
-                "Error sending or processing clarification message to OpenAI"
+            raise _get_failure(
+                exception=e,
+                message="Error sending or processing clarification message to OpenAI",
             )
 
     async def send_application_message(
@@ -159,129 +345,452 @@ class OpenAi(LLMBaseModel):
         log.info(f"Sending application message to OpenAI")
         try:
             available_tools = (
-                [create_application(), clarify(), conclude()]
+                [patch_application(), create_application(), clarify(), conclude()]
                 if last_application_draft
                 else [create_application(), clarify()]
             )
-            response = self._client.chat.completions.create(
-                model=self._model_name,
+            # TODO: Known issue that sometimes it outputs a clarification question but does not choose the correct tool. Need to handle this case somehow
+            # TEMP SOLUTION: If the tool is not selected, then we treat it as a clarification question
+            tool_name, json_response, is_truncated = await self._send_tool_call(
+                stage="application",
                 messages=[
                     {"role": "system", "content": system_message},
                     {"role": "user", "content": user_message},
                 ],
                 tools=available_tools,
+                validators={
+                    (
+                        ApplicationFunction.APPLICATION_CONTENT,
+                        ApplicationFunction.TABLES,
+                        WILDCARD,
+                    ): _validate_object
+                },
             )
-            log.info(response)
-            # TODO: Known issue that sometimes it outputs a clarification question but does not choose the correct tool. Need to handle this case somehow
-            # TEMP SOLUTION: If the tool is not selected, then we treat it as a clarification question
-            tool_call = response.choices[0].message.tool_calls[0]
-
-            tool_name = tool_call.function.name
+            # A draft that was cut off would silently lose the tables or patch operations that were not generated, so it is never committed
+            if is_truncated:
+                raise ValueError("The application response was cut off")
             log.info(f"Tool called: {tool_name}")
-            json_response: dict[str, str] = json.loads(tool_call.function.arguments)
             log.info(f"Initial Application Creation Response: {json_response}")
-            match tool_name:
-                case ApplicationFunction.CREATE_APPLICATION:
-                    # Ensure that the application name is in the correct format
-                    if json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ) and json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ).get(
-                        ApplicationFunction.NAME
-                    ):
-                        json_response[ApplicationFunction.APPLICATION_CONTENT][
-                            ApplicationFunction.NAME
-                        ] = (
-                            json_response[ApplicationFunction.APPLICATION_CONTENT][
-                                ApplicationFunction.NAME
-                            ]
-                            .replace(" ", "_")
-                            .lower()
-                        )
-
-                    # Ensure that the table and column names are in the correct format
-                    if json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ) and json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ).get(
-                        ApplicationFunction.TABLES
-                    ):
-                        for table in json_response[
-                            ApplicationFunction.APPLICATION_CONTENT
-                        ][ApplicationFunction.TABLES]:
-                            table[ApplicationFunction.NAME] = (
-                                table[ApplicationFunction.NAME]
-                                .replace(" ", "_")
-                                .lower()
-                            )
-                            for column in table[ApplicationFunction.COLUMNS]:
-                                column[ApplicationFunction.NAME] = (
-                                    column[ApplicationFunction.NAME]
-                                    .replace(" ", "_")
-                                    .lower()
-                                )
-
-                    # LLM keep putting this additional Primary Key column at the application level when it should be a per table parameter
-                    if json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ) and json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ).get(
-                        ApplicationFunction.PRIMARY_KEY
-                    ):
-                        del json_response[ApplicationFunction.APPLICATION_CONTENT][
-                            ApplicationFunction.PRIMARY_KEY
-                        ]
-
-                    # LLM keep putting this overview at the application level when it should be not nested
-                    if json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ) and json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ).get(
-                        ApplicationFunction.OVERVIEW
-                    ):
-                        json_response[ApplicationFunction.OVERVIEW] = json_response.get(
-                            ApplicationFunction.APPLICATION_CONTENT
-                        ).get(ApplicationFunction.OVERVIEW)
-                        del json_response[ApplicationFunction.APPLICATION_CONTENT][
-                            ApplicationFunction.OVERVIEW
-                        ]
-
-                    # LLM keep putting this clarification at the application level when it should be not nested
-                    if json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ) and json_response.get(
-                        ApplicationFunction.APPLICATION_CONTENT
-                    ).get(
-                        ApplicationFunction.CLARIFICATION
-                    ):
-                        json_response[ApplicationFunction.CLARIFICATION] = (
-                            json_response.get(
-                                ApplicationFunction.APPLICATION_CONTENT
-                            ).get(ApplicationFunction.CLARIFICATION)
-                        )
-                        del json_response[ApplicationFunction.APPLICATION_CONTENT][
-                            ApplicationFunction.CLARIFICATION
-                        ]
-                case ApplicationFunction.CLARIFY:
-                    pass
-                case ApplicationFunction.CONCLUDE:
-                    json_response[ApplicationFunction.APPLICATION_CONTENT] = (
-                        last_application_draft.model_dump()
-                    )
-                case _:
-                    raise ValueError(f"Unsupported tool name: {tool_name}")
-            log.info(f"Processed Application Creation Response: {json_response}")
-            response = CreateInferenceResponse.model_validate(json_response)
+            response = _process_application_response(
+                tool_name=tool_name,
+                json_response=json_response,
+                last_application_draft=last_application_draft,
+            )
             log.info(response)
             return response
+        except asyncio.CancelledError as e:
+            _record_cancellation(stage="application")
+            raise e
         except Exception as e:
             log.error(
                 f"Error sending or processing application message to OpenAI: {str(e)}"
             )
-            raise InferenceFailure(
-                "Error sending or processing application message to OpenAI"
+            raise _get_failure(
+                exception=e,
+                message="Error sending or processing application message to OpenAI",
+            )
+
+    async def stream_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> AsyncIterator[CreateStreamEvent]:
+        log.info(f"Streaming application message from OpenAI")
+        try:
+            available_tools = (
+                [patch_application(), create_application(), clarify(), conclude()]
+                if last_application_draft
+                else [create_application(), clarify()]
+            )
+            parser = IncrementalJsonParser(paths=list(APPLICATION_STREAM_EVENTS.keys()))
+            tool_call = _ToolCall()
+            # Closed as soon as this stream is, so that the provider stream is never left open
+            async with aclosing(
+                self._stream_tool_call(
+                    stage="application",
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": user_message},
+                    ],
+                    tools=available_tools,
+                    tool_choice=NOT_GIVEN,
+                    parser=parser,
+                    tool_call=tool_call,
+                    yields_tool_name=True,
+                )
+            ) as values:
+                async for path, value in values:
+                    if path == TOOL_NAME_PATH:
+                        log.info(f"Tool called: {value}")
+                        yield CreateStreamEvent(
+                            event=CreateStreamEventType.TOOL, data=value
+                        )
+                        continue
+                    yield _get_application_stream_event(path=path, value=value)
+
+            json_response, is_truncated = _get_arguments(
+                parser=parser,
+                stage="application",
+                finish_reason=tool_call.finish_reason,
+            )
+            # The tables streamed so far are only a preview, the response that the draft is built from has to be complete
+            if is_truncated:
+                raise ValueError("The application response was cut off")
+            log.info(f"Initial Application Creation Response: {json_response}")
+            response: CreateInferenceResponse = _process_application_response(
+                tool_name=tool_call.name,
+                json_response=json_response,
+                last_application_draft=last_application_draft,
+            )
+            log.info(response)
+            yield CreateStreamEvent(
+                event=CreateStreamEventType.RESPONSE,
+                data=response.model_dump(mode="json"),
             )
+        except asyncio.CancelledError as e:
+            _record_cancellation(stage="application")
+            raise e
+        except Exception as e:
+            log.error(
+                f"Error streaming or processing application message from OpenAI: {str(e)}"
+            )
+            raise _get_failure(
+                exception=e,
+                message="Error streaming or processing application message from OpenAI",
+            )
+
+    async def stream_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> AsyncIterator[SelectedGrouping]:
+        log.info(f"Streaming selection message from OpenAI")
+        try:
+            log.info(system_message)
+            log.info(user_message)
+            parser = IncrementalJsonParser(
+                paths=[(SelectionFunction.RELEVANT_GROUPINGS, WILDCARD)]
+            )
+            tool_call = _ToolCall()
+            index: int = 0
+            # Closed as soon as this stream is, so that the provider stream is never left open
+            async with aclosing(
+                self._stream_tool_call(
+                    stage="selection",
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": context_message},
+                        {"role": "user", "content": user_message},
+                    ],
+                    tools=[get_selection_function(applications=applications)],
+                    tool_choice={
+                        "type": "function",
+                        "function": {"name": SelectionFunction.SELECT},
+                    },
+                    parser=parser,
+                    tool_call=tool_call,
+                )
+            ) as values:
+                async for _, value in values:
+                    grouping: SelectedGrouping = SelectedGrouping.model_validate(value)
+                    # A grouping is dispatched as soon as it is yielded, so it has to refer to a table that exists
+                    validate_selected_grouping(
+                        grouping=grouping, index=index, applications=applications
+                    )
+                    log.info(f"Grouping selected: {grouping}")
+                    yield grouping
+                    index += 1
+            # The groupings were already yielded as they closed, so a response that was cut off only has to be recorded
+            _get_arguments(
+                parser=parser, stage="selection", finish_reason=tool_call.finish_reason
+            )
+        except asyncio.CancelledError as e:
+            _record_cancellation(stage="selection")
+            raise e
+        except Exception as e:
+            log.error(
+                f"Error streaming or processing selection message from OpenAI: {str(e)}"
+            )
+            raise _get_failure(
+                exception=e,
+                message="Error streaming or processing selection message from OpenAI",
+            )
+
+    async def _send_tool_call(
+        self,
+        stage: str,
+        messages: list[dict[str, str]],
+        tools: list[dict[str, Any]],
+        validators: dict[Path, Callable[[Any], Any]],
+        tool_choice: Union[dict[str, Any], NotGiven] = NOT_GIVEN,
+    ) -> tuple[Optional[str], dict[str, Any], bool]:
+        """Streams the completion and parses the arguments of the first tool call while they are being generated. The values at the paths of the validators (e.g. the groupings or rows) are validated as soon as they are complete, so an invalid response is abandoned without waiting for (and paying for) the rest of it. Returns the name of the tool, its arguments, and whether they were cut off."""
+        parser = IncrementalJsonParser(paths=list(validators.keys()))
+        tool_call = _ToolCall()
+        # Closed as soon as a value fails validation, which stops the generation of the rest of the response
+        async with aclosing(
+            self._stream_tool_call(
+                stage=stage,
+                messages=messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                parser=parser,
+                tool_call=tool_call,
+            )
+        ) as values:
+            async for path, value in values:
+                for pattern, validate in validators.items():
+                    if matches_path(path=path, pattern=pattern):
+                        validate(value)
+        json_response, is_truncated = _get_arguments(
+            parser=parser, stage=stage, finish_reason=tool_call.finish_reason
+        )
+        return tool_call.name, json_response, is_truncated
+
+    async def _stream_tool_call(
+        self,
+        stage: str,
+        messages: list[dict[str, str]],
+        tools: list[dict[str, Any]],
+        tool_choice: Union[dict[str, Any], NotGiven],
+        parser: IncrementalJsonParser,
+        tool_call: "_ToolCall",
+        yields_tool_name: bool = False,
+    ) -> AsyncIterator[tuple[Path, Any]]:
+        """Feeds the arguments of the first tool call to the parser while they are being generated, and yields the values at its paths as soon as they are complete. The name of the tool and the finish reason are filled into tool_call along the way, and the name is also yielded at TOOL_NAME_PATH as soon as it is known if yields_tool_name is set."""
+        stream = await self._client.chat.completions.create(
+            model=self._model_name,
+            timeout=_get_request_timeout(),
+            messages=messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    _record_usage(stage=stage, usage=chunk.usage)
+                if not chunk.choices:
+                    continue
+                tool_call.finish_reason = (
+                    chunk.choices[0].finish_reason or tool_call.finish_reason
+                )
+                if not chunk.choices[0].delta.tool_calls:
+                    continue
+                delta = chunk.choices[0].delta.tool_calls[0]
+                if delta.index != 0 or not delta.function:
+                    continue
+                if delta.function.name:
+                    tool_call.name = delta.function.name
+                    if yields_tool_name:
+                        yield TOOL_NAME_PATH, tool_call.name
+                if delta.function.arguments:
+                    for path, value in parser.feed(delta.function.arguments):
+                        yield path, value
+        finally:
+            # Closing the connection stops the generation of a response that is abandoned halfway
+            await stream.close()
+
+
+@dataclass
+class _ToolCall:
+    name: Optional[str] = None
+    finish_reason: Optional[str] = None
+
+
+def _get_arguments(
+    parser: IncrementalJsonParser, stage: str, finish_reason: Optional[str]
+) -> tuple[dict[str, Any], bool]:
+    """Returns the arguments of the tool call, and whether they were cut off. Arguments that were cut off (e.g. by the output limit) are recovered up to their last complete value instead of failing the whole response. A response without any tool call is not a cut-off one, so it is counted separately and fails."""
+    if parser.is_complete and finish_reason != "length":
+        return json.loads(parser.text), False
+    if not parser.text.strip() and finish_reason != "length":
+        METRICS.increment("llm_missing_tool_calls_total", labels={"stage": stage})
+        raise ValueError(
+            f"The {stage} response from OpenAI has no tool call (finish reason: {finish_reason})"
+        )
+    log.warning(
+        f"Recovering the {stage} response from OpenAI, which was cut off (finish reason: {finish_reason})"
+    )
+    METRICS.increment("llm_truncated_responses_total", labels={"stage": stage})
+    return parser.recover(), True
+
+
+def _get_failure(exception: Exception, message: str) -> InferenceFailure:
+    """Returns a ProviderFailure if the exception came from the connection to OpenAI or from OpenAI itself, which another model may not run into, and an InferenceFailure if it came from the request or the response (e.g. a response that fails validation), which failing over would only repeat."""
+    if isinstance(exception, (APIConnectionError, httpx.TransportError, TimeoutError)):
+        return ProviderFailure(message)
+    if isinstance(exception, APIStatusError) and not isinstance(
+        exception, (BadRequestError, UnprocessableEntityError)
+    ):
+        return ProviderFailure(message)
+    return InferenceFailure(message)
+
+
+def _validate_object(value: Any) -> None:
+    if not isinstance(value, dict):
+        raise ValueError(f"Expected an object but got: {value}")
+
+
+async def open_connections(count: int) -> None:
+    """Opens count connections to OpenAI in the pool of the shared client, so that the first requests do not pay for the TCP and TLS handshakes. Listing the models does not use any tokens."""
+    await asyncio.gather(*(_get_client().models.list() for _ in range(count)))
+
+
+def _get_request_timeout() -> Union[float, NotGiven]:
+    # Without a deadline, the timeout of the client applies
+    remaining_seconds: Optional[float] = get_remaining_seconds()
+    return remaining_seconds if remaining_seconds is not None else NOT_GIVEN
+
+
+@cache
+def _get_client() -> AsyncOpenAI:
+    # Every model variant shares one client, and with it one connection pool
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=1000,
+                max_keepalive_connections=100,
+                keepalive_expiry=CONNECTION_KEEPALIVE_EXPIRY_SECONDS,
+            )
+        ),
+    )
+
+
+def _process_application_response(
+    tool_name: str,
+    json_response: dict[str, Any],
+    last_application_draft: Optional[ApplicationContent],
+) -> CreateInferenceResponse:
+    match tool_name:
+        case ApplicationFunction.CREATE_APPLICATION:
+            application_content: Optional[dict[str, Any]] = json_response.get(
+                ApplicationFunction.APPLICATION_CONTENT
+            )
+
+            # Ensure that the application name is in the correct format
+            if application_content and application_content.get(
+                ApplicationFunction.NAME
+            ):
+                application_content[ApplicationFunction.NAME] = (
+                    application_content[ApplicationFunction.NAME]
+                    .replace(" ", "_")
+                    .lower()
+                )
+
+            # Ensure that the table and column names are in the correct format
+            if application_content and application_content.get(
+                ApplicationFunction.TABLES
+            ):
+                for table in application_content[ApplicationFunction.TABLES]:
+                    _normalize_table_names(table=table)
+
+            # LLM keep putting this additional Primary Key column at the application level when it should be a per table parameter
+            if application_content and application_content.get(
+                ApplicationFunction.PRIMARY_KEY
+            ):
+                del application_content[ApplicationFunction.PRIMARY_KEY]
+
+            # LLM keep putting this overview at the application level when it should be not nested
+            if application_content and application_content.get(
+                ApplicationFunction.OVERVIEW
+            ):
+                json_response[ApplicationFunction.OVERVIEW] = application_content.get(
+                    ApplicationFunction.OVERVIEW
+                )
+                del application_content[ApplicationFunction.OVERVIEW]
+
+            # LLM keep putting this clarification at the application level when it should be not nested
+            if application_content and application_content.get(
+                ApplicationFunction.CLARIFICATION
+            ):
+                json_response[ApplicationFunction.CLARIFICATION] = (
+                    application_content.get(ApplicationFunction.CLARIFICATION)
+                )
+                del application_content[ApplicationFunction.CLARIFICATION]
+        case ApplicationFunction.PATCH_APPLICATION:
+            if last_application_draft is None:
+                raise ValueError("There is no application draft to patch.")
+            operations: list[PatchOperation] = [
+                PatchOperation.model_validate(operation)
+                for operation in json_response.pop(ApplicationFunction.OPERATIONS, [])
+            ]
+            json_response[ApplicationFunction.APPLICATION_CONTENT] = (
+                apply_application_patch(
+                    application=last_application_draft, operations=operations
+                ).model_dump()
+            )
+            METRICS.increment("application_patches_total")
+            METRICS.observe("application_patch_operations", len(operations))
+        case ApplicationFunction.CLARIFY:
+            pass
+        case ApplicationFunction.CONCLUDE:
+            json_response[ApplicationFunction.APPLICATION_CONTENT] = (
+                last_application_draft.model_dump()
+            )
+        case _:
+            raise ValueError(f"Unsupported tool name: {tool_name}")
+    log.info(f"Processed Application Creation Response: {json_response}")
+    return CreateInferenceResponse.model_validate(json_response)
+
+
+def _normalize_table_names(table: dict[str, Any]) -> None:
+    table[ApplicationFunction.NAME] = (
+        table[ApplicationFunction.NAME].replace(" ", "_").lower()
+    )
+    for column in table[ApplicationFunction.COLUMNS]:
+        column[ApplicationFunction.NAME] = (
+            column[ApplicationFunction.NAME].replace(" ", "_").lower()
+        )
+
+
+def _get_application_stream_event(path: Path, value: Any) -> CreateStreamEvent:
+    event_type: CreateStreamEventType = next(
+        event_type
+        for pattern, event_type in APPLICATION_STREAM_EVENTS.items()
+        if matches_path(path=path, pattern=pattern)
+    )
+    match event_type:
+        case CreateStreamEventType.APPLICATION_NAME:
+            value = value.replace(" ", "_").lower()
+        case CreateStreamEventType.TABLE:
+            if (
+                ApplicationFunction.NAME in value
+                and ApplicationFunction.COLUMNS in value
+            ):
+                _normalize_table_names(table=value)
+    return CreateStreamEvent(event=event_type, data=value)
+
+
+def _record_cancellation(stage: str) -> None:
+    """The provider stops generating once the connection of a cancelled request is closed, so the cancelled requests are the tokens saved by giving up on work nobody is waiting for."""
+    METRICS.increment("llm_requests_cancelled_total", labels={"stage": stage})
+    log.info(f"Cancelled {stage} request to OpenAI")
+
+
+def _record_usage(stage: str, usage: Optional[CompletionUsage]) -> None:
+    """Records how much of the prompt was served from the provider's prompt cache. The stable prefix of the prompts (system message, tools and canonical schema) should be cached on repeated turns against the same applications."""
+    if usage is None:
+        return
+    prompt_tokens_details: Any = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(prompt_tokens_details, dict):
+        cached_tokens: int = prompt_tokens_details.get("cached_tokens") or 0
+    else:
+        cached_tokens = getattr(prompt_tokens_details, "cached_tokens", None) or 0
+    labels: dict[str, str] = {"stage": stage}
+    METRICS.increment("llm_prompt_tokens_total", usage.prompt_tokens, labels=labels)
+    METRICS.increment("llm_cached_prompt_tokens_total", cached_tokens, labels=labels)
+    METRICS.increment(
+        "llm_completion_tokens_total", usage.completion_tokens, labels=labels
+    )
+    if usage.prompt_tokens:
+        METRICS.observe(
+            "llm_cached_prompt_token_fraction",
+            cached_tokens / usage.prompt_tokens,
+            labels=labels,
+        )
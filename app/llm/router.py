@@ -0,0 +1,329 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Optional
+
+from app.exceptions.exception import ProviderFailure
+from app.llm.base import LLMBaseModel
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent, Table
+from app.models.inference.create import CreateInferenceResponse, CreateStreamEvent
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    HttpMethod,
+    HttpMethodResponse,
+    SelectedGrouping,
+    SelectionResponse,
+    TableSelectionResponse,
+)
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Weight of the latest observation in the latency and error EWMAs
+EWMA_ALPHA: float = 0.2
+# A failure counts as this many seconds of latency when the backends are ranked
+ERROR_LATENCY_PENALTY_SECONDS: float = 10.0
+# Once the error EWMA of a backend crosses this threshold, it is only tried after every healthy backend until the cooldown has passed
+ERROR_RATE_THRESHOLD: float = 0.5
+COOLDOWN_SECONDS: float = 30.0
+ERROR_HALF_LIFE_SECONDS: float = 60.0
+# A measured backend that has not been used for this long gets the next message, so that a backend which was slower once is measured again instead of being ruled out for good
+PROBE_INTERVAL_SECONDS: float = 30.0
+
+
+@dataclass
+class BackendHealth:
+    latency_ewma: Optional[float] = None
+    error_ewma: float = 0.0
+    failed_at: Optional[float] = None
+    unavailable_until: float = 0.0
+    used_at: float = 0.0
+
+    @property
+    def is_measured(self) -> bool:
+        return self.latency_ewma is not None or self.failed_at is not None
+
+    def get_score(self, now: float) -> float:
+        return (self.latency_ewma or 0.0) + self.get_error_rate(
+            now=now
+        ) * ERROR_LATENCY_PENALTY_SECONDS
+
+    def get_error_rate(self, now: float) -> float:
+        # The error EWMA also decays while the backend is not being used, so that a backend which failed is eventually tried again
+        if self.failed_at is None:
+            return self.error_ewma
+        return self.error_ewma * 0.5 ** (
+            (now - self.failed_at) / ERROR_HALF_LIFE_SECONDS
+        )
+
+    def record_success(self, latency: float, now: float) -> None:
+        self.latency_ewma = (
+            latency
+            if self.latency_ewma is None
+            else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency_ewma
+        )
+        self.error_ewma = (1 - EWMA_ALPHA) * self.get_error_rate(now=now)
+        self.failed_at = None
+        self.used_at = now
+
+    def record_failure(self, now: float) -> None:
+        self.error_ewma = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.get_error_rate(now=now)
+        self.failed_at = now
+        self.used_at = now
+        if self.error_ewma >= ERROR_RATE_THRESHOLD:
+            self.unavailable_until = now + COOLDOWN_SECONDS
+
+
+class Router(LLMBaseModel):
+    """Routes every message across interchangeable backends (e.g. model variants) by their live latency and error EWMAs, failing over to the next backend when a backend fails. The router is itself an LLMBaseModel, so the generators do not need to know whether they are routed."""
+
+    def __init__(self, backends: list[LLMBaseModel]):
+        if not backends:
+            raise ValueError("At least one backend must be provided.")
+        # The primary backend determines the model config the generators see
+        super().__init__(
+            model_name=backends[0].model_name, model_config=backends[0].model_config
+        )
+        self._backends = backends
+        self._health: dict[str, BackendHealth] = {
+            backend.model_name: BackendHealth() for backend in backends
+        }
+
+    async def send_http_request_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        http_method: HttpMethod,
+        table: Table,
+    ) -> HttpMethodResponse:
+        return await self._route(
+            method_name="send_http_request_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            http_method=http_method,
+            table=table,
+        )
+
+    async def send_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> SelectionResponse:
+        return await self._route(
+            method_name="send_selection_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_application_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> ApplicationSelectionResponse:
+        return await self._route(
+            method_name="send_application_selection_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_table_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        grouping_indices: list[int],
+    ) -> TableSelectionResponse:
+        return await self._route(
+            method_name="send_table_selection_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            grouping_indices=grouping_indices,
+        )
+
+    async def send_clarification_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+    ) -> str:
+        return await self._route(
+            method_name="send_clarification_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+        )
+
+    async def send_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> CreateInferenceResponse:
+        return await self._route(
+            method_name="send_application_message",
+            system_message=system_message,
+            user_message=user_message,
+            last_application_draft=last_application_draft,
+        )
+
+    async def stream_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> AsyncIterator[CreateStreamEvent]:
+        """Events that were already sent to the client cannot be taken back, so the stream only fails over if the backend fails before its first event. The latency of a stream is its time to the first event."""
+        last_exception: Optional[Exception] = None
+        for backend in self._rank_backends():
+            start: float = time.monotonic()
+            has_yielded: bool = False
+            try:
+                async for event in backend.stream_application_message(
+                    system_message=system_message,
+                    user_message=user_message,
+                    last_application_draft=last_application_draft,
+                ):
+                    if not has_yielded:
+                        has_yielded = True
+                        self._record_success(
+                            backend=backend, latency=time.monotonic() - start
+                        )
+                    yield event
+                return
+            except ProviderFailure as e:
+                if has_yielded:
+                    raise e
+                self._record_failure(backend=backend, exception=e)
+                last_exception = e
+        raise last_exception
+
+    async def stream_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> AsyncIterator[SelectedGrouping]:
+        """Groupings that were already dispatched cannot be taken back, so the stream only fails over if the backend fails before its first grouping."""
+        last_exception: Optional[Exception] = None
+        for backend in self._rank_backends():
+            start: float = time.monotonic()
+            has_yielded: bool = False
+            try:
+                async for grouping in backend.stream_selection_message(
+                    system_message=system_message,
+                    context_message=context_message,
+                    user_message=user_message,
+                    applications=applications,
+                ):
+                    if not has_yielded:
+                        has_yielded = True
+                        self._record_success(
+                            backend=backend, latency=time.monotonic() - start
+                        )
+                    yield grouping
+                return
+            except ProviderFailure as e:
+                if has_yielded:
+                    raise e
+                self._record_failure(backend=backend, exception=e)
+                last_exception = e
+        raise last_exception
+
+    def _rank_backends(self) -> list[LLMBaseModel]:
+        now: float = time.monotonic()
+        # Backends are only measured once they have been failed over to, so the configured order is kept until then. Sorting is stable, so backends with the same rank keep their configured order as well
+        ranked_backends: list[LLMBaseModel] = sorted(
+            self._backends,
+            key=lambda backend: (
+                self._health[backend.model_name].unavailable_until > now,
+                not self._health[backend.model_name].is_measured,
+                self._health[backend.model_name].get_score(now=now),
+            ),
+        )
+        # Only the top ranked backend is measured by the messages, so one message per interval probes the backend that was used the longest ago
+        stale_backends: list[LLMBaseModel] = [
+            backend
+            for backend in ranked_backends[1:]
+            if self._health[backend.model_name].is_measured
+            and self._health[backend.model_name].unavailable_until <= now
+            and now - self._health[backend.model_name].used_at >= PROBE_INTERVAL_SECONDS
+        ]
+        if not stale_backends:
+            return ranked_backends
+        probed_backend: LLMBaseModel = min(
+            stale_backends,
+            key=lambda backend: self._health[backend.model_name].used_at,
+        )
+        # Marked as used straight away, so that the messages sent while the probe is in flight are not sent to it as well
+        self._health[probed_backend.model_name].used_at = now
+        METRICS.increment(
+            "llm_router_probes_total", labels={"backend": probed_backend.model_name}
+        )
+        log.info(f"Probing backend {probed_backend.model_name}")
+        ranked_backends.remove(probed_backend)
+        return [probed_backend] + ranked_backends
+
+    async def _route(self, method_name: str, **kwargs) -> Any:
+        last_exception: Optional[Exception] = None
+        for backend in self._rank_backends():
+            start: float = time.monotonic()
+            try:
+                response: Any = await getattr(backend, method_name)(**kwargs)
+            # Any other failure comes from the request or the response, which every backend would fail on
+            except ProviderFailure as e:
+                self._record_failure(backend=backend, exception=e)
+                last_exception = e
+                continue
+            self._record_success(backend=backend, latency=time.monotonic() - start)
+            return response
+        raise last_exception
+
+    def _record_success(self, backend: LLMBaseModel, latency: float) -> None:
+        health: BackendHealth = self._health[backend.model_name]
+        health.record_success(latency=latency, now=time.monotonic())
+        METRICS.increment(
+            "llm_router_requests_total",
+            labels={"backend": backend.model_name, "outcome": "success"},
+        )
+        self._export_health(model_name=backend.model_name)
+
+    def _record_failure(self, backend: LLMBaseModel, exception: Exception) -> None:
+        log.warning(f"Backend {backend.model_name} failed, failing over: {exception}")
+        health: BackendHealth = self._health[backend.model_name]
+        health.record_failure(now=time.monotonic())
+        METRICS.increment(
+            "llm_router_requests_total",
+            labels={"backend": backend.model_name, "outcome": "failure"},
+        )
+        self._export_health(model_name=backend.model_name)
+
+    def _export_health(self, model_name: str) -> None:
+        health: BackendHealth = self._health[model_name]
+        if health.latency_ewma is not None:
+            METRICS.set_gauge(
+                "llm_router_latency_ewma_seconds",
+                health.latency_ewma,
+                labels={"backend": model_name},
+            )
+        METRICS.set_gauge(
+            "llm_router_error_ewma",
+            health.get_error_rate(now=time.monotonic()),
+            labels={"backend": model_name},
+        )
@@ -0,0 +1,153 @@
+import logging
+from typing import Any, AsyncIterator, Optional
+
+from app.llm.base import LLMBaseModel
+from app.models.application import ApplicationContent, Table
+from app.models.inference.create import CreateInferenceResponse, CreateStreamEvent
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    HttpMethod,
+    HttpMethodResponse,
+    SelectedGrouping,
+    SelectionResponse,
+    TableSelectionResponse,
+)
+from app.scheduler.scheduler import FairScheduler
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+class ScheduledModel(LLMBaseModel):
+    """Makes every message wait for a slot of the tenant of the current request in the shared scheduler. The slot is held for the whole message, including every tier of a cascade and every backend a router fails over to, and for the whole of a stream."""
+
+    def __init__(self, model: LLMBaseModel, scheduler: FairScheduler):
+        super().__init__(model_name=model.model_name, model_config=model.model_config)
+        self._model = model
+        self._scheduler = scheduler
+
+    async def send_http_request_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        http_method: HttpMethod,
+        table: Table,
+    ) -> HttpMethodResponse:
+        return await self._send(
+            method_name="send_http_request_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            http_method=http_method,
+            table=table,
+        )
+
+    async def send_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> SelectionResponse:
+        return await self._send(
+            method_name="send_selection_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_application_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> ApplicationSelectionResponse:
+        return await self._send(
+            method_name="send_application_selection_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            applications=applications,
+        )
+
+    async def send_table_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        application: ApplicationContent,
+        grouping_indices: list[int],
+    ) -> TableSelectionResponse:
+        return await self._send(
+            method_name="send_table_selection_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+            application=application,
+            grouping_indices=grouping_indices,
+        )
+
+    async def send_clarification_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+    ) -> str:
+        return await self._send(
+            method_name="send_clarification_message",
+            system_message=system_message,
+            context_message=context_message,
+            user_message=user_message,
+        )
+
+    async def send_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> CreateInferenceResponse:
+        return await self._send(
+            method_name="send_application_message",
+            system_message=system_message,
+            user_message=user_message,
+            last_application_draft=last_application_draft,
+        )
+
+    async def stream_application_message(
+        self,
+        system_message: str,
+        user_message: str,
+        last_application_draft: Optional[ApplicationContent],
+    ) -> AsyncIterator[CreateStreamEvent]:
+        async with self._scheduler.schedule():
+            async for event in self._model.stream_application_message(
+                system_message=system_message,
+                user_message=user_message,
+                last_application_draft=last_application_draft,
+            ):
+                yield event
+
+    async def stream_selection_message(
+        self,
+        system_message: str,
+        context_message: str,
+        user_message: str,
+        applications: list[ApplicationContent],
+    ) -> AsyncIterator[SelectedGrouping]:
+        async with self._scheduler.schedule():
+            async for grouping in self._model.stream_selection_message(
+                system_message=system_message,
+                context_message=context_message,
+                user_message=user_message,
+                applications=applications,
+            ):
+                yield grouping
+
+    async def _send(self, method_name: str, **kwargs) -> Any:
+        async with self._scheduler.schedule():
+            return await getattr(self._model, method_name)(**kwargs)
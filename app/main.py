@@ -1,115 +1,533 @@
+import asyncio
+import json
 import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 
+from app.admission.admission import AdmissionController
+from app.cache.base import CacheStats
+from app.cache.factory import get_cache, get_state_store
 from app.config import (
     APPLICATION_CONFIG,
     CLARIFICATION_CONFIG,
+    CREATE_ADMISSION_CONFIG,
+    DEADLINE_CONFIG,
+    FAST_PATH_CONFIG,
     HTTP_REQUEST_CONFIG,
     SELECTION_CONFIG,
+    USE_ADMISSION_CONFIG,
 )
-from app.exceptions.exception import InferenceFailure
+from app.context.deadline import deadline, get_share_of_remaining_seconds
+from app.context.disconnect import cancel_on_disconnect
+from app.context.tenant import TENANT_HEADER, resolve_tenant_id, tenant
+from app.encoding.negotiation import NegotiatedRoute, create_response
+from app.exceptions.exception import DeadlineExceeded, InferenceFailure, QuotaExceeded
 from app.generator.create.application import ApplicationGenerator
 from app.generator.use.clarification import ClarificationGenerator
 from app.generator.use.http_request import HttpRequestGenerator
 from app.generator.use.selection import SelectionGenerator
-from app.models.inference.create import CreateInferenceRequest, CreateInferenceResponse
+from app.metrics.metrics import METRICS
+from app.models.inference.create import (
+    ApplicationDraft,
+    ApplicationDraftVersionResponse,
+    CreateApplicationDraftResponse,
+    CreateInferenceRequest,
+    CreateInferenceResponse,
+    CreateStreamEvent,
+    CreateStreamEventType,
+)
 from app.models.inference.use import (
+    CreateUseSessionRequest,
+    CreateUseSessionResponse,
     HttpMethodResponse,
     SelectionResponse,
     UseInferenceRequest,
     UseInferenceResponse,
+    UseSession,
+    UseSessionInferenceRequest,
 )
+from app.processor.intent import FastPathMatch, IntentMatcher
+from app.processor.plan import build_execution_plan
 from app.processor.postprocess import Postprocessor
-from app.processor.preprocess import Preprocessor
+from app.processor.preprocess import PreprocessedUseInferenceRequest, Preprocessor
+from app.session.draft import (
+    get_application_draft_store,
+    get_draft_operations,
+    get_draft_version,
+    get_latest_version,
+)
+from app.session.store import get_chat_history, get_use_session_store
+from app.warmup.warmup import (
+    is_ready,
+    keep_connections_alive,
+    record_recent_applications,
+    warm_up,
+)
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # The worker starts accepting connections straight away, but only reports that it is ready once the warmup is over
+    warmup_task: asyncio.Task[None] = asyncio.create_task(warm_up())
+    keepalive_task: asyncio.Task[None] = asyncio.create_task(keep_connections_alive())
+    yield
+    for task in (warmup_task, keepalive_task):
+        task.cancel()
+    await asyncio.gather(warmup_task, keepalive_task, return_exceptions=True)
+
+
+app = FastAPI(lifespan=lifespan)
+# Set before the routes are declared, as every route is created with it
+app.router.route_class = NegotiatedRoute
+
+USE_ADMISSION_CONTROLLER = AdmissionController(
+    endpoint="/inference/use",
+    max_in_flight=USE_ADMISSION_CONFIG.max_in_flight,
+    max_queue_depth=USE_ADMISSION_CONFIG.max_queue_depth,
+    queue_timeout_seconds=USE_ADMISSION_CONFIG.queue_timeout_seconds,
+)
+CREATE_ADMISSION_CONTROLLER = AdmissionController(
+    endpoint="/inference/create",
+    max_in_flight=CREATE_ADMISSION_CONFIG.max_in_flight,
+    max_queue_depth=CREATE_ADMISSION_CONFIG.max_queue_depth,
+    queue_timeout_seconds=CREATE_ADMISSION_CONFIG.queue_timeout_seconds,
+)
 
 
 @app.post("/inference/use")
-async def generate_use_response(input: UseInferenceRequest) -> JSONResponse:
-    try:
-        processed_input = Preprocessor().preprocess(input=input)
-        log.info("PREPROCESS COMPLETE")
-        log.info(processed_input)
-
-        selection_generator = SelectionGenerator(config=SELECTION_CONFIG)
-        selection_response: SelectionResponse = await selection_generator.generate(
-            applications=processed_input.applications,
-            message=processed_input.message,
-            chat_history=processed_input.chat_history,
+async def generate_use_response(
+    input: UseInferenceRequest, request: Request
+) -> Response:
+    with tenant(
+        tenant_id=resolve_tenant_id(
+            header=request.headers.get(TENANT_HEADER), applications=input.applications
         )
-        if not selection_response.relevant_groupings:
-            clarification_generator = ClarificationGenerator(
-                config=CLARIFICATION_CONFIG
-            )
-            clarification_response: str = await clarification_generator.generate(
-                applications=processed_input.applications,
-                message=processed_input.message,
-                chat_history=processed_input.chat_history,
+    ):
+        return await cancel_on_disconnect(
+            request=request,
+            awaitable=_generate_use_response(input=input, request=request),
+            endpoint="/inference/use",
+        )
+
+
+async def _generate_use_response(
+    input: UseInferenceRequest, request: Request
+) -> Response:
+    inference_response: UseInferenceResponse = await _infer_use_response(input=input)
+    return create_response(
+        request=request,
+        content=inference_response.model_dump(),
+    )
+
+
+async def _infer_use_response(input: UseInferenceRequest) -> UseInferenceResponse:
+    async with (
+        USE_ADMISSION_CONTROLLER.admit(),
+        deadline(
+            timeout_seconds=_get_timeout_seconds(input=input.timeout_seconds),
+            stage="use",
+        ),
+    ):
+        try:
+            processed_input: PreprocessedUseInferenceRequest = (
+                Preprocessor().preprocess(input=input)
             )
-            inference_response = UseInferenceResponse(
-                response=[],
-                clarification=clarification_response,
+            log.info("PREPROCESS COMPLETE")
+            log.info(processed_input)
+            await record_recent_applications(applications=input.applications)
+
+            fast_path_match: Optional[FastPathMatch] = None
+            if FAST_PATH_CONFIG.enabled:
+                fast_path_match = IntentMatcher(
+                    applications=processed_input.applications,
+                    confidence_threshold=FAST_PATH_CONFIG.confidence_threshold,
+                ).match(message=processed_input.message)
+
+            http_method_response_lst: Optional[list[HttpMethodResponse]] = None
+            if fast_path_match:
+                selection_response: SelectionResponse = (
+                    fast_path_match.selection_response
+                )
+                http_method_response_lst = fast_path_match.http_method_responses
+                log.info("SELECTION RESOLVED BY FAST PATH")
+            elif (
+                SELECTION_CONFIG.pipeline_selection
+                and not SELECTION_CONFIG.cascade_llm_types
+            ):
+                selection_generator = SelectionGenerator(config=SELECTION_CONFIG)
+                http_request_generator = HttpRequestGenerator(
+                    config=HTTP_REQUEST_CONFIG
+                )
+                selected_groupings, http_method_response_lst = (
+                    await http_request_generator.generate_from_stream(
+                        applications=processed_input.http_request_applications,
+                        message=processed_input.message,
+                        chat_history=processed_input.chat_history,
+                        groupings=selection_generator.stream(
+                            applications=processed_input.selection_applications,
+                            message=processed_input.message,
+                            chat_history=processed_input.chat_history,
+                        ),
+                        selection_timeout_seconds=get_share_of_remaining_seconds(
+                            fraction=DEADLINE_CONFIG.selection_fraction
+                        ),
+                    )
+                )
+                selection_response = SelectionResponse(
+                    relevant_groupings=selected_groupings or None
+                )
+            else:
+                selection_generator = SelectionGenerator(config=SELECTION_CONFIG)
+                async with deadline(
+                    timeout_seconds=get_share_of_remaining_seconds(
+                        fraction=DEADLINE_CONFIG.selection_fraction
+                    ),
+                    stage="selection",
+                ):
+                    selection_response = await selection_generator.generate(
+                        applications=processed_input.selection_applications,
+                        message=processed_input.message,
+                        chat_history=processed_input.chat_history,
+                    )
+            if not selection_response.relevant_groupings:
+                clarification_generator = ClarificationGenerator(
+                    config=CLARIFICATION_CONFIG
+                )
+                clarification_response: str = await clarification_generator.generate(
+                    applications=processed_input.applications,
+                    message=processed_input.message,
+                    chat_history=processed_input.chat_history,
+                )
+                return UseInferenceResponse(
+                    response=[],
+                    clarification=clarification_response,
+                )
+            log.info("SELECTION COMPLETE")
+
+            execution_plan: list[list[int]] = build_execution_plan(
+                groupings=selection_response.relevant_groupings
             )
-            return JSONResponse(
-                status_code=200,
-                content=inference_response.model_dump(),
+            log.info(f"EXECUTION PLAN: {execution_plan}")
+
+            if http_method_response_lst is None:
+                http_request_generator = HttpRequestGenerator(
+                    config=HTTP_REQUEST_CONFIG
+                )
+                http_method_response_lst = await http_request_generator.generate(
+                    applications=processed_input.http_request_applications,
+                    message=processed_input.message,
+                    chat_history=processed_input.chat_history,
+                    selection_response=selection_response,
+                    execution_plan=execution_plan,
+                )
+            log.info("HTTP REQUEST COMPLETE")
+
+            inference_response: UseInferenceResponse = Postprocessor().postprocess(
+                input=http_method_response_lst,
+                original_applications=input.applications,
+                execution_plan=execution_plan,
             )
-        log.info("SELECTION COMPLETE")
-
-        http_request_generator = HttpRequestGenerator(config=HTTP_REQUEST_CONFIG)
-        http_method_response_lst: list[HttpMethodResponse] = (
-            await http_request_generator.generate(
-                applications=processed_input.applications,
-                message=processed_input.message,
-                chat_history=processed_input.chat_history,
-                selection_response=selection_response,
+            log.info(inference_response)
+            log.info("USE INFERENCE COMPLETE")
+            return inference_response
+        except (DeadlineExceeded, QuotaExceeded) as e:
+            raise e
+        except InferenceFailure as e:
+            log.error(f"Inference failure: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            log.error(f"Unknown error in generating response: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/inference/use/sessions")
+async def create_use_session(input: CreateUseSessionRequest) -> JSONResponse:
+    session: UseSession = await get_use_session_store().create(
+        applications=input.applications
+    )
+    return JSONResponse(
+        status_code=200,
+        content=CreateUseSessionResponse(session_id=session.session_id).model_dump(),
+    )
+
+
+@app.post("/inference/use/sessions/{session_id}")
+async def generate_use_session_response(
+    session_id: str, input: UseSessionInferenceRequest, request: Request
+) -> Response:
+    return await cancel_on_disconnect(
+        request=request,
+        awaitable=_generate_use_session_response(
+            session_id=session_id, input=input, request=request
+        ),
+        endpoint="/inference/use/sessions",
+    )
+
+
+async def _generate_use_session_response(
+    session_id: str, input: UseSessionInferenceRequest, request: Request
+) -> Response:
+    """Runs the same inference as /inference/use against the chat history kept by the session, and appends the turn to it once the response is generated. A turn that fails is not appended, so the client can retry it."""
+    session: UseSession = get_use_session_store().attach_rows(
+        session=await get_use_session_store().get(session_id=session_id),
+        rows=input.rows,
+    )
+    if input.applications is not None:
+        session = session.model_copy(update={"applications": input.applications})
+    with tenant(
+        tenant_id=resolve_tenant_id(
+            header=request.headers.get(TENANT_HEADER),
+            applications=session.applications,
+        )
+    ):
+        inference_response: UseInferenceResponse = await _infer_use_response(
+            input=UseInferenceRequest(
+                applications=session.applications,
+                message=input.message,
+                chat_history=get_chat_history(session=session),
+                timeout_seconds=input.timeout_seconds,
             )
         )
-        log.info("HTTP REQUEST COMPLETE")
+    await get_use_session_store().save(
+        session=get_use_session_store().append_turn(
+            session=session,
+            message=input.message,
+            response=inference_response,
+        )
+    )
+    return create_response(
+        request=request,
+        content=inference_response.model_dump(),
+    )
+
+
+@app.delete("/inference/use/sessions/{session_id}")
+async def delete_use_session(session_id: str) -> JSONResponse:
+    await get_use_session_store().delete(session_id=session_id)
+    return JSONResponse(status_code=200, content={"session_id": session_id})
+
 
-        inference_response: UseInferenceResponse = Postprocessor().postprocess(
-            input=http_method_response_lst,
-            original_applications=input.applications,
+@app.post("/inference/create")
+async def generate_create_response(
+    input: CreateInferenceRequest, request: Request
+) -> Response:
+    with tenant(tenant_id=resolve_tenant_id(header=request.headers.get(TENANT_HEADER))):
+        return await cancel_on_disconnect(
+            request=request,
+            awaitable=_generate_create_response(input=input, request=request),
+            endpoint="/inference/create",
         )
-        log.info(inference_response)
-        log.info("USE INFERENCE COMPLETE")
 
-        return JSONResponse(
-            status_code=200,
-            content=inference_response.model_dump(),
+
+async def _generate_create_response(
+    input: CreateInferenceRequest, request: Request
+) -> Response:
+    async with (
+        CREATE_ADMISSION_CONTROLLER.admit(),
+        deadline(
+            timeout_seconds=_get_timeout_seconds(input=input.timeout_seconds),
+            stage="create",
+        ),
+    ):
+        draft: Optional[ApplicationDraft] = await _get_application_draft(
+            draft_id=input.draft_id
         )
-    except InferenceFailure as e:
-        log.error(f"Inference failure: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    except Exception as e:
-        log.error(f"Unknown error in generating response: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        try:
+            application_generator = ApplicationGenerator(config=APPLICATION_CONFIG)
+            inference_response: CreateInferenceResponse = (
+                await application_generator.generate(
+                    message=input.message,
+                    chat_history=input.chat_history,
+                    draft=draft,
+                )
+            )
+            if draft is not None:
+                inference_response = await _commit_application_draft(
+                    draft=draft, response=inference_response
+                )
+            log.info("CREATE INFERENCE COMPLETE")
+            return create_response(
+                request=request,
+                content=inference_response.model_dump(),
+            )
+        except (DeadlineExceeded, QuotaExceeded) as e:
+            raise e
+        except InferenceFailure as e:
+            log.error(f"Inference failure: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            log.error(f"Unknown error in generating response: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/inference/create")
-async def generate_use_response(input: CreateInferenceRequest) -> JSONResponse:
-    try:
-        application_generator = ApplicationGenerator(config=APPLICATION_CONFIG)
-        inference_response: CreateInferenceResponse = (
-            await application_generator.generate(
-                message=input.message,
-                chat_history=input.chat_history,
+@app.post("/inference/create/stream")
+async def stream_create_response(
+    input: CreateInferenceRequest, request: Request
+) -> StreamingResponse:
+    application_generator = ApplicationGenerator(config=APPLICATION_CONFIG)
+    # Fetched before the stream starts, so that a missing draft is a 404 instead of an error event
+    draft: Optional[ApplicationDraft] = await _get_application_draft(
+        draft_id=input.draft_id
+    )
+    # The stream is generated after the endpoint returns, so the tenant is set inside of it
+    tenant_id: str = resolve_tenant_id(header=request.headers.get(TENANT_HEADER))
+
+    async def stream_events() -> AsyncIterator[str]:
+        # The request stays admitted until the stream ends, not just until the response starts
+        await CREATE_ADMISSION_CONTROLLER.acquire()
+        start: float = time.monotonic()
+        try:
+            # Marks the point up to which the stream is started before the endpoint returns, and is never sent
+            yield ""
+            with tenant(tenant_id=tenant_id):
+                async with deadline(
+                    timeout_seconds=_get_timeout_seconds(input=input.timeout_seconds),
+                    stage="create",
+                ):
+                    async for event in application_generator.stream(
+                        message=input.message,
+                        chat_history=input.chat_history,
+                        draft=draft,
+                    ):
+                        if (
+                            draft is not None
+                            and event.event == CreateStreamEventType.RESPONSE
+                        ):
+                            response: CreateInferenceResponse = (
+                                await _commit_application_draft(
+                                    draft=draft,
+                                    response=CreateInferenceResponse.model_validate(
+                                        event.data
+                                    ),
+                                )
+                            )
+                            event = CreateStreamEvent(
+                                event=CreateStreamEventType.RESPONSE,
+                                data=response.model_dump(mode="json"),
+                            )
+                        yield _format_server_sent_event(event=event)
+            log.info("CREATE INFERENCE STREAM COMPLETE")
+        except (InferenceFailure, DeadlineExceeded, QuotaExceeded) as e:
+            log.error(f"Inference failure: {e}")
+            yield _format_server_sent_event(
+                event=CreateStreamEvent(
+                    event=CreateStreamEventType.ERROR, data=e.detail
+                )
             )
+        except Exception as e:
+            log.error(f"Unknown error in streaming response: {e}")
+            yield _format_server_sent_event(
+                event=CreateStreamEvent(event=CreateStreamEventType.ERROR, data=str(e))
+            )
+        except asyncio.CancelledError as e:
+            # The response stream is cancelled when the client disconnects, which cancels the provider stream along with it
+            METRICS.increment(
+                "client_disconnects_total",
+                labels={"endpoint": "/inference/create/stream"},
+            )
+            log.warning("Client disconnected from /inference/create/stream")
+            raise e
+        finally:
+            CREATE_ADMISSION_CONTROLLER.release(duration=time.monotonic() - start)
+
+    # Admitting the request before the response starts keeps a rejection a 503 with a Retry-After. From then on the slot belongs to the stream, whose finally also runs when it is closed or garbage collected without ever being sent, e.g. when the client disconnects first
+    events: AsyncIterator[str] = stream_events()
+    await anext(events)
+    return StreamingResponse(events, media_type="text/event-stream")
+
+
+@app.post("/inference/create/drafts")
+async def create_application_draft() -> JSONResponse:
+    draft: ApplicationDraft = await get_application_draft_store().create()
+    return JSONResponse(
+        status_code=200,
+        content=CreateApplicationDraftResponse(draft_id=draft.draft_id).model_dump(),
+    )
+
+
+@app.get("/inference/create/drafts/{draft_id}/versions/{version}")
+async def get_application_draft_version(draft_id: str, version: int) -> JSONResponse:
+    draft: ApplicationDraft = await get_application_draft_store().get(draft_id=draft_id)
+    return JSONResponse(
+        status_code=200,
+        content=ApplicationDraftVersionResponse(
+            draft_id=draft_id,
+            version=version,
+            application_content=get_draft_version(draft=draft, version=version),
+            operations=get_draft_operations(draft=draft, version=version),
+        ).model_dump(mode="json"),
+    )
+
+
+@app.delete("/inference/create/drafts/{draft_id}")
+async def delete_application_draft(draft_id: str) -> JSONResponse:
+    await get_application_draft_store().delete(draft_id=draft_id)
+    return JSONResponse(status_code=200, content={"draft_id": draft_id})
+
+
+async def _get_application_draft(draft_id: Optional[str]) -> Optional[ApplicationDraft]:
+    if draft_id is None:
+        return None
+    return await get_application_draft_store().get(draft_id=draft_id)
+
+
+async def _commit_application_draft(
+    draft: ApplicationDraft, response: CreateInferenceResponse
+) -> CreateInferenceResponse:
+    """Commits the generated application as the latest version of the draft. A response without an application (e.g. a clarification) refers to the latest version as it is."""
+    if response.application_content is not None:
+        draft = get_application_draft_store().commit(
+            draft=draft, application=response.application_content
         )
-        log.info("CREATE INFERENCE COMPLETE")
-        return JSONResponse(
-            status_code=200,
-            content=inference_response.model_dump(),
-        )
-    except InferenceFailure as e:
-        log.error(f"Inference failure: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    except Exception as e:
-        log.error(f"Unknown error in generating response: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    # Saved either way, which renews the TTL of the draft
+    await get_application_draft_store().save(draft=draft)
+    return response.model_copy(
+        update={"draft_version": get_latest_version(draft=draft)}
+    )
+
+
+def _get_timeout_seconds(input: Optional[float]) -> float:
+    if input is None:
+        return DEADLINE_CONFIG.default_timeout_seconds
+    return min(input, DEADLINE_CONFIG.max_timeout_seconds)
+
+
+def _format_server_sent_event(event: CreateStreamEvent) -> str:
+    return f"event: {event.event}\ndata: {json.dumps(event.data)}\n\n"
+
+
+@app.get("/health/live")
+async def get_liveness() -> JSONResponse:
+    return JSONResponse(status_code=200, content={"status": "live"})
+
+
+@app.get("/health/ready")
+async def get_readiness() -> JSONResponse:
+    """Returns a 503 until the worker is warmed up, so that the load balancer only sends it traffic once the first requests no longer pay for the warmup."""
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return JSONResponse(status_code=200, content={"status": "ready"})
+
+
+@app.get("/metrics")
+async def get_metrics() -> JSONResponse:
+    # The stats of the SQLite cache are read from the database, which must not block the event loop
+    cache_stats: CacheStats = await asyncio.to_thread(lambda: get_cache().stats())
+    METRICS.set_gauge("cache_entries", cache_stats.entries)
+    METRICS.set_gauge("cache_size_bytes", cache_stats.size_bytes)
+    state_store_stats: CacheStats = await asyncio.to_thread(
+        lambda: get_state_store().stats()
+    )
+    METRICS.set_gauge("state_store_entries", state_store_stats.entries)
+    METRICS.set_gauge("state_store_size_bytes", state_store_stats.size_bytes)
+    return JSONResponse(
+        status_code=200,
+        content=METRICS.snapshot(),
+    )
@@ -0,0 +1,75 @@
+import threading
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+
+class Summary(BaseModel):
+    count: int = 0
+    total: float = 0.0
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+
+class Metrics:
+    """In-process registry of counters, gauges and summaries. Every worker keeps its own registry, which is exposed through the /metrics endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._summaries: dict[str, Summary] = {}
+
+    def increment(
+        self, name: str, value: float = 1, labels: Optional[dict[str, str]] = None
+    ) -> None:
+        key: str = _get_key(name=name, labels=labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(
+        self, name: str, value: float, labels: Optional[dict[str, str]] = None
+    ) -> None:
+        key: str = _get_key(name=name, labels=labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(
+        self, name: str, value: float, labels: Optional[dict[str, str]] = None
+    ) -> None:
+        key: str = _get_key(name=name, labels=labels)
+        with self._lock:
+            self._summaries.setdefault(key, Summary()).observe(value)
+
+    def get_counter(self, name: str, labels: Optional[dict[str, str]] = None) -> float:
+        with self._lock:
+            return self._counters.get(_get_key(name=name, labels=labels), 0)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {
+                    key: summary.model_dump()
+                    for key, summary in self._summaries.items()
+                },
+            }
+
+
+def _get_key(name: str, labels: Optional[dict[str, str]]) -> str:
+    if not labels:
+        return name
+    formatted_labels: str = ",".join(
+        f'{label}="{value}"' for label, value in sorted(labels.items())
+    )
+    return f"{name}{{{formatted_labels}}}"
+
+
+METRICS = Metrics()
@@ -1,4 +1,5 @@
-from typing import Optional
+from enum import StrEnum
+from typing import Any, Optional
 
 from pydantic import BaseModel
 
@@ -8,11 +9,17 @@ from app.models.message import Message
 
 class CreateMessage(Message):
     application_content: Optional[ApplicationContent] = None
+    # Refers to a version of the draft of the request instead of inlining its application_content
+    draft_version: Optional[int] = None
 
 
 class CreateInferenceRequest(BaseModel):
     message: str
     chat_history: list[CreateMessage]
+    # The latest version of this draft is used as the last application draft, and the generated application is committed to it as a new version
+    draft_id: Optional[str] = None
+    # The server's default timeout applies if this is not set
+    timeout_seconds: Optional[float] = None
 
 
 class CreateInferenceResponse(BaseModel):
@@ -20,3 +27,68 @@ class CreateInferenceResponse(BaseModel):
     overview: Optional[str] = None
     clarification: Optional[str] = None
     concluding_message: Optional[str] = None
+    # Only set if the request has a draft. The version of the draft that application_content was committed as
+    draft_version: Optional[int] = None
+
+
+class CreateStreamEventType(StrEnum):
+    TOOL = "tool"
+    APPLICATION_NAME = "application_name"
+    TABLE = "table"
+    OVERVIEW = "overview"
+    CLARIFICATION = "clarification"
+    CONCLUDING_MESSAGE = "concluding_message"
+    RESPONSE = "response"
+    ERROR = "error"
+
+
+class CreateStreamEvent(BaseModel):
+    event: CreateStreamEventType
+    data: Any
+
+
+class PatchOperationType(StrEnum):
+    ADD_TABLE = "add_table"
+    REMOVE_TABLE = "remove_table"
+    ALTER_TABLE = "alter_table"
+    ADD_COLUMN = "add_column"
+    REMOVE_COLUMN = "remove_column"
+    ALTER_COLUMN = "alter_column"
+
+
+class PatchOperation(BaseModel):
+    operation: PatchOperationType
+    table_name: str
+    column_name: Optional[str] = None
+    # The full definition of the added table or column
+    table: Optional[dict[str, Any]] = None
+    column: Optional[dict[str, Any]] = None
+    # The fields of the altered table or column that change, e.g. {"name": "new_name"}
+    changes: Optional[dict[str, Any]] = None
+
+
+class ApplicationDraftVersion(BaseModel):
+    version: int
+    # The edit operations that turn the previous version into this one. Versions that the operations cannot describe are stored whole in application_content instead
+    operations: Optional[list[PatchOperation]] = None
+    application_content: Optional[ApplicationContent] = None
+
+
+class ApplicationDraft(BaseModel):
+    draft_id: str
+    # The oldest version that is kept is always stored whole
+    versions: list[ApplicationDraftVersion] = []
+    # The latest version, kept whole so that it does not have to be rebuilt on every turn
+    head: Optional[ApplicationContent] = None
+
+
+class CreateApplicationDraftResponse(BaseModel):
+    draft_id: str
+
+
+class ApplicationDraftVersionResponse(BaseModel):
+    draft_id: str
+    version: int
+    application_content: ApplicationContent
+    # The edit operations from the previous version, if they could be described
+    operations: Optional[list[PatchOperation]] = None
@@ -1,7 +1,7 @@
 from enum import StrEnum
 from typing import Any, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from app.models.application import ApplicationContent
 from app.models.message import Message
@@ -9,6 +9,17 @@ from app.models.message import Message
 
 class UseMessage(Message):
     rows: Optional[list[dict[str, Any]]] = None
+    # How the message is rendered into the chat history of the prompts, which is filled in by the first prompt that renders it
+    _prompt_fragment: Optional[str] = PrivateAttr(default=None)
+
+    def model_copy(
+        self, *, update: Optional[dict[str, Any]] = None, deep: bool = False
+    ) -> "UseMessage":
+        """A copy that changes the message no longer matches the prompt fragment of the original."""
+        message: UseMessage = super().model_copy(update=update, deep=deep)
+        if update:
+            message._prompt_fragment = None
+        return message
 
 
 class HttpMethod(StrEnum):
@@ -22,6 +33,8 @@ class UseInferenceRequest(BaseModel):
     applications: list[ApplicationContent]
     message: str
     chat_history: list[UseMessage]
+    # The server's default timeout applies if this is not set
+    timeout_seconds: Optional[float] = None
 
 
 class SelectedGrouping(BaseModel):
@@ -29,18 +42,55 @@ class SelectedGrouping(BaseModel):
     application_name: str
     table_name: str
     http_method: HttpMethod
+    depends_on: list[int] = []
 
 
 class SelectionResponse(BaseModel):
     relevant_groupings: Optional[list[SelectedGrouping]]
 
 
+class SelectedApplicationGrouping(BaseModel):
+    task: str
+    application_name: str
+    http_method: HttpMethod
+    depends_on: list[int] = []
+
+
+class ApplicationSelectionResponse(BaseModel):
+    relevant_groupings: Optional[list[SelectedApplicationGrouping]]
+
+
+class SelectedTable(BaseModel):
+    grouping_index: int
+    table_name: str
+
+
+class TableSelectionResponse(BaseModel):
+    selected_tables: list[SelectedTable]
+
+
 class HttpMethodRequest(BaseModel):
     application: ApplicationContent
     http_method: HttpMethod
     filter_conditions: dict[str, Any]
 
 
+class SqlStatement(BaseModel):
+    # PostgreSQL statement with $1, $2, ... placeholders for the parameters
+    template: str
+    parameters: list[Any]
+    # Hash of the template, which is the same for every statement of the same shape regardless of its parameters
+    fingerprint: str
+
+
+class BulkInsertSummary(BaseModel):
+    # Number of rows left after the duplicates were removed
+    row_count: int
+    # Number of LLM calls the rows were generated in
+    chunk_count: int
+    duplicate_row_count: int
+
+
 class HttpMethodResponse(BaseModel):
     http_method: HttpMethod
     application: ApplicationContent
@@ -48,8 +98,45 @@ class HttpMethodResponse(BaseModel):
     inserted_rows: Optional[list[dict[str, Any]]] = None
     filter_conditions: Optional[dict[str, Any]] = None
     updated_data: Optional[dict[str, Any]] = None
+    # Only set for POST requests whose rows were generated in chunks
+    bulk_insert: Optional[BulkInsertSummary] = None
+    # Only set for POST requests whose rows were cut off by the output limit, so that the rows after the last complete one are missing. The HTTP request stage generates the missing rows before it responds
+    is_truncated: bool = False
+    # Compiled in the post-processing step, so that the executor does not have to interpret the parameters above
+    sql: Optional[SqlStatement] = None
 
 
 class UseInferenceResponse(BaseModel):
     response: list[HttpMethodResponse]
     clarification: Optional[str] = None
+    # Each level holds indices into response. Requests within a level are independent of each other and can be executed in parallel, but every level must complete before the next one starts.
+    execution_plan: Optional[list[list[int]]] = None
+
+
+class CreateUseSessionRequest(BaseModel):
+    applications: list[ApplicationContent]
+
+
+class CreateUseSessionResponse(BaseModel):
+    session_id: str
+
+
+class UseSessionInferenceRequest(BaseModel):
+    message: str
+    # The rows returned by executing the requests of the previous turn, which are attached to its response in the chat history
+    rows: Optional[list[dict[str, Any]]] = None
+    # Replaces the applications of the session if set
+    applications: Optional[list[ApplicationContent]] = None
+    # The server's default timeout applies if this is not set
+    timeout_seconds: Optional[float] = None
+
+
+class UseSession(BaseModel):
+    session_id: str
+    applications: list[ApplicationContent]
+    # Only the latest messages are kept, and the rows of all but the latest message are cut down
+    chat_history: list[UseMessage] = []
+    # Summary of the messages that no longer fit in the chat history
+    summary: Optional[str] = None
+    # The prompt fragments of the messages of the chat history, so that the messages that did not change are not rendered again on every turn
+    chat_history_fragments: list[str] = []
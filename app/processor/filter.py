@@ -0,0 +1,336 @@
+import logging
+from typing import Any, Optional
+
+from app.prompts.use.functions import HttpMethodFunction
+from app.prompts.use.schema import canonicalize
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# An empty AND is always true and an empty OR is always false, which is how the optimizer spells out tautologies and contradictions
+TRUE_FILTER_CONDITIONS: dict[str, Any] = {
+    HttpMethodFunction.BOOLEAN_CLAUSE: "AND",
+    HttpMethodFunction.CONDITIONS: [],
+}
+FALSE_FILTER_CONDITIONS: dict[str, Any] = {
+    HttpMethodFunction.BOOLEAN_CLAUSE: "OR",
+    HttpMethodFunction.CONDITIONS: [],
+}
+RANGE_OPERATORS: set[str] = {">", ">=", "<", "<="}
+
+
+def optimize_filter_conditions(filter_conditions: dict[str, Any]) -> dict[str, Any]:
+    """Rewrites the filter conditions into an equivalent canonical tree: nested clauses of the same kind are flattened, single-child clauses are unwrapped, equality predicates on a column are folded into IN, duplicates are removed and the conditions are sorted, so that equivalent filters are byte-identical. Contradictions fold into an empty OR and tautologies into an empty AND. The root is always a clause."""
+    optimized: dict[str, Any] = _optimize(condition=filter_conditions)
+    if not _is_clause(condition=optimized):
+        return {
+            HttpMethodFunction.BOOLEAN_CLAUSE: "AND",
+            HttpMethodFunction.CONDITIONS: [optimized],
+        }
+    return optimized
+
+
+def count_predicates(condition: dict[str, Any]) -> int:
+    if _is_clause(condition=condition):
+        return sum(
+            count_predicates(condition=sub_condition)
+            for sub_condition in condition[HttpMethodFunction.CONDITIONS]
+        )
+    return 1
+
+
+def _optimize(condition: dict[str, Any]) -> dict[str, Any]:
+    if not _is_clause(condition=condition):
+        return _normalize_predicate(predicate=condition)
+
+    boolean_clause: str = condition[HttpMethodFunction.BOOLEAN_CLAUSE]
+    # The empty clause of the other kind absorbs the whole clause, e.g. x AND FALSE is FALSE
+    absorbing_element: dict[str, Any] = (
+        FALSE_FILTER_CONDITIONS if boolean_clause == "AND" else TRUE_FILTER_CONDITIONS
+    )
+    conditions: list[dict[str, Any]] = []
+    for sub_condition in condition[HttpMethodFunction.CONDITIONS]:
+        optimized: dict[str, Any] = _optimize(condition=sub_condition)
+        if optimized == absorbing_element:
+            return absorbing_element
+        if (
+            _is_clause(condition=optimized)
+            and optimized[HttpMethodFunction.BOOLEAN_CLAUSE] == boolean_clause
+        ):
+            conditions.extend(optimized[HttpMethodFunction.CONDITIONS])
+        else:
+            conditions.append(optimized)
+
+    folded_conditions: Optional[list[dict[str, Any]]] = (
+        _fold_conjunction(conditions=conditions)
+        if boolean_clause == "AND"
+        else _fold_disjunction(conditions=conditions)
+    )
+    if folded_conditions is None:
+        return absorbing_element
+
+    unique_conditions: dict[str, dict[str, Any]] = {
+        canonicalize(folded_condition): folded_condition
+        for folded_condition in folded_conditions
+    }
+    sorted_conditions: list[dict[str, Any]] = [
+        unique_conditions[key] for key in sorted(unique_conditions)
+    ]
+    if len(sorted_conditions) == 1:
+        return sorted_conditions[0]
+    return {
+        HttpMethodFunction.BOOLEAN_CLAUSE: boolean_clause,
+        HttpMethodFunction.CONDITIONS: sorted_conditions,
+    }
+
+
+def _normalize_predicate(predicate: dict[str, Any]) -> dict[str, Any]:
+    if predicate[HttpMethodFunction.OPERATOR] != "IN" or not _is_scalar_list(
+        value=predicate[HttpMethodFunction.VALUE]
+    ):
+        return predicate
+    values: list[Any] = _get_unique_values(values=predicate[HttpMethodFunction.VALUE])
+    if not values:
+        return FALSE_FILTER_CONDITIONS
+    return _build_membership_predicate(
+        column_name=predicate[HttpMethodFunction.COLUMN], values=values
+    )
+
+
+def _fold_disjunction(
+    conditions: list[dict[str, Any]]
+) -> Optional[list[dict[str, Any]]]:
+    """Folds x = 1 OR x = 2 OR x IN (3) into x IN (1, 2, 3). Nothing else is folded, as x = 1 OR x != 1 is not a tautology for the rows where x is NULL."""
+    values_by_column_name: dict[str, list[Any]] = {}
+    folded_conditions: list[dict[str, Any]] = []
+    for condition in conditions:
+        values: Optional[list[Any]] = _get_membership_values(condition=condition)
+        if values is None:
+            folded_conditions.append(condition)
+            continue
+        values_by_column_name.setdefault(
+            condition[HttpMethodFunction.COLUMN], []
+        ).extend(values)
+
+    for column_name, values in values_by_column_name.items():
+        folded_conditions.append(
+            _build_membership_predicate(
+                column_name=column_name, values=_get_unique_values(values=values)
+            )
+        )
+    return folded_conditions
+
+
+def _fold_conjunction(
+    conditions: list[dict[str, Any]]
+) -> Optional[list[dict[str, Any]]]:
+    """Intersects the equality, IN, != and numeric range predicates on the same column, e.g. x IN (1, 2, 3) AND x != 2 AND x > 1 becomes x = 3, and keeps only the tightest bounds of a range. Returns None if the predicates on a column contradict each other."""
+    predicates_by_column_name: dict[str, list[dict[str, Any]]] = {}
+    folded_conditions: list[dict[str, Any]] = []
+    for condition in conditions:
+        if _is_clause(condition=condition) or not _is_foldable_in_conjunction(
+            predicate=condition
+        ):
+            folded_conditions.append(condition)
+            continue
+        predicates_by_column_name.setdefault(
+            condition[HttpMethodFunction.COLUMN], []
+        ).append(condition)
+
+    for column_name, predicates in predicates_by_column_name.items():
+        column_conditions: Optional[list[dict[str, Any]]] = _fold_column_conjunction(
+            column_name=column_name, predicates=predicates
+        )
+        if column_conditions is None:
+            log.info(f"Contradicting filter conditions on column {column_name}")
+            return None
+        folded_conditions.extend(column_conditions)
+    return folded_conditions
+
+
+def _fold_column_conjunction(
+    column_name: str, predicates: list[dict[str, Any]]
+) -> Optional[list[dict[str, Any]]]:
+    allowed_values: Optional[list[Any]] = None
+    excluded_keys: set[str] = set()
+    range_predicates: list[dict[str, Any]] = []
+    for predicate in predicates:
+        operator: str = predicate[HttpMethodFunction.OPERATOR]
+        if operator == "!=":
+            excluded_keys.add(canonicalize(predicate[HttpMethodFunction.VALUE]))
+        elif operator in RANGE_OPERATORS:
+            range_predicates.append(predicate)
+        else:
+            values: list[Any] = _get_membership_values(condition=predicate)
+            if allowed_values is None:
+                allowed_values = _get_unique_values(values=values)
+            else:
+                keys: set[str] = {canonicalize(value) for value in values}
+                allowed_values = [
+                    value for value in allowed_values if canonicalize(value) in keys
+                ]
+
+    if allowed_values is not None:
+        # The range predicates can only be checked against numbers, and are otherwise left for the database to filter
+        can_check_range: bool = all(_is_number(value=value) for value in allowed_values)
+        allowed_values = [
+            value
+            for value in allowed_values
+            if canonicalize(value) not in excluded_keys
+            and (
+                not can_check_range
+                or all(
+                    _satisfies_range(value=value, predicate=range_predicate)
+                    for range_predicate in range_predicates
+                )
+            )
+        ]
+        if not allowed_values:
+            return None
+        # Every other predicate on the column is implied by the remaining values
+        return [
+            _build_membership_predicate(column_name=column_name, values=allowed_values)
+        ] + ([] if can_check_range else range_predicates)
+
+    column_conditions: list[dict[str, Any]] = [
+        {
+            HttpMethodFunction.COLUMN: column_name,
+            HttpMethodFunction.OPERATOR: "!=",
+            HttpMethodFunction.VALUE: value,
+        }
+        for value in _get_unique_values(
+            values=[
+                predicate[HttpMethodFunction.VALUE]
+                for predicate in predicates
+                if predicate[HttpMethodFunction.OPERATOR] == "!="
+            ]
+        )
+    ]
+    lower_bound: Optional[dict[str, Any]] = _get_tightest_bound(
+        predicates=[
+            predicate
+            for predicate in range_predicates
+            if predicate[HttpMethodFunction.OPERATOR] in {">", ">="}
+        ],
+        is_lower_bound=True,
+    )
+    upper_bound: Optional[dict[str, Any]] = _get_tightest_bound(
+        predicates=[
+            predicate
+            for predicate in range_predicates
+            if predicate[HttpMethodFunction.OPERATOR] in {"<", "<="}
+        ],
+        is_lower_bound=False,
+    )
+    if lower_bound is not None and upper_bound is not None:
+        lower_value: float = lower_bound[HttpMethodFunction.VALUE]
+        upper_value: float = upper_bound[HttpMethodFunction.VALUE]
+        if lower_value > upper_value or (
+            lower_value == upper_value
+            and (
+                lower_bound[HttpMethodFunction.OPERATOR] == ">"
+                or upper_bound[HttpMethodFunction.OPERATOR] == "<"
+            )
+        ):
+            return None
+    column_conditions.extend(
+        bound for bound in (lower_bound, upper_bound) if bound is not None
+    )
+    return column_conditions
+
+
+def _get_tightest_bound(
+    predicates: list[dict[str, Any]], is_lower_bound: bool
+) -> Optional[dict[str, Any]]:
+    tightest_bound: Optional[dict[str, Any]] = None
+    for predicate in predicates:
+        if tightest_bound is None:
+            tightest_bound = predicate
+            continue
+        value: float = predicate[HttpMethodFunction.VALUE]
+        tightest_value: float = tightest_bound[HttpMethodFunction.VALUE]
+        # Of two bounds on the same value, the strict one is tighter
+        is_tighter: bool = (
+            value > tightest_value if is_lower_bound else value < tightest_value
+        ) or (
+            value == tightest_value
+            and predicate[HttpMethodFunction.OPERATOR] in {">", "<"}
+        )
+        if is_tighter:
+            tightest_bound = predicate
+    return tightest_bound
+
+
+def _satisfies_range(value: float, predicate: dict[str, Any]) -> bool:
+    bound: float = predicate[HttpMethodFunction.VALUE]
+    match predicate[HttpMethodFunction.OPERATOR]:
+        case ">":
+            return value > bound
+        case ">=":
+            return value >= bound
+        case "<":
+            return value < bound
+        case "<=":
+            return value <= bound
+        case _:
+            raise ValueError(
+                f"Unsupported range operator: {predicate[HttpMethodFunction.OPERATOR]}"
+            )
+
+
+def _is_foldable_in_conjunction(predicate: dict[str, Any]) -> bool:
+    operator: str = predicate[HttpMethodFunction.OPERATOR]
+    value: Any = predicate[HttpMethodFunction.VALUE]
+    if operator == "!=":
+        return _is_scalar(value=value)
+    if operator in RANGE_OPERATORS:
+        return _is_number(value=value)
+    return _get_membership_values(condition=predicate) is not None
+
+
+def _get_membership_values(condition: dict[str, Any]) -> Optional[list[Any]]:
+    """Returns the values of an = or IN predicate, or None if the condition is not one. Predicates on NULL are never folded, as = NULL does not behave like the other values."""
+    if _is_clause(condition=condition):
+        return None
+    operator: str = condition[HttpMethodFunction.OPERATOR]
+    value: Any = condition[HttpMethodFunction.VALUE]
+    if operator == "=" and _is_scalar(value=value):
+        return [value]
+    if operator == "IN" and _is_scalar_list(value=value):
+        return value
+    return None
+
+
+def _build_membership_predicate(column_name: str, values: list[Any]) -> dict[str, Any]:
+    if len(values) == 1:
+        return {
+            HttpMethodFunction.COLUMN: column_name,
+            HttpMethodFunction.OPERATOR: "=",
+            HttpMethodFunction.VALUE: values[0],
+        }
+    return {
+        HttpMethodFunction.COLUMN: column_name,
+        HttpMethodFunction.OPERATOR: "IN",
+        HttpMethodFunction.VALUE: sorted(values, key=canonicalize),
+    }
+
+
+def _get_unique_values(values: list[Any]) -> list[Any]:
+    # Compared by their JSON form, as True == 1 in Python but not in the database
+    return list({canonicalize(value): value for value in values}.values())
+
+
+def _is_clause(condition: dict[str, Any]) -> bool:
+    return HttpMethodFunction.BOOLEAN_CLAUSE in condition
+
+
+def _is_scalar(value: Any) -> bool:
+    return isinstance(value, (str, int, float))
+
+
+def _is_scalar_list(value: Any) -> bool:
+    return isinstance(value, list) and all(_is_scalar(value=item) for item in value)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -0,0 +1,333 @@
+import logging
+import re
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent, PrimaryKey, Table
+from app.models.inference.use import (
+    HttpMethod,
+    HttpMethodResponse,
+    SelectedGrouping,
+    SelectionResponse,
+)
+from app.prompts.use.functions import HttpMethodFunction
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+VERB_TO_HTTP_METHOD: dict[str, HttpMethod] = {
+    "show": HttpMethod.GET,
+    "list": HttpMethod.GET,
+    "get": HttpMethod.GET,
+    "display": HttpMethod.GET,
+    "view": HttpMethod.GET,
+    "find": HttpMethod.GET,
+    "fetch": HttpMethod.GET,
+    "add": HttpMethod.POST,
+    "create": HttpMethod.POST,
+    "insert": HttpMethod.POST,
+    "update": HttpMethod.PUT,
+    "change": HttpMethod.PUT,
+    "edit": HttpMethod.PUT,
+    "mark": HttpMethod.PUT,
+    "set": HttpMethod.PUT,
+    "rename": HttpMethod.PUT,
+    "delete": HttpMethod.DELETE,
+    "remove": HttpMethod.DELETE,
+}
+
+FILLER_WORDS: set[str] = {
+    "#",
+    "a",
+    "all",
+    "an",
+    "as",
+    "every",
+    "for",
+    "from",
+    "id",
+    "in",
+    "me",
+    "my",
+    "new",
+    "no",
+    "number",
+    "of",
+    "please",
+    "the",
+    "to",
+    "with",
+}
+
+# These words hint at multiple tasks, conditions or references to the chat history, which only the LLM can resolve
+AMBIGUOUS_WORDS: set[str] = {
+    "after",
+    "again",
+    "also",
+    "and",
+    "before",
+    "but",
+    "if",
+    "it",
+    "not",
+    "or",
+    "same",
+    "that",
+    "them",
+    "then",
+    "these",
+    "this",
+    "those",
+    "which",
+    "where",
+}
+
+MAX_TOKEN_COUNT: int = 12
+MAX_TABLE_NAME_TOKEN_COUNT: int = 3
+SELECTION_CONFIDENCE: float = 0.9
+UNKNOWN_TOKEN_PENALTY: float = 0.05
+
+UUID_PATTERN = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"
+)
+INTEGER_PATTERN = re.compile(r"^\d+$")
+# A number only refers to a row if it follows one of these words (or the name of the table, e.g. "task 3"). Any other number is more likely an amount or a year, e.g. "delete 3 tasks" or "show tasks from 2023"
+IDENTIFIER_PREFIXES: set[str] = {"#", "id", "number"}
+
+
+class FastPathMatch(BaseModel):
+    confidence: float
+    selection_response: SelectionResponse
+    # Only set when the instruction is simple enough for the request parameters to be resolved without the LLM as well
+    http_method_responses: Optional[list[HttpMethodResponse]] = None
+
+
+class IntentMatcher:
+    """Deterministically resolves trivial single-table instructions (e.g. "show all tasks", "delete todo 5") from the table and column names of the applications, so that they do not need a round trip to the LLM."""
+
+    def __init__(
+        self, applications: list[ApplicationContent], confidence_threshold: float
+    ):
+        self._applications = applications
+        self._confidence_threshold = confidence_threshold
+        self._application_names: set[str] = {
+            application.name for application in applications
+        }
+        self._table_aliases: dict[tuple[str, ...], list[tuple[str, str]]] = {}
+        self._known_words: set[str] = set()
+        for application in applications:
+            for table in application.tables:
+                for alias in _get_table_aliases(table_name=table.name):
+                    self._table_aliases.setdefault(alias, []).append(
+                        (application.name, table.name)
+                    )
+                for column in table.columns:
+                    self._known_words.update(column.name.split("_"))
+                    self._known_words.update(
+                        value.lower() for value in column.enum_values or []
+                    )
+
+    def match(self, message: str) -> Optional[FastPathMatch]:
+        METRICS.increment("fast_path_attempts_total")
+        fast_path_match: Optional[FastPathMatch] = self._match(message=message)
+        if (
+            fast_path_match is None
+            or fast_path_match.confidence < self._confidence_threshold
+        ):
+            METRICS.increment("fast_path_misses_total")
+            return None
+
+        METRICS.increment(
+            "fast_path_hits_total",
+            labels={
+                "resolution": (
+                    "response" if fast_path_match.http_method_responses else "selection"
+                )
+            },
+        )
+        METRICS.observe("fast_path_confidence", fast_path_match.confidence)
+        log.info(f"Fast path match: {fast_path_match}")
+        return fast_path_match
+
+    def _match(self, message: str) -> Optional[FastPathMatch]:
+        tokens: list[str] = _tokenize(message=message)
+        while tokens and tokens[0] == "please":
+            tokens = tokens[1:]
+        if not tokens or len(tokens) > MAX_TOKEN_COUNT:
+            return None
+        if any(token in AMBIGUOUS_WORDS for token in tokens):
+            return None
+
+        http_method: Optional[HttpMethod] = VERB_TO_HTTP_METHOD.get(tokens[0])
+        if http_method is None:
+            return None
+
+        matched_tables: set[tuple[str, str]] = set()
+        identifiers: list[str] = []
+        unknown_token_count: int = 0
+        mentions_column: bool = False
+        position: int = 1
+        follows_table: bool = False
+        while position < len(tokens):
+            table_match: Optional[tuple[int, list[tuple[str, str]]]] = (
+                self._match_table(tokens=tokens, position=position)
+            )
+            if table_match:
+                length, tables = table_match
+                matched_tables.update(tables)
+                position += length
+                follows_table = True
+                continue
+
+            token: str = tokens[position]
+            if INTEGER_PATTERN.match(token) or UUID_PATTERN.match(token):
+                if follows_table or tokens[position - 1] in IDENTIFIER_PREFIXES:
+                    identifiers.append(token)
+                else:
+                    unknown_token_count += 1
+            elif token in self._known_words:
+                mentions_column = True
+            elif token not in FILLER_WORDS and token not in self._application_names:
+                unknown_token_count += 1
+            follows_table = False
+            position += 1
+
+        if len(matched_tables) != 1:
+            return None
+        application_name, table_name = next(iter(matched_tables))
+        selection_response = SelectionResponse(
+            relevant_groupings=[
+                SelectedGrouping(
+                    task=message,
+                    application_name=application_name,
+                    table_name=table_name,
+                    http_method=http_method,
+                )
+            ]
+        )
+
+        if (
+            http_method in (HttpMethod.GET, HttpMethod.DELETE)
+            and not unknown_token_count
+            and not mentions_column
+            and len(identifiers) <= 1
+        ):
+            filter_conditions: Optional[dict[str, Any]] = self._get_filter_conditions(
+                application_name=application_name,
+                table_name=table_name,
+                http_method=http_method,
+                identifiers=identifiers,
+            )
+            if filter_conditions is not None:
+                return FastPathMatch(
+                    confidence=1.0,
+                    selection_response=selection_response,
+                    http_method_responses=[
+                        HttpMethodResponse(
+                            http_method=http_method,
+                            application=self._get_application(
+                                application_name=application_name
+                            ),
+                            table_name=table_name,
+                            filter_conditions=filter_conditions,
+                        )
+                    ],
+                )
+
+        return FastPathMatch(
+            confidence=max(
+                0.0, SELECTION_CONFIDENCE - UNKNOWN_TOKEN_PENALTY * unknown_token_count
+            ),
+            selection_response=selection_response,
+        )
+
+    def _match_table(
+        self, tokens: list[str], position: int
+    ) -> Optional[tuple[int, list[tuple[str, str]]]]:
+        for length in range(MAX_TABLE_NAME_TOKEN_COUNT, 0, -1):
+            alias: tuple[str, ...] = tuple(tokens[position : position + length])
+            if len(alias) == length and alias in self._table_aliases:
+                return length, self._table_aliases[alias]
+        return None
+
+    def _get_application(self, application_name: str) -> ApplicationContent:
+        return next(
+            application
+            for application in self._applications
+            if application.name == application_name
+        )
+
+    def _get_filter_conditions(
+        self,
+        application_name: str,
+        table_name: str,
+        http_method: HttpMethod,
+        identifiers: list[str],
+    ) -> Optional[dict[str, Any]]:
+        """Returns None if the filter conditions cannot be resolved with certainty."""
+        if not identifiers:
+            # Deleting every row of a table is destructive enough that the LLM should confirm the instruction
+            if http_method == HttpMethod.DELETE:
+                return None
+            return {
+                HttpMethodFunction.BOOLEAN_CLAUSE: "AND",
+                HttpMethodFunction.CONDITIONS: [],
+            }
+
+        table: Table = next(
+            table
+            for table in self._get_application(application_name=application_name).tables
+            if table.name == table_name
+        )
+        identifier: str = identifiers[0]
+        if table.primary_key == PrimaryKey.AUTO_INCREMENT and INTEGER_PATTERN.match(
+            identifier
+        ):
+            value: Any = int(identifier)
+        elif table.primary_key == PrimaryKey.UUID and UUID_PATTERN.match(identifier):
+            value = identifier
+        else:
+            return None
+        return {
+            HttpMethodFunction.BOOLEAN_CLAUSE: "AND",
+            HttpMethodFunction.CONDITIONS: [
+                {
+                    HttpMethodFunction.COLUMN: "id",
+                    HttpMethodFunction.OPERATOR: "=",
+                    HttpMethodFunction.VALUE: value,
+                }
+            ],
+        }
+
+
+def _tokenize(message: str) -> list[str]:
+    # "#" is kept as a token of its own, as it marks the number after it as an identifier
+    return re.sub(r"[^\w\s#-]", " ", message.lower()).replace("#", " # ").split()
+
+
+def _get_table_aliases(table_name: str) -> set[tuple[str, ...]]:
+    words: list[str] = table_name.split("_")
+    aliases: set[tuple[str, ...]] = {(table_name,)}
+    for last_word in (words[-1], _singularize(words[-1]), _pluralize(words[-1])):
+        aliases.add(tuple(words[:-1] + [last_word]))
+    return aliases
+
+
+def _singularize(word: str) -> str:
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ses", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _pluralize(word: str) -> str:
+    if word.endswith("y") and word[-2:-1] not in "aeiou":
+        return word[:-1] + "ies"
+    if word.endswith(("s", "x")):
+        return word + "es"
+    return word + "s"
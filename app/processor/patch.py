@@ -0,0 +1,248 @@
+import logging
+from typing import Any, Optional
+
+from app.models.application import ApplicationContent, Table
+from app.models.inference.create import PatchOperation, PatchOperationType
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def apply_application_patch(
+    application: ApplicationContent, operations: list[PatchOperation]
+) -> ApplicationContent:
+    """Applies the edit operations returned by the patch_application tool to the last application draft. The patched application is validated like any other application, so an invalid patch raises a ValueError instead of producing a broken draft."""
+    application_content: dict[str, Any] = application.model_dump()
+    tables: list[dict[str, Any]] = application_content["tables"]
+    for operation in operations:
+        log.info(f"Applying patch operation: {operation}")
+        table_name: str = _normalize_name(operation.table_name)
+        match operation.operation:
+            case PatchOperationType.ADD_TABLE:
+                if _find_index(items=tables, name=table_name) is not None:
+                    raise ValueError(f"Table {table_name} already exists.")
+                table: dict[str, Any] = dict(operation.table or {})
+                table["name"] = table_name
+                for column in table.get("columns", []):
+                    column["name"] = _normalize_name(column["name"])
+                tables.append(table)
+            case PatchOperationType.REMOVE_TABLE:
+                del tables[_get_index(items=tables, name=table_name, kind="Table")]
+            case PatchOperationType.ALTER_TABLE:
+                table = tables[_get_index(items=tables, name=table_name, kind="Table")]
+                changes: dict[str, Any] = dict(operation.changes or {})
+                if "name" in changes:
+                    changes["name"] = _normalize_name(changes["name"])
+                    if (
+                        changes["name"] != table_name
+                        and _find_index(items=tables, name=changes["name"]) is not None
+                    ):
+                        raise ValueError(f"Table {changes['name']} already exists.")
+                    _rename_foreign_key_tables(
+                        tables=tables, old_name=table_name, new_name=changes["name"]
+                    )
+                # Columns are only changed through the column operations
+                changes.pop("columns", None)
+                table.update(changes)
+            case PatchOperationType.ADD_COLUMN:
+                columns: list[dict[str, Any]] = tables[
+                    _get_index(items=tables, name=table_name, kind="Table")
+                ]["columns"]
+                column: dict[str, Any] = dict(operation.column or {})
+                column["name"] = _normalize_name(
+                    column.get("name") or operation.column_name or ""
+                )
+                if _find_index(items=columns, name=column["name"]) is not None:
+                    raise ValueError(
+                        f"Column {column['name']} already exists in table {table_name}."
+                    )
+                columns.append(column)
+            case PatchOperationType.REMOVE_COLUMN:
+                columns = tables[
+                    _get_index(items=tables, name=table_name, kind="Table")
+                ]["columns"]
+                del columns[
+                    _get_index(
+                        items=columns,
+                        name=_normalize_name(operation.column_name or ""),
+                        kind="Column",
+                    )
+                ]
+            case PatchOperationType.ALTER_COLUMN:
+                columns = tables[
+                    _get_index(items=tables, name=table_name, kind="Table")
+                ]["columns"]
+                column_name: str = _normalize_name(operation.column_name or "")
+                column = columns[
+                    _get_index(items=columns, name=column_name, kind="Column")
+                ]
+                changes = dict(operation.changes or {})
+                if "name" in changes:
+                    changes["name"] = _normalize_name(changes["name"])
+                    if (
+                        changes["name"] != column_name
+                        and _find_index(items=columns, name=changes["name"]) is not None
+                    ):
+                        raise ValueError(
+                            f"Column {changes['name']} already exists in table {table_name}."
+                        )
+                    _rename_foreign_key_columns(
+                        tables=tables,
+                        table_name=table_name,
+                        old_name=column_name,
+                        new_name=changes["name"],
+                    )
+                if "data_type" in changes and changes["data_type"] != column.get(
+                    "data_type"
+                ):
+                    # The default value and enum values of the previous data type do not carry over
+                    column.pop("default_value", None)
+                    column.pop("enum_values", None)
+                column.update(changes)
+            case _:
+                raise ValueError(f"Unsupported patch operation: {operation.operation}")
+
+    patched_application = ApplicationContent.model_validate(application_content)
+    _validate_foreign_keys(application=patched_application)
+    return patched_application
+
+
+def diff_applications(
+    old: ApplicationContent, new: ApplicationContent
+) -> list[PatchOperation]:
+    """Describes the changes from the old to the new application as the edit operations of the patch_application tool, so that apply_application_patch(old, operations) rebuilds the new application. Renamed tables and columns are described as removed and added again. A change of the application name or of the order of the tables or columns cannot be described, so the caller has to check that the operations rebuild the new application exactly."""
+    operations: list[PatchOperation] = []
+    old_tables: dict[str, Table] = {table.name: table for table in old.tables}
+    new_table_names: set[str] = {table.name for table in new.tables}
+    for table in old.tables:
+        if table.name not in new_table_names:
+            operations.append(
+                PatchOperation(
+                    operation=PatchOperationType.REMOVE_TABLE, table_name=table.name
+                )
+            )
+    for table in new.tables:
+        old_table: Optional[Table] = old_tables.get(table.name)
+        if old_table is None:
+            operations.append(
+                PatchOperation(
+                    operation=PatchOperationType.ADD_TABLE,
+                    table_name=table.name,
+                    table=table.model_dump(mode="json"),
+                )
+            )
+            continue
+        changes: dict[str, Any] = _diff_fields(
+            old=old_table.model_dump(mode="json", exclude={"name", "columns"}),
+            new=table.model_dump(mode="json", exclude={"name", "columns"}),
+        )
+        if changes:
+            operations.append(
+                PatchOperation(
+                    operation=PatchOperationType.ALTER_TABLE,
+                    table_name=table.name,
+                    changes=changes,
+                )
+            )
+        operations.extend(_diff_columns(old_table=old_table, new_table=table))
+    return operations
+
+
+def _diff_columns(old_table: Table, new_table: Table) -> list[PatchOperation]:
+    operations: list[PatchOperation] = []
+    old_columns: dict[str, dict[str, Any]] = {
+        column.name: column.model_dump(mode="json") for column in old_table.columns
+    }
+    new_column_names: set[str] = {column.name for column in new_table.columns}
+    for column_name in old_columns:
+        if column_name not in new_column_names:
+            operations.append(
+                PatchOperation(
+                    operation=PatchOperationType.REMOVE_COLUMN,
+                    table_name=new_table.name,
+                    column_name=column_name,
+                )
+            )
+    for column in new_table.columns:
+        new_column: dict[str, Any] = column.model_dump(mode="json")
+        old_column: Optional[dict[str, Any]] = old_columns.get(column.name)
+        if old_column is None:
+            operations.append(
+                PatchOperation(
+                    operation=PatchOperationType.ADD_COLUMN,
+                    table_name=new_table.name,
+                    column_name=column.name,
+                    column=new_column,
+                )
+            )
+            continue
+        changes: dict[str, Any] = _diff_fields(old=old_column, new=new_column)
+        if "data_type" in changes:
+            # The default value and enum values are dropped when the data type changes, so they are always restated
+            changes["default_value"] = new_column["default_value"]
+            changes["enum_values"] = new_column["enum_values"]
+        if changes:
+            operations.append(
+                PatchOperation(
+                    operation=PatchOperationType.ALTER_COLUMN,
+                    table_name=new_table.name,
+                    column_name=column.name,
+                    changes=changes,
+                )
+            )
+    return operations
+
+
+def _diff_fields(old: dict[str, Any], new: dict[str, Any]) -> dict[str, Any]:
+    return {key: value for key, value in new.items() if old.get(key) != value}
+
+
+def _normalize_name(name: str) -> str:
+    return name.replace(" ", "_").lower()
+
+
+def _find_index(items: list[dict[str, Any]], name: str) -> Optional[int]:
+    return next(
+        (index for index, item in enumerate(items) if item.get("name") == name), None
+    )
+
+
+def _get_index(items: list[dict[str, Any]], name: str, kind: str) -> int:
+    index: Optional[int] = _find_index(items=items, name=name)
+    if index is None:
+        raise ValueError(f"{kind} {name} does not exist.")
+    return index
+
+
+def _rename_foreign_key_tables(
+    tables: list[dict[str, Any]], old_name: str, new_name: str
+) -> None:
+    for table in tables:
+        for column in table.get("columns", []):
+            foreign_key: Optional[dict[str, Any]] = column.get("foreign_key")
+            if foreign_key and foreign_key.get("table") == old_name:
+                foreign_key["table"] = new_name
+
+
+def _rename_foreign_key_columns(
+    tables: list[dict[str, Any]], table_name: str, old_name: str, new_name: str
+) -> None:
+    for table in tables:
+        for column in table.get("columns", []):
+            foreign_key: Optional[dict[str, Any]] = column.get("foreign_key")
+            if (
+                foreign_key
+                and foreign_key.get("table") == table_name
+                and foreign_key.get("column") == old_name
+            ):
+                foreign_key["column"] = new_name
+
+
+def _validate_foreign_keys(application: ApplicationContent) -> None:
+    table_names: set[str] = {table.name for table in application.tables}
+    for table in application.tables:
+        for column in table.columns:
+            if column.foreign_key and column.foreign_key.table not in table_names:
+                raise ValueError(
+                    f"Column {column.name} of table {table.name} references table {column.foreign_key.table} which does not exist."
+                )
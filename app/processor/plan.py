@@ -0,0 +1,48 @@
+import logging
+
+from app.models.inference.use import SelectedGrouping
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def build_execution_plan(groupings: list[SelectedGrouping]) -> list[list[int]]:
+    """Groups the indices of the selected groupings into dependency levels (Kahn's algorithm). Groupings in the same level do not depend on each other, and every grouping only depends on groupings in earlier levels."""
+    dependencies: list[set[int]] = [
+        _get_valid_dependencies(index=index, grouping=grouping, size=len(groupings))
+        for index, grouping in enumerate(groupings)
+    ]
+
+    execution_plan: list[list[int]] = []
+    scheduled: set[int] = set()
+    remaining: list[int] = list(range(len(groupings)))
+    while remaining:
+        level: list[int] = [
+            index for index in remaining if dependencies[index].issubset(scheduled)
+        ]
+        if not level:
+            # The LLM produced a cycle. We cannot trust the dependencies that are left, so the safest fallback is to run the remaining groupings one after another in the order they were selected
+            log.warning(
+                f"Cyclic dependencies found between groupings {remaining}. Executing them sequentially."
+            )
+            execution_plan.extend([index] for index in remaining)
+            break
+        execution_plan.append(level)
+        scheduled.update(level)
+        remaining = [index for index in remaining if index not in scheduled]
+
+    return execution_plan
+
+
+def _get_valid_dependencies(
+    index: int, grouping: SelectedGrouping, size: int
+) -> set[int]:
+    valid_dependencies: set[int] = set()
+    for dependency in grouping.depends_on:
+        if dependency == index or not 0 <= dependency < size:
+            log.warning(
+                f"Ignoring invalid dependency {dependency} of grouping {index}: {grouping.task}"
+            )
+            continue
+        valid_dependencies.add(dependency)
+    return valid_dependencies
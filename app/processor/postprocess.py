@@ -1,10 +1,22 @@
 import logging
-from typing import Any
+from typing import Any, Optional
 
 from pydantic import BaseModel
 
-from app.models.application import ApplicationContent, Column, DataType
-from app.models.inference.use import HttpMethodResponse, UseInferenceResponse
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent, Column, DataType, Table
+from app.models.inference.use import (
+    HttpMethod,
+    HttpMethodResponse,
+    UseInferenceResponse,
+)
+from app.processor.filter import (
+    FALSE_FILTER_CONDITIONS,
+    TRUE_FILTER_CONDITIONS,
+    count_predicates,
+    optimize_filter_conditions,
+)
+from app.processor.sql import compile_sql_statement
 from app.prompts.use.functions import HttpMethodFunction
 
 logging.basicConfig(level=logging.INFO)
@@ -17,21 +29,25 @@ class Postprocessor(BaseModel):
         self,
         input: list[HttpMethodResponse],
         original_applications: list[ApplicationContent],
+        execution_plan: Optional[list[list[int]]] = None,
     ) -> UseInferenceResponse:
         http_method_response_lst: list[HttpMethodResponse] = []
         for http_method_response in input:
             result = _enforce_response_types(
                 input=http_method_response,
             )
+            result = _optimize_filter_conditions(input=result)
             result = _restore_application_schema(
                 input=result,
                 original_applications=original_applications,
             )
+            result = _compile_sql_statement(input=result)
 
             http_method_response_lst.append(result)
 
         return UseInferenceResponse(
             response=http_method_response_lst,
+            execution_plan=execution_plan,
         )
 
 
@@ -47,6 +63,66 @@ def _restore_application_schema(
     return input
 
 
+def _optimize_filter_conditions(input: HttpMethodResponse) -> HttpMethodResponse:
+    """Runs after the response types are enforced, so that 1 and "1" are recognised as the same value."""
+    if not input.filter_conditions:
+        return input
+    filter_conditions: dict[str, Any] = optimize_filter_conditions(
+        filter_conditions=input.filter_conditions
+    )
+    # Unless the LLM asked for every row in the first place, a filter that matches every row is far more likely to be a bad generation than the intent of a write
+    if (
+        filter_conditions == TRUE_FILTER_CONDITIONS
+        and input.filter_conditions != TRUE_FILTER_CONDITIONS
+        and input.http_method != HttpMethod.GET
+    ):
+        log.warning(
+            f"Keeping the filter conditions of the {input.http_method} request as they are, as they match every row once optimized: {input.filter_conditions}"
+        )
+        METRICS.increment(
+            "filter_conditions_optimized_total", labels={"result": "tautology"}
+        )
+        return input
+
+    if filter_conditions == FALSE_FILTER_CONDITIONS:
+        result: str = "contradiction"
+    elif filter_conditions == input.filter_conditions:
+        result = "unchanged"
+    else:
+        result = "simplified"
+    METRICS.increment("filter_conditions_optimized_total", labels={"result": result})
+    METRICS.observe(
+        "filter_predicates_removed",
+        count_predicates(condition=input.filter_conditions)
+        - count_predicates(condition=filter_conditions),
+    )
+    input.filter_conditions = filter_conditions
+    return input
+
+
+def _compile_sql_statement(input: HttpMethodResponse) -> HttpMethodResponse:
+    """The SQL statement is only an optimisation for the executor, which can still fall back to interpreting the parameters, so a response that cannot be compiled is returned without one."""
+    table: Optional[Table] = next(
+        (table for table in input.application.tables if table.name == input.table_name),
+        None,
+    )
+    try:
+        if table is None:
+            raise ValueError(f"Unknown table: {input.table_name}")
+        input.sql = compile_sql_statement(response=input, table=table)
+        METRICS.increment(
+            "sql_statements_compiled_total",
+            labels={"http_method": input.http_method, "result": "compiled"},
+        )
+    except Exception as e:
+        log.warning(f"Error compiling the {input.http_method} request into SQL: {e}")
+        METRICS.increment(
+            "sql_statements_compiled_total",
+            labels={"http_method": input.http_method, "result": "failed"},
+        )
+    return input
+
+
 def _enforce_response_types(
     input: HttpMethodResponse,
 ) -> HttpMethodResponse:
@@ -205,8 +281,8 @@ def _enforce_response_types_for_filter_conditions(
     for table in input.application.tables:
         if table.name != input.table_name:
             continue
-        table_columns: list[Column] = table.columns
-        # Add id as a possible field to filter by
+        # Add id as a possible field to filter by. The columns are copied, as the tables are shared with the cached schema views
+        table_columns: list[Column] = list(table.columns)
         if table.primary_key == "auto_increment":
             table_columns.append(Column(name="id", data_type=DataType.INTEGER))
         elif table.primary_key == "uuid":
@@ -1,14 +1,118 @@
+import hashlib
 import logging
+from collections import OrderedDict
+from typing import Optional
 
 from pydantic import BaseModel
 
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent, Column, Table
 from app.models.inference.use import UseInferenceRequest
+from app.processor.validation import IMPLICIT_COLUMN_NAMES
+from app.prompts.use.schema import canonicalize_application
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+# The same applications are sent on every turn of a conversation, so the views of a schema are built once and served from memory afterwards
+MAX_CACHED_SCHEMAS: int = 256
+
+
+class StageViews(BaseModel):
+    """Views of one application that only keep what each stage of the inference needs. The views are copy-on-write: a table (or column) that is not pruned is shared with the original application instead of being copied, so the views must never be mutated."""
+
+    # Without the columns that the ORM fills in by itself and the function schemas add back as filters
+    pruned: ApplicationContent
+    # Only the names and descriptions of the tables
+    selection: ApplicationContent
+    # The pruned application narrowed down to a single table, keyed by the table name
+    http_request: dict[str, ApplicationContent]
+
+
+class PreprocessedUseInferenceRequest(UseInferenceRequest):
+    selection_applications: list[ApplicationContent]
+    # Keyed by (application name, table name)
+    http_request_applications: dict[tuple[str, str], ApplicationContent]
+
+
+_stage_views_cache: OrderedDict[str, StageViews] = OrderedDict()
+
 
 class Preprocessor(BaseModel):
-    def preprocess(self, input: UseInferenceRequest) -> UseInferenceRequest:
-        return input
-        # copied_input = input.model_copy(deep=True) # I believe this is necessary if not the original copy will still be corrupted in main.py (which is necessary for post-processing)
+    def preprocess(self, input: UseInferenceRequest) -> PreprocessedUseInferenceRequest:
+        """The applications of the input are left untouched, as the post-processing step restores the original schema from them."""
+        stage_views_lst: list[StageViews] = [
+            get_stage_views(application=application)
+            for application in input.applications
+        ]
+        return PreprocessedUseInferenceRequest(
+            applications=[stage_views.pruned for stage_views in stage_views_lst],
+            message=input.message,
+            chat_history=input.chat_history,
+            timeout_seconds=input.timeout_seconds,
+            selection_applications=[
+                stage_views.selection for stage_views in stage_views_lst
+            ],
+            http_request_applications={
+                (stage_views.pruned.name, table_name): application
+                for stage_views in stage_views_lst
+                for table_name, application in stage_views.http_request.items()
+            },
+        )
+
+
+def get_stage_views(application: ApplicationContent) -> StageViews:
+    schema_hash: str = hashlib.sha256(
+        canonicalize_application(application=application).encode()
+    ).hexdigest()
+    stage_views: Optional[StageViews] = _stage_views_cache.get(schema_hash)
+    if stage_views is not None:
+        _stage_views_cache.move_to_end(schema_hash)
+        METRICS.increment("schema_view_cache_requests_total", labels={"result": "hit"})
+        return stage_views
+
+    METRICS.increment("schema_view_cache_requests_total", labels={"result": "miss"})
+    stage_views = _build_stage_views(application=application)
+    _stage_views_cache[schema_hash] = stage_views
+    if len(_stage_views_cache) > MAX_CACHED_SCHEMAS:
+        _stage_views_cache.popitem(last=False)
+    return stage_views
+
+
+def _build_stage_views(application: ApplicationContent) -> StageViews:
+    pruned_tables: list[Table] = [
+        _prune_table(table=table) for table in application.tables
+    ]
+    pruned: ApplicationContent = (
+        application
+        if all(
+            pruned_table is table
+            for pruned_table, table in zip(pruned_tables, application.tables)
+        )
+        else application.model_copy(update={"tables": pruned_tables})
+    )
+    return StageViews(
+        pruned=pruned,
+        selection=application.model_copy(
+            update={
+                "tables": [
+                    table.model_copy(update={"columns": []})
+                    for table in application.tables
+                ]
+            }
+        ),
+        http_request={
+            table.name: pruned.model_copy(update={"tables": [table]})
+            for table in pruned.tables
+        },
+    )
+
+
+def _prune_table(table: Table) -> Table:
+    """We drop the id column as it is unhelpful for inference. The ORM fills it in by itself, and it is offered as a filter by the function schemas regardless. Timestamp columns like created_at are kept, as they could not be filtered by otherwise."""
+    columns: list[Column] = [
+        column for column in table.columns if column.name not in IMPLICIT_COLUMN_NAMES
+    ]
+    if len(columns) == len(table.columns):
+        return table
+    return table.model_copy(update={"columns": columns})
@@ -0,0 +1,188 @@
+import hashlib
+import logging
+from typing import Any
+
+from app.models.application import Table
+from app.models.inference.use import HttpMethod, HttpMethodResponse, SqlStatement
+from app.processor.filter import TRUE_FILTER_CONDITIONS
+from app.prompts.use.functions import HttpMethodFunction
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+COMPARISON_OPERATORS: dict[str, str] = {
+    "=": "=",
+    "!=": "<>",
+    ">": ">",
+    "<": "<",
+    ">=": ">=",
+    "<=": "<=",
+    "LIKE": "LIKE",
+    "IS NOT": "IS DISTINCT FROM",
+}
+
+
+class _Parameters:
+    """Collects the parameters of a statement in the order of their placeholders."""
+
+    def __init__(self):
+        self.values: list[Any] = []
+
+    def add(self, value: Any) -> str:
+        self.values.append(value)
+        return f"${len(self.values)}"
+
+
+def compile_sql_statement(response: HttpMethodResponse, table: Table) -> SqlStatement:
+    """Compiles the parameters of the response into a parameterized PostgreSQL statement. Values only ever appear as parameters, and IN is compiled into = ANY($n) with the whole list as one parameter, so the template only depends on the shape of the request and can be prepared once for every request of that shape. Raises a ValueError if the response cannot be compiled."""
+    table_name: str = _quote_identifier(name=response.table_name)
+    parameters = _Parameters()
+    match response.http_method:
+        case HttpMethod.GET:
+            template: str = f"SELECT * FROM {table_name}" + _compile_where(
+                filter_conditions=response.filter_conditions,
+                http_method=response.http_method,
+                parameters=parameters,
+            )
+        case HttpMethod.POST:
+            template = _compile_insert(
+                table_name=table_name,
+                table=table,
+                inserted_rows=response.inserted_rows,
+                parameters=parameters,
+            )
+        case HttpMethod.PUT:
+            template = _compile_update(
+                table_name=table_name,
+                table=table,
+                updated_data=response.updated_data,
+                parameters=parameters,
+            ) + _compile_where(
+                filter_conditions=response.filter_conditions,
+                http_method=response.http_method,
+                parameters=parameters,
+            )
+        case HttpMethod.DELETE:
+            template = f"DELETE FROM {table_name}" + _compile_where(
+                filter_conditions=response.filter_conditions,
+                http_method=response.http_method,
+                parameters=parameters,
+            )
+        case _:
+            raise ValueError(f"Unsupported HTTP method: {response.http_method}")
+
+    return SqlStatement(
+        template=template,
+        parameters=parameters.values,
+        fingerprint=hashlib.sha256(template.encode()).hexdigest(),
+    )
+
+
+def _compile_insert(
+    table_name: str,
+    table: Table,
+    inserted_rows: Any,
+    parameters: _Parameters,
+) -> str:
+    if not inserted_rows:
+        raise ValueError("There are no rows to insert.")
+    column_names: list[str] = _order_column_names(
+        table=table,
+        column_names={column_name for row in inserted_rows for column_name in row},
+    )
+    # A column that is missing from a row takes its default value, like it would if it was left out of the insert
+    values: list[str] = [
+        "("
+        + ", ".join(
+            parameters.add(row[column_name]) if column_name in row else "DEFAULT"
+            for column_name in column_names
+        )
+        + ")"
+        for row in inserted_rows
+    ]
+    columns: str = ", ".join(
+        _quote_identifier(name=column_name) for column_name in column_names
+    )
+    return f"INSERT INTO {table_name} ({columns}) VALUES {', '.join(values)}"
+
+
+def _compile_update(
+    table_name: str,
+    table: Table,
+    updated_data: Any,
+    parameters: _Parameters,
+) -> str:
+    if not updated_data:
+        raise ValueError("There is no data to update.")
+    assignments: str = ", ".join(
+        f"{_quote_identifier(name=column_name)} = {parameters.add(updated_data[column_name])}"
+        for column_name in _order_column_names(
+            table=table, column_names=set(updated_data)
+        )
+    )
+    return f"UPDATE {table_name} SET {assignments}"
+
+
+def _compile_where(
+    filter_conditions: Any, http_method: HttpMethod, parameters: _Parameters
+) -> str:
+    # An empty AND matches every row, so the statement is left unfiltered
+    if filter_conditions == TRUE_FILTER_CONDITIONS:
+        return ""
+    # A write only changes every row if the filter says so explicitly, as missing filter conditions are far more likely to be a bad generation
+    if not filter_conditions:
+        if http_method != HttpMethod.GET:
+            raise ValueError(f"The {http_method} request has no filter conditions.")
+        return ""
+    return " WHERE " + _compile_clause(
+        condition=filter_conditions, parameters=parameters
+    )
+
+
+def _compile_condition(condition: dict[str, Any], parameters: _Parameters) -> str:
+    if HttpMethodFunction.BOOLEAN_CLAUSE in condition:
+        return f"({_compile_clause(condition=condition, parameters=parameters)})"
+
+    column: str = _quote_identifier(name=condition[HttpMethodFunction.COLUMN])
+    operator: str = condition[HttpMethodFunction.OPERATOR]
+    value: Any = condition[HttpMethodFunction.VALUE]
+    if value is None:
+        match operator:
+            case "=":
+                return f"{column} IS NULL"
+            case "!=" | "IS NOT":
+                return f"{column} IS NOT NULL"
+            case _:
+                raise ValueError(f"Operator {operator} cannot compare with NULL.")
+    if operator == "IN":
+        if not isinstance(value, list):
+            raise ValueError(f"The value of an IN condition must be a list: {value}")
+        return f"{column} = ANY({parameters.add(value)})"
+    if operator not in COMPARISON_OPERATORS:
+        raise ValueError(f"Unsupported operator: {operator}")
+    return f"{column} {COMPARISON_OPERATORS[operator]} {parameters.add(value)}"
+
+
+def _compile_clause(condition: dict[str, Any], parameters: _Parameters) -> str:
+    boolean_clause: str = condition[HttpMethodFunction.BOOLEAN_CLAUSE]
+    if boolean_clause not in {"AND", "OR"}:
+        raise ValueError(f"Unsupported boolean clause: {boolean_clause}")
+    sub_conditions: list[dict[str, Any]] = condition[HttpMethodFunction.CONDITIONS]
+    if not sub_conditions:
+        return "TRUE" if boolean_clause == "AND" else "FALSE"
+    return f" {boolean_clause} ".join(
+        _compile_condition(condition=sub_condition, parameters=parameters)
+        for sub_condition in sub_conditions
+    )
+
+
+def _order_column_names(table: Table, column_names: set[str]) -> list[str]:
+    # The columns are listed in the order of the schema, so that the same set of columns always compiles into the same template
+    schema_column_names: list[str] = [
+        column.name for column in table.columns if column.name in column_names
+    ]
+    return schema_column_names + sorted(column_names - set(schema_column_names))
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,196 @@
+import uuid
+from datetime import date, datetime
+from typing import Any, Optional
+
+from app.models.application import ApplicationContent, Column, DataType, Table
+from app.models.inference.create import CreateInferenceResponse
+from app.models.inference.use import (
+    ApplicationSelectionResponse,
+    HttpMethodResponse,
+    SelectedGrouping,
+    SelectionResponse,
+    TableSelectionResponse,
+)
+from app.prompts.use.functions import HttpMethodFunction
+
+# These columns are dropped from the schema sent to the LLM, but can still be filtered by as the function schemas add them back. Timestamp columns like created_at are kept in the schema, as nothing adds them back and they are often filtered by
+IMPLICIT_COLUMN_NAMES: set[str] = {"id"}
+OPERATORS: set[str] = {"=", "!=", ">", "<", ">=", "<=", "LIKE", "IN"}
+
+
+def validate_selection_response(
+    response: SelectionResponse, applications: list[ApplicationContent]
+) -> None:
+    """Raises a ValueError if the selection is empty, or refers to an application, table or grouping that does not exist. An empty selection is only trusted from the last model of the cascade, as a cheaper model is more likely to miss the relevant tables than the instruction is to have none."""
+    if not response.relevant_groupings:
+        raise ValueError("Empty selection")
+    groupings = response.relevant_groupings
+    for index, grouping in enumerate(groupings):
+        validate_selected_grouping(
+            grouping=grouping, index=index, applications=applications
+        )
+        for dependency in grouping.depends_on:
+            if dependency >= len(groupings):
+                raise ValueError(f"Invalid dependency {dependency} of task {index}")
+
+
+def validate_selected_grouping(
+    grouping: SelectedGrouping, index: int, applications: list[ApplicationContent]
+) -> None:
+    """Raises a ValueError if the grouping refers to an application or table that does not exist, or to a grouping that cannot exist. A dependency on a later grouping is not checked, so that a streamed grouping can be validated before the rest of the selection."""
+    table_names: dict[str, set[str]] = {
+        application.name: {table.name for table in application.tables}
+        for application in applications
+    }
+    if grouping.application_name not in table_names:
+        raise ValueError(f"Unknown application: {grouping.application_name}")
+    if grouping.table_name not in table_names[grouping.application_name]:
+        raise ValueError(
+            f"Unknown table {grouping.table_name} in application {grouping.application_name}"
+        )
+    for dependency in grouping.depends_on:
+        if dependency < 0 or dependency == index:
+            raise ValueError(f"Invalid dependency {dependency} of task {index}")
+
+
+def validate_application_selection_response(
+    response: ApplicationSelectionResponse, applications: list[ApplicationContent]
+) -> None:
+    # An empty selection is only trusted from the last model of the cascade, like in validate_selection_response
+    if not response.relevant_groupings:
+        raise ValueError("Empty application selection")
+    application_names: set[str] = {application.name for application in applications}
+    for grouping in response.relevant_groupings:
+        if grouping.application_name not in application_names:
+            raise ValueError(f"Unknown application: {grouping.application_name}")
+
+
+def validate_table_selection_response(
+    response: TableSelectionResponse,
+    application: ApplicationContent,
+    grouping_indices: list[int],
+) -> None:
+    """Raises a ValueError if a table does not exist, is selected for a task that was not asked about, or if a task is left without a table. The grouping index is not enum-constrained in the tool schema, so it has to be checked here."""
+    table_names: set[str] = {table.name for table in application.tables}
+    uncovered_indices: set[int] = set(grouping_indices)
+    for selected_table in response.selected_tables:
+        if selected_table.table_name not in table_names:
+            raise ValueError(
+                f"Unknown table {selected_table.table_name} in application {application.name}"
+            )
+        if selected_table.grouping_index not in grouping_indices:
+            raise ValueError(
+                f"Table {selected_table.table_name} selected for unknown task {selected_table.grouping_index}"
+            )
+        uncovered_indices.discard(selected_table.grouping_index)
+    if uncovered_indices:
+        raise ValueError(f"No table selected for tasks {sorted(uncovered_indices)}")
+
+
+def validate_http_method_response(response: HttpMethodResponse, table: Table) -> None:
+    """Raises a ValueError if the parameters refer to columns that do not exist in the table, or hold values that cannot be coerced to the data type of their column."""
+    columns: dict[str, Column] = {column.name: column for column in table.columns}
+    for row in response.inserted_rows or []:
+        for column_name, value in row.items():
+            _validate_value(column=_get_column(columns, column_name), value=value)
+    for column_name, value in (response.updated_data or {}).items():
+        _validate_value(column=_get_column(columns, column_name), value=value)
+    if response.filter_conditions:
+        _validate_filter_condition(
+            condition=response.filter_conditions, table=table, columns=columns
+        )
+
+
+def validate_clarification_response(response: str) -> None:
+    if not response or not response.strip():
+        raise ValueError("Empty clarification")
+
+
+def validate_application_response(response: CreateInferenceResponse) -> None:
+    if not (
+        response.application_content
+        or response.clarification
+        or response.concluding_message
+    ):
+        raise ValueError("The response has no application, clarification or conclusion")
+
+
+def _get_column(columns: dict[str, Column], column_name: str) -> Column:
+    if column_name not in columns:
+        raise ValueError(f"Unknown column: {column_name}")
+    return columns[column_name]
+
+
+def _validate_filter_condition(
+    condition: dict[str, Any], table: Table, columns: dict[str, Column]
+) -> None:
+    if HttpMethodFunction.BOOLEAN_CLAUSE in condition:
+        for sub_condition in condition.get(HttpMethodFunction.CONDITIONS, []):
+            _validate_filter_condition(
+                condition=sub_condition, table=table, columns=columns
+            )
+        return
+
+    column_name: Optional[str] = condition.get(HttpMethodFunction.COLUMN)
+    operator: Optional[str] = condition.get(HttpMethodFunction.OPERATOR)
+    if operator not in OPERATORS:
+        raise ValueError(f"Unknown operator: {operator}")
+    if operator == "LIKE":
+        # Patterns do not have to be valid values of the column
+        if column_name not in columns and column_name not in IMPLICIT_COLUMN_NAMES:
+            raise ValueError(f"Unknown column: {column_name}")
+        return
+    if column_name in IMPLICIT_COLUMN_NAMES and column_name not in columns:
+        if column_name == "id":
+            _validate_value(
+                column=Column(
+                    name="id",
+                    data_type=(
+                        DataType.INTEGER
+                        if table.primary_key == "auto_increment"
+                        else DataType.UUID
+                    ),
+                ),
+                value=condition.get(HttpMethodFunction.VALUE),
+            )
+        return
+    _validate_value(
+        column=_get_column(columns, column_name),
+        value=condition.get(HttpMethodFunction.VALUE),
+    )
+
+
+def _validate_value(column: Column, value: Any) -> None:
+    if isinstance(value, list):
+        for item in value:
+            _validate_value(column=column, value=item)
+        return
+    if value is None:
+        return
+    try:
+        match column.data_type:
+            case DataType.INTEGER:
+                if isinstance(value, float) and not value.is_integer():
+                    raise ValueError
+                int(value)
+            case DataType.FLOAT:
+                float(value)
+            case DataType.BOOLEAN:
+                if not isinstance(value, bool) and str(value).lower() not in (
+                    "true",
+                    "false",
+                ):
+                    raise ValueError
+            case DataType.DATE:
+                date.fromisoformat(str(value))
+            case DataType.DATETIME:
+                datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+            case DataType.UUID:
+                uuid.UUID(str(value))
+            case DataType.ENUM:
+                if str(value) not in (column.enum_values or []):
+                    raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"Value {value!r} of column {column.name} is not a valid {column.data_type}"
+        )
@@ -1,3 +1,6 @@
+from typing import Optional
+
+from app.models.application import ApplicationContent
 from app.models.inference.create import CreateMessage
 
 
@@ -14,6 +17,7 @@ Take note of the following constraints:
 1. If a column's data type is an enum, you must set a default value for that column that belongs to the enum values.
 2. If you decide to use a foreign key, make sure to create the target table which is referenced as well.
 3. You MUST use one of the tools provided.
+4. If there is already a draft of the application and the user only asks for changes to some of its tables or columns, use the patch_application tool to describe only those changes instead of recreating the whole application.
 
 Do not include the following columns in your response:
 1. Primary key column. For this special column, you just need to indicate the primary key type.
@@ -22,12 +26,25 @@ Do not include the following columns in your response:
 
 
 def generate_openai_application_user_message(
-    message: str, chat_history: list[CreateMessage]
+    message: str,
+    chat_history: list[CreateMessage],
+    last_draft_version: Optional[int] = None,
+    last_application_draft: Optional[ApplicationContent] = None,
 ) -> str:
+    """The latest version of the draft is included once, for the messages of the chat history that refer to it instead of inlining it."""
+    draft_section: str = (
+        f"""
+### Here is the latest draft of the application (version {last_draft_version}), which the messages with a draft_version of {last_draft_version} in the chat history refer to:
+
+{last_application_draft.model_dump()}
+"""
+        if last_draft_version is not None and last_application_draft is not None
+        else ""
+    )
     return f"""### Here is the chat history:
 
 {[message.model_dump() for message in chat_history]}
-
+{draft_section}
 ### Here is the user's current message:
 
 {message}
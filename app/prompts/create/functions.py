@@ -3,6 +3,7 @@ from enum import StrEnum
 from typing import Any
 
 from app.models.application import DataType, PrimaryKey
+from app.models.inference.create import PatchOperationType
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -30,6 +31,11 @@ class ApplicationFunction(StrEnum):
     COLUMN = "column"
     CONCLUDE = "conclude"
     CONCLUDING_MESSAGE = "concluding_message"
+    PATCH_APPLICATION = "patch_application"
+    OPERATIONS = "operations"
+    OPERATION = "operation"
+    COLUMN_NAME = "column_name"
+    CHANGES = "changes"
 
 
 def create_application() -> dict[str, Any]:
@@ -51,95 +57,7 @@ def create_application() -> dict[str, Any]:
                             ApplicationFunction.TABLES: {
                                 "type": "array",
                                 "description": "An array of tables for the application",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        ApplicationFunction.NAME: {
-                                            "type": "string",
-                                            "description": "The name of the table",
-                                        },
-                                        ApplicationFunction.DESCRIPTION: {
-                                            "type": "string",
-                                            "description": "A description of the table",
-                                        },
-                                        ApplicationFunction.COLUMNS: {
-                                            "type": "array",
-                                            "description": "An array of columns for the table",
-                                            "items": {
-                                                "type": "object",
-                                                "properties": {
-                                                    ApplicationFunction.NAME: {
-                                                        "type": "string",
-                                                        "description": "The name of the column",
-                                                    },
-                                                    ApplicationFunction.DATA_TYPE: {
-                                                        "type": "string",
-                                                        "enum": [
-                                                            data_type.value
-                                                            for data_type in DataType.__members__.values()
-                                                        ],
-                                                        "description": "The data type of the column",
-                                                    },
-                                                    ApplicationFunction.ENUM_VALUES: {
-                                                        "type": "array",
-                                                        "items": {"type": "string"},
-                                                        "description": "List of enum values if data_type is enum",
-                                                    },
-                                                    ApplicationFunction.NULLABLE: {
-                                                        "type": "boolean",
-                                                        "description": "Whether the column can be null",
-                                                    },
-                                                    ApplicationFunction.DEFAULT_VALUE: {
-                                                        "type": [
-                                                            "string",
-                                                            "number",
-                                                            "boolean",
-                                                            "null",
-                                                        ],
-                                                        "description": "The default value for the column. This is required if the data type is enum",
-                                                    },
-                                                    ApplicationFunction.UNIQUE: {
-                                                        "type": "boolean",
-                                                        "description": "Whether the column values must be unique",
-                                                    },
-                                                    ApplicationFunction.FOREIGN_KEY: {
-                                                        "type": "object",
-                                                        "properties": {
-                                                            ApplicationFunction.TABLE: {
-                                                                "type": "string"
-                                                            },
-                                                            ApplicationFunction.COLUMN: {
-                                                                "type": "string"
-                                                            },
-                                                        },
-                                                        "required": [
-                                                            ApplicationFunction.TABLE,
-                                                            ApplicationFunction.COLUMN,
-                                                        ],
-                                                        "description": "Foreign key reference if applicable",
-                                                    },
-                                                },
-                                                "required": [
-                                                    ApplicationFunction.NAME,
-                                                    ApplicationFunction.DATA_TYPE,
-                                                ],
-                                            },
-                                        },
-                                        ApplicationFunction.PRIMARY_KEY: {
-                                            "type": "string",
-                                            "enum": [
-                                                PrimaryKey.AUTO_INCREMENT,
-                                                PrimaryKey.UUID,
-                                            ],
-                                            "description": "The primary key type for the table",
-                                        },
-                                    },
-                                    "required": [
-                                        ApplicationFunction.NAME,
-                                        ApplicationFunction.COLUMNS,
-                                        ApplicationFunction.PRIMARY_KEY,
-                                    ],
-                                },
+                                "items": _build_table_schema(),
                             },
                         },
                         "required": [
@@ -166,6 +84,159 @@ def create_application() -> dict[str, Any]:
     return function
 
 
+def patch_application() -> dict[str, Any]:
+    function = {
+        "type": "function",
+        "function": {
+            "name": ApplicationFunction.PATCH_APPLICATION,
+            "description": "Refine the last draft of the application by describing only the changes to its tables and columns",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    ApplicationFunction.OPERATIONS: {
+                        "type": "array",
+                        "description": "The edit operations to apply to the last draft, in order",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                ApplicationFunction.OPERATION: {
+                                    "type": "string",
+                                    "enum": [
+                                        operation.value
+                                        for operation in PatchOperationType
+                                    ],
+                                    "description": "The type of edit operation",
+                                },
+                                ApplicationFunction.TABLE_NAME: {
+                                    "type": "string",
+                                    "description": "The name of the table to add, remove or alter, or the table of the column to add, remove or alter",
+                                },
+                                ApplicationFunction.COLUMN_NAME: {
+                                    "type": "string",
+                                    "description": "The name of the column to remove or alter",
+                                },
+                                ApplicationFunction.TABLE: {
+                                    **_build_table_schema(),
+                                    "description": "The full definition of the table to add. Only used by add_table",
+                                },
+                                ApplicationFunction.COLUMN: {
+                                    **_build_column_schema(),
+                                    "description": "The full definition of the column to add. Only used by add_column",
+                                },
+                                ApplicationFunction.CHANGES: {
+                                    "type": "object",
+                                    "description": 'Only the fields of the table or column that change, e.g. {"name": "new_name"}. Only used by alter_table and alter_column',
+                                },
+                            },
+                            "required": [
+                                ApplicationFunction.OPERATION,
+                                ApplicationFunction.TABLE_NAME,
+                            ],
+                        },
+                    },
+                    ApplicationFunction.OVERVIEW: {
+                        "type": "string",
+                        "description": "A short summary of the changes made to the application",
+                    },
+                },
+                "required": [ApplicationFunction.OPERATIONS],
+            },
+        },
+    }
+    return function
+
+
+def _build_table_schema() -> dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            ApplicationFunction.NAME: {
+                "type": "string",
+                "description": "The name of the table",
+            },
+            ApplicationFunction.DESCRIPTION: {
+                "type": "string",
+                "description": "A description of the table",
+            },
+            ApplicationFunction.COLUMNS: {
+                "type": "array",
+                "description": "An array of columns for the table",
+                "items": _build_column_schema(),
+            },
+            ApplicationFunction.PRIMARY_KEY: {
+                "type": "string",
+                "enum": [
+                    PrimaryKey.AUTO_INCREMENT,
+                    PrimaryKey.UUID,
+                ],
+                "description": "The primary key type for the table",
+            },
+        },
+        "required": [
+            ApplicationFunction.NAME,
+            ApplicationFunction.COLUMNS,
+            ApplicationFunction.PRIMARY_KEY,
+        ],
+    }
+
+
+def _build_column_schema() -> dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {
+            ApplicationFunction.NAME: {
+                "type": "string",
+                "description": "The name of the column",
+            },
+            ApplicationFunction.DATA_TYPE: {
+                "type": "string",
+                "enum": [
+                    data_type.value for data_type in DataType.__members__.values()
+                ],
+                "description": "The data type of the column",
+            },
+            ApplicationFunction.ENUM_VALUES: {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "List of enum values if data_type is enum",
+            },
+            ApplicationFunction.NULLABLE: {
+                "type": "boolean",
+                "description": "Whether the column can be null",
+            },
+            ApplicationFunction.DEFAULT_VALUE: {
+                "type": [
+                    "string",
+                    "number",
+                    "boolean",
+                    "null",
+                ],
+                "description": "The default value for the column. This is required if the data type is enum",
+            },
+            ApplicationFunction.UNIQUE: {
+                "type": "boolean",
+                "description": "Whether the column values must be unique",
+            },
+            ApplicationFunction.FOREIGN_KEY: {
+                "type": "object",
+                "properties": {
+                    ApplicationFunction.TABLE: {"type": "string"},
+                    ApplicationFunction.COLUMN: {"type": "string"},
+                },
+                "required": [
+                    ApplicationFunction.TABLE,
+                    ApplicationFunction.COLUMN,
+                ],
+                "description": "Foreign key reference if applicable",
+            },
+        },
+        "required": [
+            ApplicationFunction.NAME,
+            ApplicationFunction.DATA_TYPE,
+        ],
+    }
+
+
 def clarify() -> dict[str, Any]:
     function = {
         "type": "function",
@@ -1,21 +1,28 @@
 from app.models.application import ApplicationContent
 from app.models.inference.use import UseMessage
+from app.prompts.use.history import render_chat_history
+from app.prompts.use.schema import canonicalize_applications
 
 
 def generate_openai_clarification_system_message() -> str:
     return f"""Your task is to clarify the user's natural language instruction so that an AI agent can use your output to perform specific actions on the databases of applications. Currently, the user's instruction is not clear enough for the AI agent to understand which applications, tables, and HTTP methods to use. Your job is to ask for the necessary information that is missing."""
 
 
-def generate_openai_clarification_user_message(
-    applications: list[ApplicationContent], message: str, chat_history: list[UseMessage]
+def generate_openai_clarification_context_message(
+    applications: list[ApplicationContent],
 ) -> str:
     return f"""### Here are the applications that might be relevant to the user's instruction:
 
-{[application.model_dump() for application in applications]}
+{canonicalize_applications(applications=applications)}
+"""
+
 
-### Here is the chat history:
+def generate_openai_clarification_user_message(
+    message: str, chat_history: list[UseMessage]
+) -> str:
+    return f"""### Here is the chat history:
 
-{[message.model_dump() for message in chat_history]}
+{render_chat_history(chat_history=chat_history)}
 
 ### Here is the user's current instruction:
 
@@ -1,13 +1,48 @@
+import functools
 import logging
+from collections import OrderedDict
 from enum import StrEnum
-from typing import Any
+from typing import Any, Callable, Optional
 
+from pydantic_core import to_jsonable_python
+
+from app.metrics.metrics import METRICS
 from app.models.application import ApplicationContent, Column, DataType, Table
 from app.models.inference.use import HttpMethod
+from app.prompts.use.schema import canonicalize
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+# The same schemas are sent on every turn of a conversation, so their tool schemas are compiled once and served from memory afterwards. They are kept per worker rather than in the shared cache, as reading a schema back from the shared cache costs about as much as compiling it again and would block the event loop on disk I/O
+MAX_COMPILED_FUNCTIONS: int = 1024
+
+_compiled_functions: OrderedDict[str, dict[str, Any]] = OrderedDict()
+
+
+def _compiled(build: Callable[..., dict[str, Any]]) -> Callable[..., dict[str, Any]]:
+    """Memoizes a tool schema by the canonical form of its arguments, so that it is only built once per worker (or ahead of time by the warmup). The compiled schemas are shared between requests, so they must never be mutated."""
+
+    @functools.wraps(build)
+    def get_function(**kwargs) -> dict[str, Any]:
+        key: str = f"{build.__name__}:{canonicalize(to_jsonable_python(kwargs))}"
+        function: Optional[dict[str, Any]] = _compiled_functions.get(key)
+        if function is not None:
+            _compiled_functions.move_to_end(key)
+            METRICS.increment(
+                "tool_schema_cache_requests_total", labels={"result": "hit"}
+            )
+            return function
+
+        METRICS.increment("tool_schema_cache_requests_total", labels={"result": "miss"})
+        function = build(**kwargs)
+        _compiled_functions[key] = function
+        if len(_compiled_functions) > MAX_COMPILED_FUNCTIONS:
+            _compiled_functions.popitem(last=False)
+        return function
+
+    return get_function
+
 
 class SelectionFunction(StrEnum):
     SELECT = "select"
@@ -15,9 +50,15 @@ class SelectionFunction(StrEnum):
     APPLICATION_NAME = "application_name"
     TABLE_NAME = "table_name"
     HTTP_METHOD = "http_method"
+    DEPENDS_ON = "depends_on"
     RELEVANT_GROUPINGS = "relevant_groupings"
+    SELECT_APPLICATIONS = "select_applications"
+    SELECT_TABLES = "select_tables"
+    SELECTED_TABLES = "selected_tables"
+    GROUPING_INDEX = "grouping_index"
 
 
+@_compiled
 def get_selection_function(applications: list[ApplicationContent]) -> dict[str, Any]:
 
     function = {
@@ -40,9 +81,9 @@ def get_selection_function(applications: list[ApplicationContent]) -> dict[str,
                                 },
                                 SelectionFunction.APPLICATION_NAME: {
                                     "type": "string",
-                                    "enum": [
+                                    "enum": sorted(
                                         application.name for application in applications
-                                    ],
+                                    ),
                                     "description": "The name of the application to use the HTTP method on.",
                                 },
                                 SelectionFunction.TABLE_NAME: {
@@ -54,6 +95,11 @@ def get_selection_function(applications: list[ApplicationContent]) -> dict[str,
                                     "enum": [method.value for method in HttpMethod],
                                     "description": "The HTTP method to use on the chosen application's table",
                                 },
+                                SelectionFunction.DEPENDS_ON: {
+                                    "type": "array",
+                                    "items": {"type": "integer"},
+                                    "description": "The 0-based positions of the earlier groupings in relevant_groupings that must be executed before this one. Leave empty if this grouping can be executed independently.",
+                                },
                             },
                             "required": [
                                 SelectionFunction.TASK,
@@ -71,6 +117,107 @@ def get_selection_function(applications: list[ApplicationContent]) -> dict[str,
     return function
 
 
+@_compiled
+def get_application_selection_function(
+    applications: list[ApplicationContent],
+) -> dict[str, Any]:
+
+    function = {
+        "type": "function",
+        "function": {
+            "name": SelectionFunction.SELECT_APPLICATIONS,
+            "description": "Select the relevant (task, application, HTTP method) groupings that are necessary to perform the user's instruction.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    SelectionFunction.RELEVANT_GROUPINGS: {
+                        "type": "array",
+                        "description": "All the relevant (task, application, HTTP method) groupings.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                SelectionFunction.TASK: {
+                                    "type": "string",
+                                    "description": "This task represents a single step in the entire user instruction.",
+                                },
+                                SelectionFunction.APPLICATION_NAME: {
+                                    "type": "string",
+                                    "enum": sorted(
+                                        application.name for application in applications
+                                    ),
+                                    "description": "The name of the application to use the HTTP method on.",
+                                },
+                                SelectionFunction.HTTP_METHOD: {
+                                    "type": "string",
+                                    "enum": [method.value for method in HttpMethod],
+                                    "description": "The HTTP method to use on the chosen application",
+                                },
+                                SelectionFunction.DEPENDS_ON: {
+                                    "type": "array",
+                                    "items": {"type": "integer"},
+                                    "description": "The 0-based positions of the earlier groupings in relevant_groupings that must be executed before this one. Leave empty if this grouping can be executed independently.",
+                                },
+                            },
+                            "required": [
+                                SelectionFunction.TASK,
+                                SelectionFunction.APPLICATION_NAME,
+                                SelectionFunction.HTTP_METHOD,
+                            ],
+                        },
+                    }
+                },
+            },
+        },
+    }
+
+    return function
+
+
+@_compiled
+def get_table_selection_function(application: ApplicationContent) -> dict[str, Any]:
+    """The grouping index is not enum-constrained as the tool schema would then change with every instruction and break the prompt prefix caching of the provider."""
+
+    function = {
+        "type": "function",
+        "function": {
+            "name": SelectionFunction.SELECT_TABLES,
+            "description": f"Select the table(s) of the {application.name} application that each task has to be performed on.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    SelectionFunction.SELECTED_TABLES: {
+                        "type": "array",
+                        "description": "All the relevant (task, table name) pairs. A task can be paired with more than one table.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                SelectionFunction.GROUPING_INDEX: {
+                                    "type": "integer",
+                                    "description": "The index of the task that the table is selected for.",
+                                },
+                                SelectionFunction.TABLE_NAME: {
+                                    "type": "string",
+                                    "enum": sorted(
+                                        table.name for table in application.tables
+                                    ),
+                                    "description": "The table name of the application to use the HTTP method on.",
+                                },
+                            },
+                            "required": [
+                                SelectionFunction.GROUPING_INDEX,
+                                SelectionFunction.TABLE_NAME,
+                            ],
+                        },
+                    }
+                },
+                "required": [SelectionFunction.SELECTED_TABLES],
+            },
+        },
+    }
+
+    return function
+
+
 class HttpMethodFunction(StrEnum):
     GET_HTTP_METHOD_PARAMETERS = "get_http_method_parameters"
     HTTP_METHOD = "http_method"
@@ -86,6 +233,7 @@ class HttpMethodFunction(StrEnum):
     FILTER_CONDITIONS = "filter_conditions"
 
 
+@_compiled
 def get_http_method_parameters_function(
     http_method: HttpMethod, table: Table
 ) -> dict[str, Any]:
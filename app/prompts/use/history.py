@@ -0,0 +1,16 @@
+from app.metrics.metrics import METRICS
+from app.models.inference.use import UseMessage
+
+
+def render_chat_history(chat_history: list[UseMessage]) -> str:
+    """Renders the chat history like the list of the message dumps, from the prompt fragment of every message. Each stage of an inference renders the same chat history, so a message is only rendered by the first one."""
+    return f"[{', '.join(render_message(message=message) for message in chat_history)}]"
+
+
+def render_message(message: UseMessage) -> str:
+    if message._prompt_fragment is not None:
+        METRICS.increment("prompt_fragment_requests_total", labels={"result": "hit"})
+        return message._prompt_fragment
+    METRICS.increment("prompt_fragment_requests_total", labels={"result": "miss"})
+    message._prompt_fragment = repr(message.model_dump())
+    return message._prompt_fragment
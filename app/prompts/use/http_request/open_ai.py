@@ -1,5 +1,9 @@
+from typing import Optional
+
 from app.models.application import Table
-from app.models.inference.use import HttpMethod, UseMessage
+from app.models.inference.use import HttpMethod, HttpMethodResponse, UseMessage
+from app.prompts.use.history import render_chat_history
+from app.prompts.use.schema import canonicalize_table
 
 
 def generate_openai_http_request_system_message(http_method: HttpMethod) -> str:
@@ -53,24 +57,51 @@ Follow these guidelines:
 """
 
 
-def generate_openai_http_request_user_message(
+def generate_openai_http_request_context_message(
     application_name: str,
     table: Table,
     http_method: HttpMethod,
-    message: str,
-    chat_history: list[UseMessage],
 ) -> str:
     return f"""### Name of application: {application_name}
 
 ### Target table to generate {http_method} request for: 
 
-{table.model_dump()}
+{canonicalize_table(table=table)}
+"""
+
+
+def generate_openai_http_request_user_message(
+    message: str,
+    chat_history: list[UseMessage],
+    prerequisites: list[HttpMethodResponse],
+) -> str:
+    prerequisites_section: str = (
+        f"""### The following requests will be executed before this one:
+
+{[prerequisite.model_dump(exclude={"application"}) for prerequisite in prerequisites]}
 
-### Here is the chat history:
+"""
+        if prerequisites
+        else ""
+    )
+    return f"""{prerequisites_section}### Here is the chat history:
 
-{[message.model_dump() for message in chat_history]}
+{render_chat_history(chat_history=chat_history)}
 
 ### Here is the current user's instruction:
 
 {message}
 """
+
+
+def generate_openai_bulk_insert_chunk_message(
+    start: int, end: Optional[int], row_count: int
+) -> str:
+    row_range: str = (
+        f"rows {start} to {end}" if end is not None else f"row {start} onwards"
+    )
+    return f"""
+### The rows of this request are generated in parts:
+
+The instruction asks for about {row_count} rows. Only generate {row_range}, counting from 1 in the order in which the rows appear in (or follow from) the instruction. Do not generate any other row.
+"""
@@ -0,0 +1,62 @@
+import json
+from typing import Any
+
+from app.models.application import ApplicationContent, Table
+
+
+def canonicalize(content: Any) -> str:
+    """Serialises the content into compact JSON with sorted keys, so that the same schema always renders into a byte-identical prompt prefix that the provider can cache."""
+    return json.dumps(content, sort_keys=True, separators=(",", ":"))
+
+
+def canonicalize_table(table: Table) -> str:
+    return canonicalize(table.model_dump(mode="json", exclude_none=True))
+
+
+def canonicalize_application(application: ApplicationContent) -> str:
+    return canonicalize(_dump_application(application=application))
+
+
+def canonicalize_applications(applications: list[ApplicationContent]) -> str:
+    return canonicalize(
+        [
+            _dump_application(application=application)
+            for application in sorted(
+                applications, key=lambda application: application.name
+            )
+        ]
+    )
+
+
+def canonicalize_application_summaries(
+    applications: list[ApplicationContent],
+) -> str:
+    return canonicalize(
+        [
+            {
+                "name": application.name,
+                "tables": sorted(table.name for table in application.tables),
+            }
+            for application in sorted(
+                applications, key=lambda application: application.name
+            )
+        ]
+    )
+
+
+def _dump_application(application: ApplicationContent) -> dict[str, Any]:
+    # Clients do not always send the tables in the same order, but the order of the columns is kept as it is meaningful to the user
+    return {
+        "name": application.name,
+        "tables": [
+            _dump_table(table=table)
+            for table in sorted(application.tables, key=lambda table: table.name)
+        ],
+    }
+
+
+def _dump_table(table: Table) -> dict[str, Any]:
+    # The selection views prune the columns away, which must not read as tables without any columns
+    return table.model_dump(
+        mode="json", exclude_none=True, exclude=None if table.columns else {"columns"}
+    )
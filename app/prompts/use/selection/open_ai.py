@@ -1,5 +1,12 @@
 from app.models.application import ApplicationContent
-from app.models.inference.use import UseMessage
+from app.models.inference.use import SelectedApplicationGrouping, UseMessage
+from app.prompts.use.history import render_chat_history
+from app.prompts.use.schema import (
+    canonicalize,
+    canonicalize_application,
+    canonicalize_application_summaries,
+    canonicalize_applications,
+)
 
 
 def generate_openai_selection_system_message() -> str:
@@ -12,6 +19,7 @@ Follow these guidelines:
     4. For each application, you need to determine the subset of tables which the task is related to.
     5. For each table, you need to determine the appropriate HTTP methods to use given the task.  
     6. The chat history is provided as additional context for you to interpret the user's current instruction, but you only have to generate the relevant groupings based on the user's current instruction. 
+    7. Order matters for some instructions. E.g. "Mark the task as done and show me all the completed tasks" requires the PUT request to be executed before the GET request. For each grouping, list the positions of the earlier groupings that must be executed before it. Groupings that do not depend on each other should not be listed as dependencies so that they can be executed in parallel.
 """
 
     # Note: There's this problem of the LLM splitting filter conditions into separate tasks. This is a problem because the filter conditions are part of the same task.
@@ -20,16 +28,98 @@ Follow these guidelines:
     # 2. Note that filter conditions belongs to the same task. E.g. "Show me all the users with the name John or have an age higher than 12" is one single task. Do not split this up.
 
 
+def generate_openai_selection_context_message(
+    applications: list[ApplicationContent],
+) -> str:
+    return f"""### Here are the applications that might be relevant to the user's instruction:
+
+{canonicalize_applications(applications=applications)}
+"""
+
+
 def generate_openai_selection_user_message(
-    applications: list[ApplicationContent], message: str, chat_history: list[UseMessage]
+    message: str, chat_history: list[UseMessage]
+) -> str:
+    return f"""### Here is the chat history:
+
+{render_chat_history(chat_history=chat_history)}
+
+### Here is the user's current instruction:
+
+{message}
+"""
+
+
+def generate_openai_application_selection_system_message() -> str:
+    return f"""Your task is to interpret the user's natural language instruction and select the relevant (task, application, HTTP method) groupings so that an ORM can use your output to perform specific actions on the databases of applications. The tables to use will be selected in a later step.
+
+Follow these guidelines: 
+    1. Filter conditions belongs to the same task. E.g. "Show me all the users with the name John or have an age higher than 12" is one single task. Do not split this up. 
+    2. The user's instruction may not be self-contained and you may need to refer to previous instructions to infer what the current instruction is about. However, the task segment you output should be self-contained and should not refer to previous instructions. Rephrase if necessary.
+    3. For each task, it might involve requests to multiple applications and you need to decide which subset of applications the task is related to. Use the table names listed for each application to decide.
+    4. For each application, you need to determine the appropriate HTTP methods to use given the task.
+    5. The chat history is provided as additional context for you to interpret the user's current instruction, but you only have to generate the relevant groupings based on the user's current instruction. 
+    6. Order matters for some instructions. E.g. "Mark the task as done and show me all the completed tasks" requires the PUT request to be executed before the GET request. For each grouping, list the positions of the earlier groupings that must be executed before it. Groupings that do not depend on each other should not be listed as dependencies so that they can be executed in parallel.
+"""
+
+
+def generate_openai_application_selection_context_message(
+    applications: list[ApplicationContent],
 ) -> str:
     return f"""### Here are the applications that might be relevant to the user's instruction:
 
-{[application.model_dump() for application in applications]}
+{canonicalize_application_summaries(applications=applications)}
+"""
+
+
+def generate_openai_application_selection_user_message(
+    message: str, chat_history: list[UseMessage]
+) -> str:
+    return f"""### Here is the chat history:
+
+{render_chat_history(chat_history=chat_history)}
+
+### Here is the user's current instruction:
+
+{message}
+"""
+
+
+def generate_openai_table_selection_system_message() -> str:
+    return f"""Your task is to select the table(s) of an application that each task has to be performed on so that an ORM can use your output to perform specific actions on the application's database. The application and the HTTP method of each task have already been selected.
+
+Follow these guidelines: 
+    1. Every task must be paired with at least one table.
+    2. Only pair a task with more than one table if the task cannot be performed with a single table.
+    3. The chat history is provided as additional context for you to interpret the tasks.
+"""
+
+
+def generate_openai_table_selection_context_message(
+    application: ApplicationContent,
+) -> str:
+    return f"""### Here is the application:
+
+{canonicalize_application(application=application)}
+"""
+
+
+def generate_openai_table_selection_user_message(
+    groupings: dict[int, SelectedApplicationGrouping],
+    message: str,
+    chat_history: list[UseMessage],
+) -> str:
+    tasks: dict[int, dict[str, str]] = {
+        index: grouping.model_dump(mode="json", include={"task", "http_method"})
+        for index, grouping in groupings.items()
+    }
+    return f"""### Here are the tasks to select the table(s) for, keyed by their index:
+
+{canonicalize(tasks)}
 
 ### Here is the chat history:
 
-{[message.model_dump() for message in chat_history]}
+{render_chat_history(chat_history=chat_history)}
 
 ### Here is the user's current instruction:
 
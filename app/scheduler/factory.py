@@ -0,0 +1,22 @@
+from typing import Optional
+
+from app.config import LLM_SCHEDULER_CONFIG, SchedulerConfig
+from app.scheduler.scheduler import FairScheduler
+
+_llm_scheduler: Optional[FairScheduler] = None
+
+
+def create_llm_scheduler(config: SchedulerConfig) -> FairScheduler:
+    return FairScheduler(
+        max_in_flight=config.max_in_flight,
+        default_tenant=config.default_tenant,
+        tenants=config.tenants,
+    )
+
+
+def get_llm_scheduler() -> FairScheduler:
+    """Returns the scheduler of this worker, which every stage shares."""
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        _llm_scheduler = create_llm_scheduler(config=LLM_SCHEDULER_CONFIG)
+    return _llm_scheduler
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+from pydantic import BaseModel
+
+from app.context.tenant import get_tenant_id
+from app.exceptions.exception import QuotaExceeded
+from app.metrics.metrics import METRICS
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Weight of the latest call in the EWMA of the call duration, which the Retry-After estimate is based on
+EWMA_ALPHA: float = 0.2
+
+
+class TenantConfig(BaseModel):
+    """The main class describing the share of the LLM calls of a worker that one tenant gets."""
+
+    # Backlogged tenants get calls in proportion to their weights
+    weight: float = 1
+    # The bulkhead of the tenant, which keeps its bulk jobs from taking every call of the worker
+    max_in_flight: int = 16
+    # Calls beyond this many waiting calls of the tenant are rejected with a 429 straight away
+    max_queue_depth: int = 256
+    # Calls beyond this rate are rejected with a 429. The rate is not limited if this is not set
+    calls_per_minute: Optional[int] = None
+
+
+@dataclass
+class _Waiter:
+    start_tag: float
+    finish_tag: float
+    enqueued_at: float
+    future: asyncio.Future[None]
+
+
+@dataclass
+class _Tenant:
+    config: TenantConfig
+    in_flight: int = 0
+    # Finish tag of the latest call of the tenant, which the next call of the tenant starts from
+    finish_tag: float = 0.0
+    queue: deque[_Waiter] = field(default_factory=deque)
+    tokens: float = 0.0
+    refilled_at: float = 0.0
+
+
+class FairScheduler:
+    """Shares the LLM calls of the worker between the tenants with start-time fair queuing. Every call is tagged with a virtual finish time that grows by 1 / weight with every call of its tenant, and a free slot goes to the waiting call with the earliest tag whose tenant is below its own concurrency cap. A tenant that floods the queue only pushes its own tags back, so the calls of the other tenants keep overtaking its backlog. A tenant that was idle starts from the current virtual time, so it cannot save up a burst."""
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        default_tenant: TenantConfig,
+        tenants: dict[str, TenantConfig],
+    ):
+        self._max_in_flight = max_in_flight
+        self._default_tenant = default_tenant
+        self._tenant_configs = tenants
+        self._tenants: dict[str, _Tenant] = {}
+        self._in_flight: int = 0
+        # Start tag of the latest call that was dispatched
+        self._virtual_time: float = 0.0
+        self._duration_ewma: Optional[float] = None
+
+    @asynccontextmanager
+    async def schedule(self) -> AsyncIterator[None]:
+        """Holds a slot for the call of the current tenant inside the block. Raises QuotaExceeded if the tenant is over its rate or its queue is full."""
+        tenant_id: str = get_tenant_id()
+        await self.acquire(tenant_id=tenant_id)
+        start: float = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(tenant_id=tenant_id, duration=time.monotonic() - start)
+
+    async def acquire(self, tenant_id: str) -> None:
+        """Every successful acquire must be followed by a release."""
+        tenant: _Tenant = self._get_tenant(tenant_id=tenant_id)
+        now: float = time.monotonic()
+        if len(tenant.queue) >= tenant.config.max_queue_depth:
+            self._reject(
+                tenant_id=tenant_id,
+                reason="queue_full",
+                retry_after_seconds=self._get_retry_after_seconds(tenant=tenant),
+            )
+        self._take_token(tenant_id=tenant_id, tenant=tenant, now=now)
+
+        start_tag: float = max(self._virtual_time, tenant.finish_tag)
+        tenant.finish_tag = start_tag + 1 / tenant.config.weight
+        waiter = _Waiter(
+            start_tag=start_tag,
+            finish_tag=tenant.finish_tag,
+            enqueued_at=now,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        tenant.queue.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # The call is cancelled with its request (e.g. by the deadline), and the slot goes to the next call if it was already granted
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(tenant_id=tenant_id, duration=0.0)
+            else:
+                tenant.queue.remove(waiter)
+                self._export_gauges(tenant_id=tenant_id, tenant=tenant)
+                self._forget_if_idle(tenant_id=tenant_id, tenant=tenant)
+            raise
+        METRICS.observe(
+            "llm_scheduler_queue_seconds",
+            time.monotonic() - waiter.enqueued_at,
+            labels={"tenant": tenant_id},
+        )
+
+    def release(self, tenant_id: str, duration: float) -> None:
+        tenant: _Tenant = self._tenants[tenant_id]
+        tenant.in_flight -= 1
+        self._in_flight -= 1
+        if duration:
+            self._duration_ewma = (
+                duration
+                if self._duration_ewma is None
+                else EWMA_ALPHA * duration + (1 - EWMA_ALPHA) * self._duration_ewma
+            )
+        self._export_gauges(tenant_id=tenant_id, tenant=tenant)
+        self._dispatch()
+        self._forget_if_idle(tenant_id=tenant_id, tenant=tenant)
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self._max_in_flight:
+            # Only the head of every queue is considered, as the tags of a tenant grow in the order its calls arrive
+            tenant_id: Optional[str] = min(
+                (
+                    tenant_id
+                    for tenant_id, tenant in self._tenants.items()
+                    if tenant.queue and tenant.in_flight < tenant.config.max_in_flight
+                ),
+                key=lambda tenant_id: self._tenants[tenant_id].queue[0].finish_tag,
+                default=None,
+            )
+            if tenant_id is None:
+                return
+            tenant: _Tenant = self._tenants[tenant_id]
+            waiter: _Waiter = tenant.queue.popleft()
+            tenant.in_flight += 1
+            self._in_flight += 1
+            self._virtual_time = max(self._virtual_time, waiter.start_tag)
+            waiter.future.set_result(None)
+            self._export_gauges(tenant_id=tenant_id, tenant=tenant)
+
+    def _get_tenant(self, tenant_id: str) -> _Tenant:
+        tenant: Optional[_Tenant] = self._tenants.get(tenant_id)
+        if tenant is None:
+            # Tenants are created for every tenant id that is seen, so the idle ones are dropped whenever a new one shows up to keep the state bounded
+            self._forget_idle_tenants()
+            config: TenantConfig = self._tenant_configs.get(
+                tenant_id, self._default_tenant
+            )
+            tenant = _Tenant(
+                config=config,
+                finish_tag=self._virtual_time,
+                tokens=float(config.calls_per_minute or 0),
+                refilled_at=time.monotonic(),
+            )
+            self._tenants[tenant_id] = tenant
+        return tenant
+
+    def _take_token(self, tenant_id: str, tenant: _Tenant, now: float) -> None:
+        calls_per_minute: Optional[int] = tenant.config.calls_per_minute
+        if calls_per_minute is None:
+            return
+        # A token bucket that holds a minute of calls, so that a tenant can burst up to its quota after being idle
+        tenant.tokens = min(
+            float(calls_per_minute),
+            tenant.tokens + (now - tenant.refilled_at) * calls_per_minute / 60,
+        )
+        tenant.refilled_at = now
+        if tenant.tokens < 1:
+            self._reject(
+                tenant_id=tenant_id,
+                reason="quota_exceeded",
+                retry_after_seconds=max(
+                    1, math.ceil((1 - tenant.tokens) * 60 / calls_per_minute)
+                ),
+            )
+        tenant.tokens -= 1
+
+    def _forget_if_idle(self, tenant_id: str, tenant: _Tenant) -> None:
+        if _is_idle(tenant=tenant, now=time.monotonic()):
+            del self._tenants[tenant_id]
+
+    def _forget_idle_tenants(self) -> None:
+        now: float = time.monotonic()
+        for tenant_id, tenant in list(self._tenants.items()):
+            if _is_idle(tenant=tenant, now=now):
+                del self._tenants[tenant_id]
+
+    def _reject(self, tenant_id: str, reason: str, retry_after_seconds: int) -> None:
+        METRICS.increment(
+            "llm_scheduler_rejections_total",
+            labels={"tenant": tenant_id, "reason": reason},
+        )
+        log.warning(
+            f"Rejecting LLM call of tenant {tenant_id} ({reason}), retry after {retry_after_seconds}s"
+        )
+        raise QuotaExceeded(
+            message=f"Too many LLM calls of tenant {tenant_id}, please retry later",
+            retry_after_seconds=retry_after_seconds,
+        )
+
+    def _get_retry_after_seconds(self, tenant: _Tenant) -> int:
+        # The time it takes for the calls of the tenant to drain through its own slots at the current call duration
+        if self._duration_ewma is None:
+            return 1
+        backlog: int = tenant.in_flight + len(tenant.queue)
+        return max(
+            1, math.ceil(self._duration_ewma * backlog / tenant.config.max_in_flight)
+        )
+
+    def _export_gauges(self, tenant_id: str, tenant: _Tenant) -> None:
+        METRICS.set_gauge(
+            "llm_scheduler_in_flight", tenant.in_flight, labels={"tenant": tenant_id}
+        )
+        METRICS.set_gauge(
+            "llm_scheduler_queue_length",
+            len(tenant.queue),
+            labels={"tenant": tenant_id},
+        )
+
+
+def _is_idle(tenant: _Tenant, now: float) -> bool:
+    # An idle tenant comes back at the current virtual time anyway, but a tenant with a quota is kept until its bucket is full again, so that dropping it does not hand out a fresh burst
+    if tenant.in_flight or tenant.queue:
+        return False
+    calls_per_minute: Optional[int] = tenant.config.calls_per_minute
+    return (
+        calls_per_minute is None
+        or tenant.tokens + (now - tenant.refilled_at) * calls_per_minute / 60
+        >= calls_per_minute
+    )
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import uuid
+from typing import Optional
+
+from app.cache.base import CacheBackend
+from app.cache.factory import get_state_store
+from app.config import CREATE_DRAFT_CONFIG, DraftConfig
+from app.exceptions.exception import DraftNotFound
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent
+from app.models.inference.create import (
+    ApplicationDraft,
+    ApplicationDraftVersion,
+    PatchOperation,
+)
+from app.processor.patch import apply_application_patch, diff_applications
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Bump this whenever the draft model changes, so that the drafts stored in the old shape are no longer read
+DRAFT_KEY_VERSION: str = "1"
+
+
+class ApplicationDraftStore:
+    """Keeps the application drafts of the create flow in the state store of the host, like the use sessions. Every version after the oldest one is stored as the edit operations from the version before it, which are a fraction of the size of the whole schema. Concurrent turns of the same draft are not serialised and the last one to finish wins."""
+
+    def __init__(self, cache: CacheBackend, config: DraftConfig):
+        self._cache = cache
+        self._config = config
+
+    async def create(self) -> ApplicationDraft:
+        draft = ApplicationDraft(draft_id=uuid.uuid4().hex)
+        await self.save(draft=draft)
+        log.info(f"Created application draft {draft.draft_id}")
+        return draft
+
+    async def get(self, draft_id: str) -> ApplicationDraft:
+        """Raises DraftNotFound if the draft expired or never existed."""
+        value: Optional[bytes] = await asyncio.to_thread(
+            self._cache.get, _get_key(draft_id=draft_id)
+        )
+        if value is None:
+            raise DraftNotFound(f"Application draft {draft_id} not found")
+        return ApplicationDraft.model_validate_json(value)
+
+    async def save(self, draft: ApplicationDraft) -> None:
+        # Every save renews the TTL, so only drafts that are no longer used expire
+        await asyncio.to_thread(
+            self._cache.set,
+            _get_key(draft_id=draft.draft_id),
+            draft.model_dump_json().encode(),
+            self._config.ttl_seconds,
+        )
+
+    async def delete(self, draft_id: str) -> None:
+        await asyncio.to_thread(self._cache.delete, _get_key(draft_id=draft_id))
+
+    def commit(
+        self, draft: ApplicationDraft, application: ApplicationContent
+    ) -> ApplicationDraft:
+        """Returns the draft with the application appended as its latest version. An application that is the same as the latest version is not committed again."""
+        if draft.head is not None and draft.head == application:
+            return draft
+
+        version: ApplicationDraftVersion = _get_version_to_store(
+            draft=draft, application=application
+        )
+        draft = draft.model_copy(
+            update={"versions": draft.versions + [version], "head": application}
+        )
+        dropped_count: int = len(draft.versions) - self._config.max_versions
+        if dropped_count > 0:
+            # The version that becomes the oldest one is rebuilt so that it is stored whole
+            oldest_version: int = draft.versions[dropped_count].version
+            draft = draft.model_copy(
+                update={
+                    "versions": [
+                        ApplicationDraftVersion(
+                            version=oldest_version,
+                            application_content=get_draft_version(
+                                draft=draft, version=oldest_version
+                            ),
+                        )
+                    ]
+                    + draft.versions[dropped_count + 1 :]
+                }
+            )
+        return draft
+
+
+def get_latest_version(draft: ApplicationDraft) -> Optional[int]:
+    """Returns None if nothing was committed to the draft yet."""
+    if not draft.versions:
+        return None
+    return draft.versions[-1].version
+
+
+def get_draft_version(draft: ApplicationDraft, version: int) -> ApplicationContent:
+    """Rebuilds a version by applying the edit operations of every version after the closest one that is stored whole. Raises DraftNotFound if the draft does not have the version (any longer)."""
+    if draft.head is not None and version == get_latest_version(draft=draft):
+        return draft.head
+    application: Optional[ApplicationContent] = None
+    for draft_version in draft.versions:
+        if draft_version.version > version:
+            break
+        if draft_version.application_content is not None:
+            application = draft_version.application_content
+        else:
+            application = apply_application_patch(
+                application=application, operations=draft_version.operations
+            )
+        if draft_version.version == version:
+            return application
+    raise DraftNotFound(
+        f"Version {version} of application draft {draft.draft_id} not found"
+    )
+
+
+def get_draft_operations(
+    draft: ApplicationDraft, version: int
+) -> Optional[list[PatchOperation]]:
+    """Returns the edit operations from the previous version, or None if the version is stored whole."""
+    for draft_version in draft.versions:
+        if draft_version.version == version:
+            return draft_version.operations
+    raise DraftNotFound(
+        f"Version {version} of application draft {draft.draft_id} not found"
+    )
+
+
+_application_draft_store: Optional[ApplicationDraftStore] = None
+
+
+def get_application_draft_store() -> ApplicationDraftStore:
+    """Returns the draft store of this worker, which only opens the state store when it is first used."""
+    global _application_draft_store
+    if _application_draft_store is None:
+        _application_draft_store = ApplicationDraftStore(
+            cache=get_state_store(), config=CREATE_DRAFT_CONFIG
+        )
+    return _application_draft_store
+
+
+def _get_key(draft_id: str) -> str:
+    return f"draft:{DRAFT_KEY_VERSION}:{draft_id}"
+
+
+def _get_version_to_store(
+    draft: ApplicationDraft, application: ApplicationContent
+) -> ApplicationDraftVersion:
+    version: int = (get_latest_version(draft=draft) or 0) + 1
+    if draft.head is None:
+        METRICS.increment("create_draft_versions_total", labels={"storage": "whole"})
+        return ApplicationDraftVersion(version=version, application_content=application)
+
+    operations: list[PatchOperation] = diff_applications(
+        old=draft.head, new=application
+    )
+    try:
+        is_rebuilt: bool = (
+            apply_application_patch(application=draft.head, operations=operations)
+            == application
+        )
+    except ValueError as e:
+        log.warning(f"Edit operations of draft {draft.draft_id} are invalid: {e}")
+        is_rebuilt = False
+    if not is_rebuilt:
+        # E.g. the application was renamed, or its tables were reordered
+        METRICS.increment("create_draft_versions_total", labels={"storage": "whole"})
+        return ApplicationDraftVersion(version=version, application_content=application)
+
+    METRICS.increment("create_draft_versions_total", labels={"storage": "diff"})
+    METRICS.observe("create_draft_diff_operations", len(operations))
+    return ApplicationDraftVersion(version=version, operations=operations)
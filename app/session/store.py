@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, Optional
+
+from app.cache.base import CacheBackend
+from app.cache.factory import get_state_store
+from app.config import USE_SESSION_CONFIG, SessionConfig
+from app.exceptions.exception import SessionNotFound
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent
+from app.models.inference.use import UseInferenceResponse, UseMessage, UseSession
+from app.models.message import Role
+from app.prompts.use.history import render_message
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Bump this whenever the session model changes, so that the sessions stored in the old shape are no longer read
+SESSION_KEY_VERSION: str = "1"
+
+
+class UseSessionStore:
+    """Keeps the use sessions in the state store, so that any worker on the host can serve any turn of a session. The store is local to the host, so with several hosts the turns of a session have to be routed to the host that created it. Concurrent turns of the same session are not serialised and the last one to finish wins, so clients should wait for the response of a turn before sending the next one."""
+
+    def __init__(self, cache: CacheBackend, config: SessionConfig):
+        self._cache = cache
+        self._config = config
+
+    async def create(self, applications: list[ApplicationContent]) -> UseSession:
+        session = UseSession(session_id=uuid.uuid4().hex, applications=applications)
+        await self.save(session=session)
+        METRICS.increment("use_session_requests_total", labels={"result": "created"})
+        log.info(f"Created use session {session.session_id}")
+        return session
+
+    async def get(self, session_id: str) -> UseSession:
+        """Raises SessionNotFound if the session expired or never existed."""
+        value: Optional[bytes] = await asyncio.to_thread(
+            self._cache.get, _get_key(session_id=session_id)
+        )
+        if value is None:
+            METRICS.increment("use_session_requests_total", labels={"result": "miss"})
+            raise SessionNotFound(f"Use session {session_id} not found")
+        METRICS.increment("use_session_requests_total", labels={"result": "hit"})
+        session: UseSession = UseSession.model_validate_json(value)
+        if len(session.chat_history_fragments) == len(session.chat_history):
+            for message, fragment in zip(
+                session.chat_history, session.chat_history_fragments
+            ):
+                message._prompt_fragment = fragment
+        return session
+
+    async def save(self, session: UseSession) -> None:
+        """Only the messages that were added or changed since the session was read are rendered into prompt fragments."""
+        session = session.model_copy(
+            update={
+                "chat_history_fragments": [
+                    render_message(message=message) for message in session.chat_history
+                ]
+            }
+        )
+        # Every save renews the TTL, so only sessions that are no longer used expire
+        await asyncio.to_thread(
+            self._cache.set,
+            _get_key(session_id=session.session_id),
+            session.model_dump_json().encode(),
+            self._config.ttl_seconds,
+        )
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._cache.delete, _get_key(session_id=session_id))
+
+    def attach_rows(
+        self, session: UseSession, rows: Optional[list[dict[str, Any]]]
+    ) -> UseSession:
+        """Attaches the rows returned by executing the requests of the previous turn to its response, so that the next instruction can refer to them."""
+        if rows is None or not session.chat_history:
+            return session
+        if session.chat_history[-1].role != Role.ASSISTANT:
+            return session
+        return session.model_copy(
+            update={
+                "chat_history": session.chat_history[:-1]
+                + [session.chat_history[-1].model_copy(update={"rows": rows})]
+            }
+        )
+
+    def append_turn(
+        self, session: UseSession, message: str, response: UseInferenceResponse
+    ) -> UseSession:
+        """Returns the session with the turn appended to its chat history. The history is compacted right away, so the summary is computed once per turn instead of on every prompt."""
+        chat_history: list[UseMessage] = list(session.chat_history)
+        chat_history.extend(
+            [
+                UseMessage(role=Role.USER, content=message),
+                UseMessage(
+                    role=Role.ASSISTANT, content=_describe_response(response=response)
+                ),
+            ]
+        )
+        return self._compact(
+            session=session.model_copy(update={"chat_history": chat_history})
+        )
+
+    def _compact(self, session: UseSession) -> UseSession:
+        chat_history: list[UseMessage] = session.chat_history
+        summary: Optional[str] = session.summary
+        overflow: int = len(chat_history) - self._config.max_messages
+        if overflow > 0:
+            summary = _summarize(
+                summary=summary,
+                messages=chat_history[:overflow],
+                max_lines=self._config.max_messages,
+            )
+            chat_history = chat_history[overflow:]
+            METRICS.increment("use_session_summarized_messages_total", overflow)
+
+        # The rows of the latest message are attached by the next turn, which keeps them whole while it refers to them
+        return session.model_copy(
+            update={
+                "chat_history": [
+                    _truncate_rows(
+                        message=message,
+                        max_rows=self._config.max_rows_per_message,
+                    )
+                    for message in chat_history[:-1]
+                ]
+                + chat_history[-1:],
+                "summary": summary,
+            }
+        )
+
+
+_use_session_store: Optional[UseSessionStore] = None
+
+
+def get_use_session_store() -> UseSessionStore:
+    """Returns the session store of this worker, which only opens the state store when it is first used."""
+    global _use_session_store
+    if _use_session_store is None:
+        _use_session_store = UseSessionStore(
+            cache=get_state_store(), config=USE_SESSION_CONFIG
+        )
+    return _use_session_store
+
+
+def get_chat_history(session: UseSession) -> list[UseMessage]:
+    """The chat history that is sent to the LLM, which starts with the summary of the messages that no longer fit."""
+    if not session.summary:
+        return session.chat_history
+    return [
+        UseMessage(
+            role=Role.ASSISTANT,
+            content=f"Summary of the earlier conversation:\n{session.summary}",
+        )
+    ] + session.chat_history
+
+
+def _get_key(session_id: str) -> str:
+    return f"session:{SESSION_KEY_VERSION}:{session_id}"
+
+
+def _describe_response(response: UseInferenceResponse) -> str:
+    if response.clarification:
+        return response.clarification
+    return "; ".join(
+        f"{http_method_response.http_method} {http_method_response.application.name}.{http_method_response.table_name}"
+        for http_method_response in response.response
+    )
+
+
+def _summarize(
+    summary: Optional[str], messages: list[UseMessage], max_lines: int
+) -> str:
+    """Keeps a line per instruction of the user, which is what later instructions refer back to. The oldest lines are dropped once there are more than max_lines."""
+    lines: list[str] = summary.splitlines() if summary else []
+    lines.extend(
+        f"- {message.content}" for message in messages if message.role == Role.USER
+    )
+    return "\n".join(lines[-max_lines:])
+
+
+def _truncate_rows(message: UseMessage, max_rows: int) -> UseMessage:
+    if message.rows is None or len(message.rows) <= max_rows:
+        return message
+    return message.model_copy(
+        update={
+            "content": f"{message.content} ({len(message.rows)} rows, only the first {max_rows} are shown)",
+            "rows": message.rows[:max_rows],
+        }
+    )
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from pydantic import TypeAdapter
+
+from app.cache.factory import get_cache
+from app.config import (
+    APPLICATION_CONFIG,
+    CLARIFICATION_CONFIG,
+    HTTP_REQUEST_CONFIG,
+    SELECTION_CONFIG,
+    WARMUP_CONFIG,
+    WarmupConfig,
+)
+from app.generator.create.application import ApplicationGenerator
+from app.generator.use.clarification import ClarificationGenerator
+from app.generator.use.http_request import HttpRequestGenerator
+from app.generator.use.selection import SelectionGenerator
+from app.metrics.metrics import METRICS
+from app.models.application import ApplicationContent
+from app.models.inference.use import HttpMethod, UseInferenceRequest
+from app.processor.preprocess import PreprocessedUseInferenceRequest, Preprocessor
+from app.prompts.use.functions import (
+    get_application_selection_function,
+    get_http_method_parameters_function,
+    get_selection_function,
+    get_table_selection_function,
+)
+from app.prompts.use.schema import canonicalize_applications
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Bump this whenever the application model changes, so that the application sets stored in the old shape are no longer read
+RECENT_APPLICATIONS_KEY: str = "warmup:recent_applications:1"
+
+_application_sets_adapter = TypeAdapter(list[list[ApplicationContent]])
+
+_ready = asyncio.Event()
+# Hashes of the application sets this worker already recorded, so that the shared list is only written when a new set shows up
+_recorded_application_sets: OrderedDict[str, None] = OrderedDict()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+async def warm_up(config: WarmupConfig = WARMUP_CONFIG) -> None:
+    """Warms the worker up before it reports that it is ready: the models are built (which imports the SDKs), connections to the backend are opened, and the tool schemas of the registered and recently seen applications are precompiled. A failed or slow warmup only costs the first requests their latency, so the worker reports that it is ready once the warmup is over either way."""
+    if not config.enabled:
+        _ready.set()
+        return
+
+    start: float = time.monotonic()
+    try:
+        async with asyncio.timeout(config.timeout_seconds):
+            # Building the models imports the SDKs, which app.llm keeps out of the import of app.main. The import runs in a thread, so that the worker keeps serving its liveness probe meanwhile
+            await asyncio.to_thread(_build_models)
+            from app.llm.open_ai import open_connections
+
+            try:
+                async with asyncio.TaskGroup() as task_group:
+                    task_group.create_task(
+                        open_connections(count=config.connection_count)
+                    )
+                    task_group.create_task(_precompile_tool_schemas(config=config))
+            except ExceptionGroup as e:
+                raise e.exceptions[0]
+        result: str = "success"
+    except TimeoutError:
+        result = "timeout"
+        log.warning(f"Warmup did not finish within {config.timeout_seconds}s")
+    except Exception as e:
+        result = "failure"
+        log.warning(f"Warmup failed: {e}")
+    finally:
+        _ready.set()
+
+    METRICS.increment("warmup_total", labels={"result": result})
+    METRICS.observe("warmup_seconds", time.monotonic() - start)
+    log.info(f"Worker is ready after {time.monotonic() - start:.2f}s ({result})")
+
+
+async def keep_connections_alive(config: WarmupConfig = WARMUP_CONFIG) -> None:
+    """Runs until it is cancelled. The connections are used more often than the keep-alive expiry of the pool, so that a quiet worker does not have to open them again for its next request."""
+    from app.llm.open_ai import open_connections
+
+    while True:
+        await asyncio.sleep(config.keepalive_interval_seconds)
+        try:
+            await open_connections(count=config.connection_count)
+        except Exception as e:
+            log.warning(f"Failed to keep the connections alive: {e}")
+
+
+async def record_recent_applications(
+    applications: list[ApplicationContent], config: WarmupConfig = WARMUP_CONFIG
+) -> None:
+    """Adds the application set to the recently seen sets shared by the workers on the host, so that workers that start later precompile its tool schemas. Recording is best-effort and never fails the request."""
+    if not config.enabled or not applications:
+        return
+    application_set_hash: str = hashlib.sha256(
+        canonicalize_applications(applications=applications).encode()
+    ).hexdigest()
+    if application_set_hash in _recorded_application_sets:
+        _recorded_application_sets.move_to_end(application_set_hash)
+        return
+    _recorded_application_sets[application_set_hash] = None
+    if len(_recorded_application_sets) > config.max_recent_applications:
+        _recorded_application_sets.popitem(last=False)
+
+    try:
+        await asyncio.to_thread(
+            _record_recent_applications,
+            applications=applications,
+            max_recent_applications=config.max_recent_applications,
+        )
+    except Exception as e:
+        log.warning(f"Failed to record the recent applications: {e}")
+
+
+def _record_recent_applications(
+    applications: list[ApplicationContent], max_recent_applications: int
+) -> None:
+    # The workers do not lock the list, so a set recorded by two workers at once can be dropped. It is recorded again by the next worker that sees it
+    application_sets: list[list[ApplicationContent]] = [
+        application_set
+        for application_set in _read_recent_applications()
+        if canonicalize_applications(applications=application_set)
+        != canonicalize_applications(applications=applications)
+    ]
+    application_sets = (application_sets + [applications])[-max_recent_applications:]
+    get_cache().set(
+        RECENT_APPLICATIONS_KEY, _application_sets_adapter.dump_json(application_sets)
+    )
+
+
+def _read_recent_applications() -> list[list[ApplicationContent]]:
+    value: Optional[bytes] = get_cache().get(RECENT_APPLICATIONS_KEY)
+    if value is None:
+        return []
+    return _application_sets_adapter.validate_json(value)
+
+
+def _read_registered_applications(
+    path: Optional[str],
+) -> list[list[ApplicationContent]]:
+    if path is None:
+        return []
+    with open(path) as f:
+        return _application_sets_adapter.validate_python(json.load(f))
+
+
+def _build_models() -> None:
+    for generator_type, inference_config in (
+        (SelectionGenerator, SELECTION_CONFIG),
+        (ClarificationGenerator, CLARIFICATION_CONFIG),
+        (HttpRequestGenerator, HTTP_REQUEST_CONFIG),
+        (ApplicationGenerator, APPLICATION_CONFIG),
+    ):
+        generator_type(config=inference_config)
+
+
+async def _precompile_tool_schemas(config: WarmupConfig) -> None:
+    application_sets: list[list[ApplicationContent]] = await asyncio.to_thread(
+        _read_registered_applications, path=config.applications_path
+    ) + await asyncio.to_thread(_read_recent_applications)
+    for applications in application_sets:
+        _precompile_application_set(applications=applications)
+        # Compiling a large set takes a while, so the event loop is given back between sets
+        await asyncio.sleep(0)
+    log.info(
+        f"Precompiled the tool schemas of {len(application_sets)} application sets"
+    )
+
+
+def _precompile_application_set(applications: list[ApplicationContent]) -> None:
+    # The schemas are compiled from the same views the requests compile them from, as the views are what their cache keys are built from
+    processed_input: PreprocessedUseInferenceRequest = Preprocessor().preprocess(
+        input=UseInferenceRequest(
+            applications=applications, message="", chat_history=[]
+        )
+    )
+    get_selection_function(applications=processed_input.selection_applications)
+    get_application_selection_function(
+        applications=processed_input.selection_applications
+    )
+    for application in processed_input.selection_applications:
+        get_table_selection_function(application=application)
+    for application in processed_input.http_request_applications.values():
+        for http_method in HttpMethod:
+            get_http_method_parameters_function(
+                http_method=http_method, table=application.tables[0]
+            )
@@ -0,0 +1,224 @@
+"""Compares the cost of MessagePack and JSON bodies on /inference/use: decoding a request into UseInferenceRequest the way FastAPI does, encoding a UseInferenceResponse the way the endpoint does, and the size of both bodies. Every run is appended to benchmarks/results/encoding.jsonl along with the commit it measured, so that regressions can be tracked over time.
+
+Run from the root of the repository:
+    python benchmarks/encoding.py --tables 40 --rows 200
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+ROOT_DIRECTORY: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIRECTORY)
+
+import msgpack
+from fastapi.responses import JSONResponse
+
+from app.encoding.negotiation import MessagePackResponse
+from app.models.application import ApplicationContent
+from app.models.inference.use import (
+    HttpMethod,
+    HttpMethodResponse,
+    UseInferenceRequest,
+    UseInferenceResponse,
+)
+
+RESULTS_PATH: str = os.path.join(
+    ROOT_DIRECTORY, "benchmarks", "results", "encoding.jsonl"
+)
+TABLES_PER_APPLICATION: int = 8
+COLUMNS_PER_TABLE: int = 10
+CHAT_HISTORY_LENGTH: int = 10
+REPEATS: int = 7
+
+
+def build_request(tables: int, rows: int) -> UseInferenceRequest:
+    """A request with tables spread over applications of TABLES_PER_APPLICATION tables each, and rows spread over the messages of the chat history."""
+    applications: list[dict[str, Any]] = [
+        {
+            "name": f"application_{application_index}",
+            "tables": [
+                _build_table(name=f"table_{table_index}")
+                for table_index in range(
+                    application_index * TABLES_PER_APPLICATION,
+                    min(tables, (application_index + 1) * TABLES_PER_APPLICATION),
+                )
+            ],
+        }
+        for application_index in range(-(-tables // TABLES_PER_APPLICATION))
+    ]
+    chat_history: list[dict[str, Any]] = [
+        {
+            "role": "user" if message_index % 2 == 0 else "assistant",
+            "content": f"Message {message_index} of the conversation about the tasks",
+            "rows": [
+                _build_row(index=row_index)
+                for row_index in range(rows // CHAT_HISTORY_LENGTH)
+            ],
+        }
+        for message_index in range(CHAT_HISTORY_LENGTH)
+    ]
+    return UseInferenceRequest.model_validate(
+        {
+            "applications": applications,
+            "message": "Mark every overdue task as done and list the open ones",
+            "chat_history": chat_history,
+        }
+    )
+
+
+def build_response(request: UseInferenceRequest) -> UseInferenceResponse:
+    """A response with one request per HTTP method on every table of the first application, each embedding the application like the endpoint does."""
+    application: ApplicationContent = request.applications[0]
+    return UseInferenceResponse(
+        response=[
+            HttpMethodResponse(
+                http_method=http_method,
+                application=application,
+                table_name=table.name,
+                filter_conditions={
+                    "boolean_clause": "AND",
+                    "conditions": [
+                        {"column": "status", "operator": "=", "value": "open"}
+                    ],
+                },
+            )
+            for table in application.tables
+            for http_method in (HttpMethod.GET, HttpMethod.DELETE)
+        ],
+        execution_plan=[list(range(2 * len(application.tables)))],
+    )
+
+
+def measure_seconds(function: Callable[[], Any], number: int) -> float:
+    """Returns the median seconds per call over REPEATS repeats."""
+    return (
+        statistics.median(timeit.repeat(function, number=number, repeat=REPEATS))
+        / number
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tables", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--number", type=int, default=50)
+    parser.add_argument(
+        "--no-record",
+        action="store_true",
+        help=f"Only print the results instead of appending them to {RESULTS_PATH}",
+    )
+    args = parser.parse_args()
+
+    request: UseInferenceRequest = build_request(tables=args.tables, rows=args.rows)
+    response_content: dict[str, Any] = build_response(request=request).model_dump()
+    json_body: bytes = json.dumps(request.model_dump(mode="json")).encode()
+    messagepack_body: bytes = msgpack.packb(request.model_dump(mode="json"))
+
+    # FastAPI parses a JSON body with json.loads before validating it, and the endpoints render the dumped response with JSONResponse
+    result: dict[str, Any] = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": _get_commit(),
+        "python": sys.version.split()[0],
+        "tables": args.tables,
+        "rows": args.rows,
+        "request_bytes": {"json": len(json_body), "msgpack": len(messagepack_body)},
+        "response_bytes": {
+            "json": len(JSONResponse(content=response_content).body),
+            "msgpack": len(MessagePackResponse(content=response_content).body),
+        },
+        "decode_request_ms": {
+            "json": _to_milliseconds(
+                measure_seconds(
+                    lambda: UseInferenceRequest.model_validate(json.loads(json_body)),
+                    number=args.number,
+                )
+            ),
+            "msgpack": _to_milliseconds(
+                measure_seconds(
+                    lambda: UseInferenceRequest.model_validate(
+                        msgpack.unpackb(messagepack_body)
+                    ),
+                    number=args.number,
+                )
+            ),
+        },
+        "encode_response_ms": {
+            "json": _to_milliseconds(
+                measure_seconds(
+                    lambda: JSONResponse(content=response_content),
+                    number=args.number,
+                )
+            ),
+            "msgpack": _to_milliseconds(
+                measure_seconds(
+                    lambda: MessagePackResponse(content=response_content),
+                    number=args.number,
+                )
+            ),
+        },
+    }
+    print(json.dumps(result, indent=2))
+    if not args.no_record:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, "a", encoding="utf-8") as file:
+            file.write(json.dumps(result) + "\n")
+
+
+def _build_table(name: str) -> dict[str, Any]:
+    return {
+        "name": name,
+        "description": f"Every {name} that the user keeps track of",
+        "primary_key": "auto_increment",
+        "columns": [
+            {
+                "name": "status",
+                "data_type": "enum",
+                "enum_values": ["open", "done"],
+                "default_value": "open",
+            }
+        ]
+        + [
+            {"name": f"column_{index}", "data_type": "string", "nullable": True}
+            for index in range(COLUMNS_PER_TABLE - 1)
+        ],
+    }
+
+
+def _build_row(index: int) -> dict[str, Any]:
+    return {
+        "id": index,
+        "title": f"Task number {index}",
+        "status": "open" if index % 3 else "done",
+        "priority": index % 5,
+        "estimate_hours": index * 0.25,
+        "archived": False,
+        "due_date": "2024-07-01",
+    }
+
+
+def _to_milliseconds(seconds: float) -> float:
+    return round(seconds * 1000, 4)
+
+
+def _get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Measures the cold start of the server: the time it takes to import app.main, the time from spawning the server to serving its first request and to reporting that it is ready, and its resident memory once it is warm. Every run is appended to benchmarks/results/startup.jsonl along with the commit it measured, so that regressions can be tracked over time.
+
+Run from the root of the repository:
+    python benchmarks/startup.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+ROOT_DIRECTORY: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH: str = os.path.join(
+    ROOT_DIRECTORY, "benchmarks", "results", "startup.jsonl"
+)
+# Served without touching the LLMs, so the first request only measures the boot itself
+FIRST_REQUEST_PATH: str = "/metrics"
+# Returns a 503 until the warmup is over
+READY_PATH: str = "/health/ready"
+BOOT_TIMEOUT_SECONDS: float = 60
+POLL_INTERVAL_SECONDS: float = 0.01
+# The last line of -X importtime for the imported module, e.g. "import time:   10629 |   741169 | app.main"
+IMPORT_TIME_PATTERN: re.Pattern = re.compile(r"\|\s*(\d+)\s*\|\s*app\.main\s*$")
+
+
+def measure_import_seconds() -> float:
+    """Imports app.main in a fresh interpreter, which is what every new worker pays before it can serve anything."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in reversed(result.stderr.splitlines()):
+        match: Optional[re.Match] = IMPORT_TIME_PATTERN.search(line)
+        if match:
+            return int(match.group(1)) / 1_000_000
+    raise RuntimeError("Could not find the import time of app.main")
+
+
+def measure_boot() -> tuple[float, float, Optional[int]]:
+    """Returns the seconds from spawning the server to its first served request and to it reporting that it is ready, and its resident memory in bytes once it is ready (None where /proc is not available)."""
+    port: int = _get_free_port()
+    start: float = time.monotonic()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT_DIRECTORY,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_for_success(
+            process=process, port=port, path=FIRST_REQUEST_PATH, start=start
+        )
+        first_request_seconds: float = time.monotonic() - start
+        _wait_for_success(process=process, port=port, path=READY_PATH, start=start)
+        ready_seconds: float = time.monotonic() - start
+        return (
+            first_request_seconds,
+            ready_seconds,
+            _get_resident_memory_bytes(pid=process.pid),
+        )
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--no-record",
+        action="store_true",
+        help=f"Only print the results instead of appending them to {RESULTS_PATH}",
+    )
+    args = parser.parse_args()
+
+    import_seconds: list[float] = []
+    first_request_seconds: list[float] = []
+    ready_seconds: list[float] = []
+    resident_memory_bytes: list[int] = []
+    for _ in range(args.runs):
+        import_seconds.append(measure_import_seconds())
+        first_request, ready, memory_bytes = measure_boot()
+        first_request_seconds.append(first_request)
+        ready_seconds.append(ready)
+        if memory_bytes is not None:
+            resident_memory_bytes.append(memory_bytes)
+
+    # The median, as the first run also pays for the cold disk cache
+    result: dict[str, Any] = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": _get_commit(),
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import_seconds": round(statistics.median(import_seconds), 4),
+        "first_request_seconds": round(statistics.median(first_request_seconds), 4),
+        "ready_seconds": round(statistics.median(ready_seconds), 4),
+        "resident_memory_mb": (
+            round(statistics.median(resident_memory_bytes) / 1024 / 1024, 1)
+            if resident_memory_bytes
+            else None
+        ),
+    }
+    print(json.dumps(result, indent=2))
+    if not args.no_record:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, "a", encoding="utf-8") as file:
+            file.write(json.dumps(result) + "\n")
+
+
+def _wait_for_success(
+    process: subprocess.Popen, port: int, path: str, start: float
+) -> None:
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        if time.monotonic() - start > BOOT_TIMEOUT_SECONDS:
+            raise RuntimeError(f"Server did not serve {path} in time")
+        try:
+            with urllib.request.urlopen(
+                f"http://127.0.0.1:{port}{path}", timeout=1
+            ) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def _get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get_resident_memory_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        return None
+    return None
+
+
+def _get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import pytest
+
+from app.generator.use.http_request import _estimate_row_count, _merge_inserted_rows
+from app.models.application import ApplicationContent, Table
+from app.models.inference.use import HttpMethod, HttpMethodResponse
+
+APPLICATION: ApplicationContent = ApplicationContent.model_validate(
+    {
+        "name": "todo",
+        "tables": [
+            {
+                "name": "tasks",
+                "primary_key": "auto_increment",
+                "columns": [
+                    {"name": "title", "data_type": "string", "unique": True},
+                    {"name": "notes", "data_type": "string", "nullable": True},
+                ],
+            }
+        ],
+    }
+)
+TABLE: Table = APPLICATION.tables[0]
+
+
+def _get_response(titles: list[str]) -> HttpMethodResponse:
+    return HttpMethodResponse(
+        http_method=HttpMethod.POST,
+        application=APPLICATION,
+        table_name=TABLE.name,
+        inserted_rows=[{"title": title, "notes": None} for title in titles],
+    )
+
+
+@pytest.mark.parametrize(
+    "message, row_count",
+    [
+        ("add 200 tasks", 200),
+        ("add 200 new tasks", 200),
+        ("add 50 sample rows", 50),
+        ("add 3 entries to my tasks", 3),
+        ("add these tasks:\n- buy milk\n- call mom\n- pay rent", 3),
+        ("add a task to buy milk", 1),
+    ],
+)
+def test_estimate_row_count_counts_rows(message: str, row_count: int):
+    assert _estimate_row_count(message=message, table=TABLE) == row_count
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "add an expense of 500 dollars for grocery items",
+        "add a task: call mom in 100 days about items",
+        "finish 60 entries of my journal",
+        "add a task to run 5 km",
+        "add a task due in 2 weeks",
+    ],
+)
+def test_estimate_row_count_ignores_other_numbers(message: str):
+    assert _estimate_row_count(message=message, table=TABLE) == 1
+
+
+def test_merge_inserted_rows_keeps_chunk_order():
+    merged: HttpMethodResponse = _merge_inserted_rows(
+        responses=[_get_response(titles=["a", "b"]), _get_response(titles=["c"])],
+        table=TABLE,
+        is_chunked=True,
+    )
+    assert [row["title"] for row in merged.inserted_rows] == ["a", "b", "c"]
+    assert merged.bulk_insert.row_count == 3
+    assert merged.bulk_insert.chunk_count == 2
+    assert merged.bulk_insert.duplicate_row_count == 0
+
+
+def test_merge_inserted_rows_drops_duplicate_unique_values():
+    merged: HttpMethodResponse = _merge_inserted_rows(
+        responses=[_get_response(titles=["a", "b"]), _get_response(titles=["b", "c"])],
+        table=TABLE,
+        is_chunked=True,
+    )
+    assert [row["title"] for row in merged.inserted_rows] == ["a", "b", "c"]
+    assert merged.bulk_insert.row_count == 3
+    assert merged.bulk_insert.duplicate_row_count == 1
+
+
+@pytest.mark.parametrize("responses", [[["a", "b"]], [["a", "b"], ["b", "c"]]])
+def test_merge_inserted_rows_leaves_unchunked_posts_without_summary(
+    responses: list[list[str]],
+):
+    # A POST that was not chunked has more than one response when its rows were cut off and continued
+    merged: HttpMethodResponse = _merge_inserted_rows(
+        responses=[_get_response(titles=titles) for titles in responses],
+        table=TABLE,
+        is_chunked=False,
+    )
+    assert [row["title"] for row in merged.inserted_rows] == sorted(
+        {title for titles in responses for title in titles}
+    )
+    assert merged.bulk_insert is None
@@ -0,0 +1,129 @@
+from typing import Any
+
+import pytest
+
+from app.processor.filter import (
+    FALSE_FILTER_CONDITIONS,
+    TRUE_FILTER_CONDITIONS,
+    optimize_filter_conditions,
+)
+
+
+def _predicate(column: str, operator: str, value: Any) -> dict[str, Any]:
+    return {"column": column, "operator": operator, "value": value}
+
+
+def _clause(boolean_clause: str, *conditions: dict[str, Any]) -> dict[str, Any]:
+    return {"boolean_clause": boolean_clause, "conditions": list(conditions)}
+
+
+@pytest.mark.parametrize(
+    "filter_conditions",
+    [
+        _clause(
+            "AND", _predicate("status", "=", "todo"), _predicate("status", "=", "done")
+        ),
+        _clause(
+            "AND",
+            _predicate("priority", "IN", [1, 2]),
+            _predicate("priority", "!=", 1),
+            _predicate("priority", "!=", 2),
+        ),
+        _clause("AND", _predicate("priority", ">", 5), _predicate("priority", "<", 3)),
+        _clause("AND", _predicate("priority", ">=", 3), _predicate("priority", "<", 3)),
+        _clause("AND", _predicate("priority", "IN", [])),
+        _clause("AND", _predicate("title", "=", "a"), FALSE_FILTER_CONDITIONS),
+    ],
+)
+def test_contradictions_fold_into_an_empty_or(filter_conditions: dict[str, Any]):
+    assert optimize_filter_conditions(filter_conditions=filter_conditions) == (
+        FALSE_FILTER_CONDITIONS
+    )
+
+
+@pytest.mark.parametrize(
+    "filter_conditions",
+    [
+        _clause("AND"),
+        _clause("OR", _predicate("title", "=", "a"), TRUE_FILTER_CONDITIONS),
+        _clause("AND", TRUE_FILTER_CONDITIONS, _clause("AND")),
+    ],
+)
+def test_tautologies_fold_into_an_empty_and(filter_conditions: dict[str, Any]):
+    assert optimize_filter_conditions(filter_conditions=filter_conditions) == (
+        TRUE_FILTER_CONDITIONS
+    )
+
+
+def test_predicates_that_differ_only_on_null_rows_are_not_a_tautology():
+    assert optimize_filter_conditions(
+        filter_conditions=_clause(
+            "OR", _predicate("status", "=", "done"), _predicate("status", "!=", "done")
+        )
+    ) == _clause(
+        "OR", _predicate("status", "!=", "done"), _predicate("status", "=", "done")
+    )
+
+
+def test_null_predicates_are_never_folded():
+    optimized: dict[str, Any] = optimize_filter_conditions(
+        filter_conditions=_clause(
+            "AND", _predicate("priority", "=", None), _predicate("priority", "=", 1)
+        )
+    )
+    assert optimized != FALSE_FILTER_CONDITIONS
+    assert _predicate("priority", "=", None) in optimized["conditions"]
+    assert optimize_filter_conditions(
+        filter_conditions=_clause(
+            "OR", _predicate("priority", "=", None), _predicate("priority", "=", 1)
+        )
+    )["conditions"] == [
+        _predicate("priority", "=", 1),
+        _predicate("priority", "=", None),
+    ]
+
+
+def test_equalities_on_a_column_fold_into_in():
+    assert optimize_filter_conditions(
+        filter_conditions=_clause(
+            "OR",
+            _predicate("priority", "=", 2),
+            _predicate("priority", "=", 1),
+            _predicate("priority", "IN", [3, 1]),
+        )
+    ) == _clause("AND", _predicate("priority", "IN", [1, 2, 3]))
+
+
+def test_membership_is_intersected_with_exclusions_and_ranges():
+    assert optimize_filter_conditions(
+        filter_conditions=_clause(
+            "AND",
+            _predicate("priority", "IN", [1, 2, 3]),
+            _predicate("priority", "!=", 2),
+            _predicate("priority", ">", 1),
+        )
+    ) == _clause("AND", _predicate("priority", "=", 3))
+
+
+def test_equivalent_filters_are_identical():
+    first: dict[str, Any] = _clause(
+        "AND",
+        _predicate("title", "LIKE", "%milk%"),
+        _clause("AND", _predicate("status", "=", "todo")),
+        _predicate("title", "LIKE", "%milk%"),
+    )
+    second: dict[str, Any] = _clause(
+        "AND", _predicate("status", "=", "todo"), _predicate("title", "LIKE", "%milk%")
+    )
+    assert optimize_filter_conditions(
+        filter_conditions=first
+    ) == optimize_filter_conditions(filter_conditions=second)
+
+
+def test_booleans_are_not_folded_with_numbers():
+    optimized: dict[str, Any] = optimize_filter_conditions(
+        filter_conditions=_clause(
+            "AND", _predicate("archived", "=", True), _predicate("archived", "=", 1)
+        )
+    )
+    assert optimized == FALSE_FILTER_CONDITIONS
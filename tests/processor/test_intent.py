@@ -0,0 +1,84 @@
+from typing import Optional
+
+import pytest
+
+from app.config import FAST_PATH_CONFIG
+from app.models.application import ApplicationContent
+from app.models.inference.use import HttpMethod
+from app.processor.intent import FastPathMatch, IntentMatcher
+
+APPLICATIONS: list[ApplicationContent] = [
+    ApplicationContent.model_validate(
+        {
+            "name": "todo",
+            "tables": [
+                {
+                    "name": "tasks",
+                    "primary_key": "auto_increment",
+                    "columns": [
+                        {"name": "title", "data_type": "string"},
+                        {
+                            "name": "status",
+                            "data_type": "enum",
+                            "enum_values": ["todo", "done"],
+                            "default_value": "todo",
+                        },
+                    ],
+                }
+            ],
+        }
+    )
+]
+
+
+def _match(message: str) -> Optional[FastPathMatch]:
+    return IntentMatcher(
+        applications=APPLICATIONS,
+        confidence_threshold=FAST_PATH_CONFIG.confidence_threshold,
+    ).match(message=message)
+
+
+def _get_id_filter(value: int) -> dict:
+    return {
+        "boolean_clause": "AND",
+        "conditions": [{"column": "id", "operator": "=", "value": value}],
+    }
+
+
+@pytest.mark.parametrize(
+    "message",
+    ["delete task 3", "delete task #3", "delete task number 3", "delete task id 3"],
+)
+def test_identifier_after_table_or_prefix_resolves_row(message: str):
+    fast_path_match: Optional[FastPathMatch] = _match(message=message)
+    assert fast_path_match is not None
+    assert fast_path_match.confidence == 1.0
+    assert fast_path_match.http_method_responses[0].http_method == HttpMethod.DELETE
+    assert fast_path_match.http_method_responses[0].filter_conditions == _get_id_filter(
+        value=3
+    )
+
+
+@pytest.mark.parametrize(
+    "message", ["delete 3 tasks", "show tasks from 2023", "show 10 tasks"]
+)
+def test_bare_number_is_not_an_identifier(message: str):
+    fast_path_match: Optional[FastPathMatch] = _match(message=message)
+    # The table is still selected, but the request parameters are left to the LLM
+    if fast_path_match is not None:
+        assert fast_path_match.http_method_responses is None
+        assert fast_path_match.confidence < 1.0
+
+
+def test_show_all_rows_resolves_without_filter():
+    fast_path_match: Optional[FastPathMatch] = _match(message="show all tasks")
+    assert fast_path_match is not None
+    assert fast_path_match.http_method_responses[0].filter_conditions == {
+        "boolean_clause": "AND",
+        "conditions": [],
+    }
+
+
+def test_delete_without_identifier_is_not_resolved():
+    fast_path_match: Optional[FastPathMatch] = _match(message="delete all tasks")
+    assert fast_path_match is None or fast_path_match.http_method_responses is None
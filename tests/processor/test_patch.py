@@ -0,0 +1,102 @@
+import pytest
+
+from app.models.application import ApplicationContent
+from app.models.inference.create import PatchOperation, PatchOperationType
+from app.processor.patch import apply_application_patch
+
+APPLICATION: ApplicationContent = ApplicationContent.model_validate(
+    {
+        "name": "todo",
+        "tables": [
+            {
+                "name": "projects",
+                "primary_key": "auto_increment",
+                "columns": [
+                    {"name": "name", "data_type": "string", "unique": True},
+                ],
+            },
+            {
+                "name": "tasks",
+                "primary_key": "auto_increment",
+                "columns": [
+                    {"name": "title", "data_type": "string"},
+                    {
+                        "name": "project_name",
+                        "data_type": "string",
+                        "foreign_key": {"table": "projects", "column": "name"},
+                    },
+                ],
+            },
+        ],
+    }
+)
+
+
+def test_alter_column_renames_referencing_foreign_keys():
+    application: ApplicationContent = apply_application_patch(
+        application=APPLICATION,
+        operations=[
+            PatchOperation(
+                operation=PatchOperationType.ALTER_COLUMN,
+                table_name="projects",
+                column_name="name",
+                changes={"name": "Title"},
+            )
+        ],
+    )
+    assert [column.name for column in application.tables[0].columns] == ["title"]
+    foreign_key = application.tables[1].columns[1].foreign_key
+    assert (foreign_key.table, foreign_key.column) == ("projects", "title")
+
+
+def test_alter_column_keeps_foreign_keys_to_other_tables():
+    # tasks.title shares its name with the column that projects.name is renamed to, but is not referenced
+    application: ApplicationContent = apply_application_patch(
+        application=APPLICATION,
+        operations=[
+            PatchOperation(
+                operation=PatchOperationType.ALTER_COLUMN,
+                table_name="tasks",
+                column_name="title",
+                changes={"name": "name"},
+            )
+        ],
+    )
+    foreign_key = application.tables[1].columns[1].foreign_key
+    assert (foreign_key.table, foreign_key.column) == ("projects", "name")
+
+
+@pytest.mark.parametrize(
+    "operation",
+    [
+        PatchOperation(
+            operation=PatchOperationType.ALTER_TABLE,
+            table_name="tasks",
+            changes={"name": "Projects"},
+        ),
+        PatchOperation(
+            operation=PatchOperationType.ALTER_COLUMN,
+            table_name="tasks",
+            column_name="title",
+            changes={"name": "project_name"},
+        ),
+    ],
+)
+def test_rename_rejects_existing_names(operation: PatchOperation):
+    with pytest.raises(ValueError, match="already exists"):
+        apply_application_patch(application=APPLICATION, operations=[operation])
+
+
+def test_alter_table_renames_referencing_foreign_keys():
+    application: ApplicationContent = apply_application_patch(
+        application=APPLICATION,
+        operations=[
+            PatchOperation(
+                operation=PatchOperationType.ALTER_TABLE,
+                table_name="projects",
+                changes={"name": "boards"},
+            )
+        ],
+    )
+    assert application.tables[0].name == "boards"
+    assert application.tables[1].columns[1].foreign_key.table == "boards"
@@ -0,0 +1,141 @@
+from typing import Any, Optional
+
+import pytest
+
+from app.models.application import ApplicationContent, Table
+from app.models.inference.use import HttpMethod, HttpMethodResponse, SqlStatement
+from app.processor.filter import TRUE_FILTER_CONDITIONS
+from app.processor.sql import compile_sql_statement
+
+APPLICATION: ApplicationContent = ApplicationContent.model_validate(
+    {
+        "name": "todo",
+        "tables": [
+            {
+                "name": "tasks",
+                "primary_key": "auto_increment",
+                "columns": [
+                    {"name": "title", "data_type": "string"},
+                    {"name": "priority", "data_type": "integer", "nullable": True},
+                    {"name": "status", "data_type": "string", "default_value": "todo"},
+                ],
+            }
+        ],
+    }
+)
+TABLE: Table = APPLICATION.tables[0]
+
+
+def _compile(
+    http_method: HttpMethod,
+    filter_conditions: Optional[dict[str, Any]] = None,
+    updated_data: Optional[dict[str, Any]] = None,
+    inserted_rows: Optional[list[dict[str, Any]]] = None,
+) -> SqlStatement:
+    return compile_sql_statement(
+        response=HttpMethodResponse(
+            http_method=http_method,
+            application=APPLICATION,
+            table_name=TABLE.name,
+            filter_conditions=filter_conditions,
+            updated_data=updated_data,
+            inserted_rows=inserted_rows,
+        ),
+        table=TABLE,
+    )
+
+
+def _get_filter(*conditions: dict[str, Any], boolean_clause: str = "AND") -> dict:
+    return {"boolean_clause": boolean_clause, "conditions": list(conditions)}
+
+
+def test_placeholders_are_numbered_across_set_and_where():
+    statement: SqlStatement = _compile(
+        http_method=HttpMethod.PUT,
+        updated_data={"status": "done", "title": "Buy milk"},
+        filter_conditions=_get_filter(
+            {"column": "priority", "operator": ">=", "value": 2},
+            {"column": "status", "operator": "!=", "value": "done"},
+        ),
+    )
+    assert statement.template == (
+        'UPDATE "tasks" SET "title" = $1, "status" = $2'
+        ' WHERE "priority" >= $3 AND "status" <> $4'
+    )
+    assert statement.parameters == ["Buy milk", "done", 2, "done"]
+
+
+def test_missing_columns_of_inserted_rows_take_their_default():
+    statement: SqlStatement = _compile(
+        http_method=HttpMethod.POST,
+        inserted_rows=[{"title": "a", "status": "done"}, {"title": "b"}],
+    )
+    assert statement.template == (
+        'INSERT INTO "tasks" ("title", "status") VALUES ($1, $2), ($3, DEFAULT)'
+    )
+    assert statement.parameters == ["a", "done", "b"]
+
+
+def test_in_is_compiled_into_any_with_one_parameter():
+    statement: SqlStatement = _compile(
+        http_method=HttpMethod.GET,
+        filter_conditions=_get_filter(
+            {"column": "id", "operator": "IN", "value": [1, 2, 3]}
+        ),
+    )
+    assert statement.template == 'SELECT * FROM "tasks" WHERE "id" = ANY($1)'
+    assert statement.parameters == [[1, 2, 3]]
+
+
+def test_null_comparisons_are_compiled_into_is_null():
+    statement: SqlStatement = _compile(
+        http_method=HttpMethod.DELETE,
+        filter_conditions=_get_filter(
+            {"column": "priority", "operator": "=", "value": None},
+            {"column": "title", "operator": "!=", "value": None},
+            boolean_clause="OR",
+        ),
+    )
+    assert statement.template == (
+        'DELETE FROM "tasks" WHERE "priority" IS NULL OR "title" IS NOT NULL'
+    )
+    assert statement.parameters == []
+
+
+def test_template_only_depends_on_the_shape_of_the_request():
+    statements: list[SqlStatement] = [
+        _compile(
+            http_method=HttpMethod.GET,
+            filter_conditions=_get_filter(
+                {"column": "title", "operator": "LIKE", "value": value}
+            ),
+        )
+        for value in ("%milk%", "%bread%")
+    ]
+    assert statements[0].fingerprint == statements[1].fingerprint
+    assert statements[0].parameters != statements[1].parameters
+
+
+@pytest.mark.parametrize("http_method", [HttpMethod.PUT, HttpMethod.DELETE])
+@pytest.mark.parametrize("filter_conditions", [None, {}])
+def test_writes_without_filter_conditions_are_rejected(
+    http_method: HttpMethod, filter_conditions: Optional[dict[str, Any]]
+):
+    with pytest.raises(ValueError):
+        _compile(
+            http_method=http_method,
+            filter_conditions=filter_conditions,
+            updated_data={"status": "done"},
+        )
+
+
+def test_writes_that_match_every_row_explicitly_are_unfiltered():
+    statement: SqlStatement = _compile(
+        http_method=HttpMethod.DELETE, filter_conditions=TRUE_FILTER_CONDITIONS
+    )
+    assert statement.template == 'DELETE FROM "tasks"'
+
+
+def test_reads_without_filter_conditions_are_unfiltered():
+    statement: SqlStatement = _compile(http_method=HttpMethod.GET)
+    assert statement.template == 'SELECT * FROM "tasks"'
@@ -0,0 +1,58 @@
+import pytest
+
+from app.models.application import ApplicationContent
+from app.models.inference.use import SelectedTable, TableSelectionResponse
+from app.processor.validation import validate_table_selection_response
+
+APPLICATION: ApplicationContent = ApplicationContent.model_validate(
+    {
+        "name": "todo",
+        "tables": [
+            {
+                "name": "tasks",
+                "primary_key": "auto_increment",
+                "columns": [{"name": "title", "data_type": "string"}],
+            },
+            {
+                "name": "projects",
+                "primary_key": "auto_increment",
+                "columns": [{"name": "name", "data_type": "string"}],
+            },
+        ],
+    }
+)
+
+
+def _response(*selected_tables: tuple[int, str]) -> TableSelectionResponse:
+    return TableSelectionResponse(
+        selected_tables=[
+            SelectedTable(grouping_index=grouping_index, table_name=table_name)
+            for grouping_index, table_name in selected_tables
+        ]
+    )
+
+
+def test_validate_table_selection_response_accepts_covered_tasks():
+    validate_table_selection_response(
+        response=_response((2, "tasks"), (5, "projects"), (5, "tasks")),
+        application=APPLICATION,
+        grouping_indices=[2, 5],
+    )
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        # Unknown table
+        _response((2, "tasks"), (5, "users")),
+        # Unknown task, which belongs to another application
+        _response((2, "tasks"), (5, "projects"), (3, "tasks")),
+        # Task 5 is left without a table
+        _response((2, "tasks")),
+    ],
+)
+def test_validate_table_selection_response_rejects(response: TableSelectionResponse):
+    with pytest.raises(ValueError):
+        validate_table_selection_response(
+            response=response, application=APPLICATION, grouping_indices=[2, 5]
+        )